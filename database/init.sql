@@ -7,12 +7,26 @@ CREATE TABLE person (
     city VARBINARY(255) NOT NULL,
     phone_number VARBINARY(255) NOT NULL,
     private_key VARBINARY(255) NOT NULL,
+    key_version INT UNSIGNED NOT NULL DEFAULT 0,
     decrypt_frequency VARBINARY(255) NOT NULL
 );
 
 CREATE TABLE person_refresh_token (
     id SERIAL PRIMARY KEY,
-    token VARCHAR(255) NOT NULL,
+    token_digest BINARY(32) NOT NULL UNIQUE,
     person_id BIGINT UNSIGNED NOT NULL,
+    expires_at BIGINT UNSIGNED NOT NULL,
+    INDEX (expires_at),
     FOREIGN KEY (person_id) REFERENCES person(id) ON DELETE CASCADE
 );
+
+-- the migrations of database/migrations/ this schema already includes
+CREATE TABLE schema_migration (
+    version INT UNSIGNED PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO schema_migration (version, name) VALUES
+    (1, 'person_key_version'),
+    (2, 'person_refresh_token_digest');
@@ -0,0 +1,3 @@
+-- the version of the master key each subkey is wrapped under, see
+-- server/app/rotate_master_key.py. Existing subkeys are under version 0
+ALTER TABLE person ADD COLUMN key_version INT UNSIGNED NOT NULL DEFAULT 0 AFTER private_key;
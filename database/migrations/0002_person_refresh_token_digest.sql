@@ -0,0 +1,14 @@
+-- refresh tokens are stored as their SHA-256 digest with an indexed expiry, see
+-- server/app/refresh_token_sweeper.py. The raw tokens stored before cannot be
+-- carried over, so the table is recreated: EVERY USER IS LOGGED OUT and has to
+-- log in again once their access token expires
+DROP TABLE person_refresh_token;
+
+CREATE TABLE person_refresh_token (
+    id SERIAL PRIMARY KEY,
+    token_digest BINARY(32) NOT NULL UNIQUE,
+    person_id BIGINT UNSIGNED NOT NULL,
+    expires_at BIGINT UNSIGNED NOT NULL,
+    INDEX (expires_at),
+    FOREIGN KEY (person_id) REFERENCES person(id) ON DELETE CASCADE
+);
@@ -9,6 +9,7 @@ import {
     TableHeader,
     TableRow,
 } from "@/components/ui/table";
+import {Button} from "@/components/ui/button";
 import React from "react";
 import {getCookie} from "cookies-next/client";
 import {toast} from "sonner";
@@ -24,65 +25,93 @@ interface Person {
 
 export default function Page() {
     const [persons, setPersons] = React.useState<Person[]>([]);
+    // the after_id of the next page, null once the last page is loaded
+    const [nextAfterId, setNextAfterId] = React.useState<string | null>(null);
+    const [isLoading, setIsLoading] = React.useState(false);
 
-    React.useEffect(() => {
+    // the endpoint is paginated, load one page and remember X-Next-After-Id
+    const fetchPage = React.useCallback(async (afterId: string | null) => {
         const personsEndpoint =
             process.env.NEXT_PUBLIC_API_ENDPOINT + "/persons";
         const token = getCookie("access_token")!.valueOf();
         const toastId = toast.loading("Fetching persons...");
+        setIsLoading(true);
 
-        fetch(personsEndpoint, {
-            method: "GET",
-            headers: {
-                "Content-Type": "application/json",
-                Authorization: "Bearer " + token,
-            },
-            credentials: "include",
-        })
-            .then((response) => {
-                if (response.status === 200) {
-                    return response.json();
-                } else {
-                    throw new Error("Failed to fetch persons.");
-                }
-            })
-            .then((data) => {
-                setPersons(data);
-            })
-            .catch((err) => {
-                console.error("Failed to fetch persons", err);
-            })
-            .finally(() => {
-                toast.dismiss(toastId);
+        const url =
+            afterId === null
+                ? personsEndpoint
+                : personsEndpoint + "?after_id=" + afterId;
+        try {
+            const response = await fetch(url, {
+                method: "GET",
+                headers: {
+                    "Content-Type": "application/json",
+                    Authorization: "Bearer " + token,
+                },
+                credentials: "include",
             });
+            if (response.status !== 200) {
+                throw new Error("Failed to fetch persons.");
+            }
+
+            const page: Person[] = await response.json();
+            setPersons((loaded) =>
+                afterId === null ? page : loaded.concat(page)
+            );
+            setNextAfterId(response.headers.get("X-Next-After-Id"));
+        } catch (err) {
+            console.error("Failed to fetch persons", err);
+        } finally {
+            setIsLoading(false);
+            toast.dismiss(toastId);
+        }
     }, []);
+
+    React.useEffect(() => {
+        fetchPage(null);
+    }, [fetchPage]);
+
     return (
-        <Table>
-            <TableCaption>A list of persons.</TableCaption>
-            <TableHeader>
-                <TableRow>
-                    <TableHead className="w-[100px]">ID</TableHead>
-                    <TableHead>Username</TableHead>
-                    <TableHead>Email</TableHead>
-                    <TableHead>Gender</TableHead>
-                    <TableHead>City</TableHead>
-                    <TableHead>Phone number</TableHead>
-                </TableRow>
-            </TableHeader>
-            <TableBody>
-                {persons.map((person) => (
-                    <TableRow key={person.id}>
-                        <TableCell className="font-medium">
-                            {person.id}
-                        </TableCell>
-                        <TableCell>{person.username}</TableCell>
-                        <TableCell>{person.email}</TableCell>
-                        <TableCell>{person.gender}</TableCell>
-                        <TableCell>{person.city}</TableCell>
-                        <TableCell>{person.phone_number}</TableCell>
+        <div className="flex flex-col gap-4">
+            <Table>
+                <TableCaption>A list of persons.</TableCaption>
+                <TableHeader>
+                    <TableRow>
+                        <TableHead className="w-[100px]">ID</TableHead>
+                        <TableHead>Username</TableHead>
+                        <TableHead>Email</TableHead>
+                        <TableHead>Gender</TableHead>
+                        <TableHead>City</TableHead>
+                        <TableHead>Phone number</TableHead>
                     </TableRow>
-                ))}
-            </TableBody>
-        </Table>
+                </TableHeader>
+                <TableBody>
+                    {persons.map((person) => (
+                        <TableRow key={person.id}>
+                            <TableCell className="font-medium">
+                                {person.id}
+                            </TableCell>
+                            <TableCell>{person.username}</TableCell>
+                            <TableCell>{person.email}</TableCell>
+                            <TableCell>{person.gender}</TableCell>
+                            <TableCell>{person.city}</TableCell>
+                            <TableCell>{person.phone_number}</TableCell>
+                        </TableRow>
+                    ))}
+                </TableBody>
+            </Table>
+            {nextAfterId !== null && (
+                <Button
+                    variant="outline"
+                    className="self-center"
+                    disabled={isLoading}
+                    onClick={() => {
+                        fetchPage(nextAfterId);
+                    }}
+                >
+                    Load more
+                </Button>
+            )}
+        </div>
     );
 }
@@ -0,0 +1,195 @@
+"""
+Decrypt-event counter.
+
+Every time a user reads their own row it counts as a decryption, and after
+subkey_rotation_counter of them the subkey is rotated. Writing the count back on
+every read made a read endpoint pay a seal and a committed UPDATE, so the events
+are counted in memory here and written in batches by a background task.
+
+A crash loses at most flush_interval seconds (or max_pending events) of counts,
+which delays a rotation by that many reads but never skips one for good.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+
+logger = logging.getLogger("uvicorn")
+
+# (person id, subkey, wrapped subkey as stored, count to store)
+FlushRow = Tuple[int, bytes, bytes, int]
+
+
+class _Entry:
+    __slots__ = ("private_key", "wrapped_key", "base", "pending")
+
+    def __init__(self, private_key: bytes, wrapped_key: bytes, base: int):
+        # the subkey the count is sealed under
+        self.private_key = private_key
+        # the stored subkey, guards the write against a concurrent rotation
+        self.wrapped_key = wrapped_key
+        # count stored in the database
+        self.base = base
+        # events not written yet
+        self.pending = 0
+
+
+class AccessCounter:
+    """
+    flush writes a batch of counts, rotate rotates the subkey of one person.
+    Both run on the event loop; start and stop are called by the app lifespan.
+    """
+
+    def __init__(
+        self,
+        threshold: int,
+        flush: Callable[[List[FlushRow]], Awaitable[None]],
+        rotate: Callable[[int], Awaitable[None]],
+        flush_interval: float,
+        max_pending: int,
+    ):
+        self._threshold = threshold
+        self._flush_fn = flush
+        self._rotate_fn = rotate
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+
+        self._entries: Dict[int, _Entry] = {}
+        self._pending = 0
+        self._rotating: Set[int] = set()
+        self._rotation_tasks: Set[asyncio.Task] = set()
+
+        self._task: asyncio.Task | None = None
+        self._wake: asyncio.Event | None = None
+        self._flush_lock: asyncio.Lock | None = None
+
+        self._recorded = 0
+        self._flushes = 0
+        self._flushed = 0
+        self._flush_failures = 0
+        self._last_flush_ms = 0.0
+        self._rotations = 0
+        self._rotation_failures = 0
+
+    async def start(self):
+        # bound to the running loop
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write what is pending and wait for running rotations"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._rotation_tasks:
+            await asyncio.gather(*self._rotation_tasks, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def record(self, id: int, private_key: bytes, wrapped_key: bytes, stored: int):
+        """
+        Count one decryption of the row of person id, whose decrypt_frequency
+        read as stored. Starts the rotation when the count passes the threshold.
+        """
+        if id in self._rotating:
+            # the row is being re-encrypted, its count restarts from zero
+            return
+
+        entry = self._entries.get(id)
+        if entry is None or entry.wrapped_key != wrapped_key:
+            # new, or the subkey changed since: counts under the old one are moot
+            if entry is not None:
+                self._pending -= entry.pending
+            entry = self._entries[id] = _Entry(private_key, wrapped_key, stored)
+        else:
+            # the row may have been read before the last flush of this entry
+            entry.base = max(entry.base, stored)
+
+        entry.pending += 1
+        self._pending += 1
+        self._recorded += 1
+
+        if entry.base + entry.pending > self._threshold:
+            del self._entries[id]
+            self._pending -= entry.pending
+            self._rotating.add(id)
+            task = asyncio.create_task(self._rotate(id))
+            self._rotation_tasks.add(task)
+            task.add_done_callback(self._rotation_tasks.discard)
+        elif self._pending >= self._max_pending:
+            self._wake.set()
+
+    async def _rotate(self, id: int):
+        try:
+            await self._rotate_fn(id)
+            self._rotations += 1
+        except Exception:
+            self._rotation_failures += 1
+            logger.exception(f"Rotating the subkey of person {id} failed")
+        finally:
+            self._rotating.discard(id)
+
+    async def flush(self):
+        async with self._flush_lock:
+            batch = [
+                (id, entry, entry.pending)
+                for id, entry in self._entries.items()
+                if entry.pending
+            ]
+            if not batch:
+                return
+
+            start = time.perf_counter()
+            try:
+                await self._flush_fn(
+                    [
+                        (id, entry.private_key, entry.wrapped_key, entry.base + count)
+                        for id, entry, count in batch
+                    ]
+                )
+            except Exception:
+                # keep the counts, the next flush retries
+                self._flush_failures += 1
+                logger.exception("Writing decrypt counts failed")
+                return
+
+            self._flushes += 1
+            self._last_flush_ms = 1000 * (time.perf_counter() - start)
+            for id, entry, count in batch:
+                self._flushed += count
+                entry.base += count
+                entry.pending -= count
+                if self._entries.get(id) is not entry:
+                    # dropped for a rotation meanwhile, pending was settled then
+                    continue
+                self._pending -= count
+                if entry.pending == 0:
+                    del self._entries[id]
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "entries": len(self._entries),
+            "recorded": self._recorded,
+            "flushes": self._flushes,
+            "flushed": self._flushed,
+            "flush_failures": self._flush_failures,
+            "last_flush_ms": self._last_flush_ms,
+            "rotating": len(self._rotating),
+            "rotations": self._rotations,
+            "rotation_failures": self._rotation_failures,
+        }
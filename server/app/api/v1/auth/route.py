@@ -1,82 +1,108 @@
 import datetime
-from types import NoneType
-import bcrypt
-from fastapi import APIRouter, Request
+import secrets
+import time
+from typing import Tuple
+from fastapi import APIRouter, BackgroundTasks, Request
 import logging
 import jwt
 
 from fastapi.responses import JSONResponse
-from mysql.connector.types import RowType
 
 from app.api.v1.auth.model import LoginModel
-from app.preload import settings, mydb
+from app.api.v1.auth.service import (
+    token_cache,
+    token_digest,
+    token_log_id,
+    verify_authorization,
+)
+from app.password_hasher import PasswordHasherBusy
+from app.preload import password_hasher, repository, settings
 
 
 api_router = APIRouter(prefix="/auth")
 
 
-def create_token(id: int, username: str, duration: int):
+def create_token(
+    id: int,
+    username: str,
+    duration: int,
+    iat: datetime.datetime | None = None,
+    jti: str | None = None,
+):
     """
     create a token with the given data and duration (in minutes)
     """
-    iat = datetime.datetime.now(tz=datetime.timezone.utc)
+    iat = iat or datetime.datetime.now(tz=datetime.timezone.utc)
     exp = iat + datetime.timedelta(minutes=duration)
 
-    return jwt.encode(
-        {
-            "id": id,
-            "username": username,
-            "iat": iat,
-            "exp": exp,
-        },
-        settings.jwt_secret,
-        algorithm="HS256",
+    payload = {
+        "id": id,
+        "username": username,
+        "iat": iat,
+        "exp": exp,
+    }
+    if jti is not None:
+        payload["jti"] = jti
+
+    return jwt.encode(payload, settings.jwt_secret, algorithm="HS256")
+
+
+def create_refresh_token(id: int, username: str) -> Tuple[str, int]:
+    """
+    create a refresh token, returns it with its expiry as Unix time. Only its
+    digest is stored, the random jti tells apart two tokens issued in one second
+    """
+    iat = datetime.datetime.now(tz=datetime.timezone.utc)
+    refresh_token = create_token(
+        id, username, settings.rt_duration_minutes, iat, secrets.token_hex(16)
     )
+    exp = iat + datetime.timedelta(minutes=settings.rt_duration_minutes)
+    return refresh_token, int(exp.timestamp())
 
 
-@api_router.post("/login")
-async def login(login_data: LoginModel):
+async def _rehash_password(id: int, password: bytes, hashed: str):
+    """Store password hashed with the current cost, unless it changed meanwhile"""
     logger = logging.getLogger("uvicorn")
 
-    sql = "SELECT id, username, password FROM person WHERE email = %s"
-    val = (login_data.email,)
-    mycursor = mydb.cursor()
-    mycursor.execute(sql, val)
-    result = mycursor.fetchone()
-    if (
-        type(result) is not NoneType
-        and type(result) is not RowType
-        and type(result) is not tuple
-    ):
-        logger.debug(f"Invalid result type: {type(result)}")
-        return JSONResponse(
-            status_code=500, content={"message": "Internal server error"}
-        )
+    try:
+        rehashed = await password_hasher.rehash(password)
+    except PasswordHasherBusy:
+        # the next login tries again
+        logger.debug(f"Skipping the rehash of the password of user {id}")
+        return
+    await repository.update_password(id, hashed, rehashed.decode("utf-8"))
+
+
+@api_router.post("/login")
+async def login(login_data: LoginModel, background_tasks: BackgroundTasks):
+    logger = logging.getLogger("uvicorn")
 
-    if not result or type(result) is NoneType:
+    result = await repository.find_person_by_email(login_data.email)
+    if not result:
         logger.debug("User not found")
         return JSONResponse(status_code=400, content={"message": "Auth failed"})
 
     # make it str
-    hashed = str(result[2])
+    hashed = str(result["password"])
     password_bytes = login_data.password.encode("utf-8")
     hashed_bytes = hashed.encode("utf-8")
 
-    if not bcrypt.checkpw(password_bytes, hashed_bytes):
+    if not await password_hasher.check(password_bytes, hashed_bytes):
         logger.debug("Invalid password")
         return JSONResponse(status_code=400, content={"message": "Auth failed"})
 
-    id = int(str(result[0]))
-    username = str(result[1])
+    id = int(str(result["id"]))
+    username = str(result["username"])
+
+    if password_hasher.needs_rehash(hashed_bytes):
+        # after the response, the login does not wait for it
+        background_tasks.add_task(_rehash_password, id, password_bytes, hashed)
 
     access_token = create_token(id, username, settings.at_duration_minutes)
-    refresh_token = create_token(id, username, settings.rt_duration_minutes)
+    refresh_token, expires_at = create_refresh_token(id, username)
 
     logger.debug("saving refresh token")
-    sql = "INSERT INTO person_refresh_token (person_id, token) VALUES (%s, %s)"
-    val = (id, refresh_token)
-    mycursor.execute(sql, val)
-    mydb.commit()
+    await repository.insert_refresh_token(id, token_digest(refresh_token), expires_at)
 
     response = JSONResponse(
         status_code=200,
@@ -95,32 +121,9 @@ async def login(login_data: LoginModel):
 
 @api_router.get("/authorize")
 async def authorize(request: Request):
-    logger = logging.getLogger("uvicorn")
-
-    auth_key = request.headers.get("Authorization")
-    if auth_key is None:
-        logger.debug("Unauthorized")
-        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
-
-    components = auth_key.split(" ")
-    if len(components) != 2:
-        logger.debug(f"Invalid token: {auth_key} (the length is not 2)")
-        return JSONResponse(status_code=401, content={"message": "Unauthorized token"})
-
-    if components[0] != "Bearer":
-        logger.debug(f"Invalid token: {auth_key} (the type is not Bearer)")
-        return JSONResponse(status_code=401, content={"message": "Unauthorized token"})
-
-    jwt_token = components[1]
-    try:
-        logger.debug(f"Decoding token: {jwt_token}")
-        jwt.decode(jwt_token, settings.jwt_secret, algorithms=["HS256"])
-    except jwt.ExpiredSignatureError:
-        logger.debug(f"Token expired: {jwt_token}")
-        return JSONResponse(status_code=401, content={"message": "Token expired"})
-    except jwt.InvalidTokenError:
-        logger.debug(f"Invalid token: {jwt_token}")
-        return JSONResponse(status_code=401, content={"message": "Invalid token"})
+    user_id = verify_authorization(request.headers.get("Authorization"))
+    if isinstance(user_id, JSONResponse):
+        return user_id
 
     return {"message": "Authorized"}
 
@@ -136,51 +139,40 @@ async def refresh(request: Request):
 
     decoded_token = None
     try:
-        logger.debug(f"Decoding token: {refresh_token}")
+        logger.debug("Decoding token: %s", token_log_id(refresh_token))
         decoded_token = jwt.decode(
             refresh_token, settings.jwt_secret, algorithms=["HS256"]
         )
     except jwt.ExpiredSignatureError:
-        logger.debug(f"Token expired: {refresh_token}")
+        logger.debug("Token expired: %s", token_log_id(refresh_token))
         return JSONResponse(status_code=401, content={"message": "Token expired"})
     except jwt.InvalidTokenError:
-        logger.debug(f"Invalid token: {refresh_token}")
+        logger.debug("Invalid token: %s", token_log_id(refresh_token))
         return JSONResponse(status_code=401, content={"message": "Invalid token"})
 
     id = int(str(decoded_token["id"]))
     username = str(decoded_token["username"])
 
-    sql = "SELECT token FROM person_refresh_token WHERE token = %s"
-    val = (refresh_token,)
-    mycursor = mydb.cursor()
-    mycursor.execute(sql, val)
-    result = mycursor.fetchone()
-    if not result or type(result) is NoneType:
+    # the old token is swapped for the new one in one transaction, of two
+    # requests with the same token only one gets through
+    new_refresh_token, expires_at = create_refresh_token(id, username)
+    logger.debug("Rotating refresh token %s", token_log_id(refresh_token))
+    if not await repository.rotate_refresh_token(
+        id,
+        token_digest(refresh_token),
+        token_digest(new_refresh_token),
+        expires_at,
+        int(time.time()),
+    ):
         # this token maybe reused, so we need to clear all (force re-login)
-        logger.debug(f"Token not found: {refresh_token}")
+        logger.debug("Token not found: %s", token_log_id(refresh_token))
         logger.debug("Clearing all refresh tokens")
-        sql = "DELETE FROM person_refresh_token WHERE person_id = %s"
-        val = (id,)
-        mycursor.execute(sql, val)
-        mydb.commit()
+        await repository.delete_refresh_tokens(id)
 
         return JSONResponse(status_code=401, content={"message": "Invalid token"})
 
-    # we just need to remove the token
-    logger.debug(f"Removing refresh token {refresh_token}")
-    sql = "DELETE FROM person_refresh_token WHERE token = %s"
-    val = (refresh_token,)
-    mycursor.execute(sql, val)
-    mydb.commit()
-
+    refresh_token = new_refresh_token
     access_token = create_token(id, username, settings.at_duration_minutes)
-    refresh_token = create_token(id, username, settings.rt_duration_minutes)
-
-    logger.debug(f"saving refresh token {refresh_token}")
-    sql = "INSERT INTO person_refresh_token (person_id, token) VALUES (%s, %s)"
-    val = (id, refresh_token)
-    mycursor.execute(sql, val)
-    mydb.commit()
 
     response = JSONResponse(
         status_code=200,
@@ -202,16 +194,25 @@ async def refresh(request: Request):
 async def logout(request: Request):
     logger = logging.getLogger("uvicorn")
 
+    # the access token and every other token of the user leave the cache
+    auth_key = request.headers.get("Authorization")
+    if auth_key is not None and auth_key.startswith("Bearer "):
+        token_cache.invalidate(auth_key[len("Bearer ") :])
+
     refresh_token = request.cookies.get("refresh_token")
     if refresh_token is None:
         return JSONResponse(status_code=200, content={"message": "Logged out"})
 
-    logger.debug(f"Removing refresh token {refresh_token}")
-    sql = "DELETE FROM person_refresh_token WHERE token = %s"
-    val = (refresh_token,)
-    mycursor = mydb.cursor()
-    mycursor.execute(sql, val)
-    mydb.commit()
+    try:
+        decoded_token = jwt.decode(
+            refresh_token, settings.jwt_secret, algorithms=["HS256"]
+        )
+        token_cache.invalidate_user(int(str(decoded_token["id"])))
+    except jwt.InvalidTokenError:
+        pass
+
+    logger.debug("Removing refresh token %s", token_log_id(refresh_token))
+    await repository.delete_refresh_token(token_digest(refresh_token))
 
     response = JSONResponse(status_code=200, content={"message": "Logged out"})
     response.delete_cookie("refresh_token")
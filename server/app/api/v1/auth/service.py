@@ -0,0 +1,65 @@
+import hashlib
+import logging
+
+import jwt
+from fastapi.responses import JSONResponse
+
+from app.preload import repository, settings
+from app.refresh_token_sweeper import RefreshTokenSweeper
+from app.token_cache import TokenCache
+
+logger = logging.getLogger("uvicorn")
+
+# started and stopped by the app lifespan
+token_cache = TokenCache(settings.jwt_secret, settings.token_cache_size)
+refresh_token_sweeper = RefreshTokenSweeper(
+    repository.delete_expired_refresh_tokens,
+    interval=settings.refresh_token_sweep_interval,
+    batch_size=settings.refresh_token_sweep_batch_size,
+)
+
+
+def token_digest(token: str) -> bytes:
+    """What is stored of a refresh token"""
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+def token_log_id(token: str) -> str:
+    """
+    What the logs show of a token: the start of its SHA-256, enough to follow
+    one token through the logs (and the stored refresh token digests) without
+    writing the token itself
+    """
+    return token_digest(token)[:6].hex()
+
+
+def verify_authorization(auth_key: str | None) -> int | JSONResponse:
+    """
+    The user id of the access token in the Authorization header auth_key, or the
+    401 response to send
+    """
+    if auth_key is None:
+        logger.debug("Unauthorized")
+        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
+
+    components = auth_key.split(" ")
+    if len(components) != 2:
+        logger.debug("Invalid token: %s (the length is not 2)", token_log_id(auth_key))
+        return JSONResponse(status_code=401, content={"message": "Unauthorized token"})
+
+    if components[0] != "Bearer":
+        logger.debug(
+            "Invalid token: %s (the type is not Bearer)", token_log_id(auth_key)
+        )
+        return JSONResponse(status_code=401, content={"message": "Unauthorized token"})
+
+    jwt_token = components[1]
+    try:
+        logger.debug("Verifying token: %s", token_log_id(jwt_token))
+        return token_cache.verify(jwt_token)
+    except jwt.ExpiredSignatureError:
+        logger.debug("Token expired: %s", token_log_id(jwt_token))
+        return JSONResponse(status_code=401, content={"message": "Token expired"})
+    except jwt.InvalidTokenError:
+        logger.debug("Invalid token: %s", token_log_id(jwt_token))
+        return JSONResponse(status_code=401, content={"message": "Invalid token"})
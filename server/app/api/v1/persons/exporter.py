@@ -0,0 +1,203 @@
+"""
+Bulk export of the masked person table.
+
+Rows are read in keyset pages of tuples, one query per batch so no connection is
+held while the client downloads, and go straight into the output, a column at a
+time, never as per-row dicts:
+
+- csv: the encrypted columns base64 encoded
+- arrow: an Arrow IPC stream, the encrypted columns as binary (needs pyarrow)
+- parquet: one row group per batch, the encrypted columns as binary (needs
+  pyarrow)
+
+Memory stays at one batch and its encoded output whatever the table size.
+"""
+
+import base64
+import csv
+import importlib.util
+import io
+import logging
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, List
+
+from app.db.repository import MASKED_PERSON_COLUMNS
+from app.preload import repository
+
+# pyarrow takes longer to import than the rest of the app, so it is only
+# imported by the first arrow or parquet export
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+pa = None
+pq = None
+
+logger = logging.getLogger("uvicorn")
+
+# media type and file extension of every format
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+ENCRYPTED_COLUMNS = ("gender", "city", "phone_number")
+
+
+def available_formats() -> List[str]:
+    return list(FORMATS) if HAS_PYARROW else ["csv"]
+
+
+def default_format() -> str:
+    return "parquet" if HAS_PYARROW else "csv"
+
+
+class _CsvWriter:
+    def __init__(self):
+        self._encrypted = [
+            MASKED_PERSON_COLUMNS.index(name) for name in ENCRYPTED_COLUMNS
+        ]
+
+    def start(self) -> bytes:
+        return (",".join(MASKED_PERSON_COLUMNS) + "\r\n").encode("utf-8")
+
+    def write(self, rows: List[tuple]) -> bytes:
+        columns = list(zip(*rows))
+        for i in self._encrypted:
+            columns[i] = [
+                base64.b64encode(value).decode("ascii") for value in columns[i]
+            ]
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(zip(*columns))
+        return buffer.getvalue().encode("utf-8")
+
+    def close(self) -> bytes:
+        return b""
+
+
+class _Sink:
+    """
+    File for the pyarrow writers, emptied after every batch. tell counts every
+    byte ever written, Parquet records its offsets with it.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _load_pyarrow():
+    global pa, pq
+    if pa is None:
+        import pyarrow
+        import pyarrow.parquet
+
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+def _arrow_type(name: str):
+    if name == "id":
+        return pa.uint64()
+    if name in ENCRYPTED_COLUMNS:
+        return pa.binary()
+    return pa.string()
+
+
+class _ArrowWriter:
+    def __init__(self, format: str):
+        _load_pyarrow()
+        self._schema = pa.schema(
+            [(name, _arrow_type(name)) for name in MASKED_PERSON_COLUMNS]
+        )
+        self._sink = _Sink()
+        file = pa.PythonFile(self._sink, mode="w")
+        if format == "parquet":
+            self._writer = pq.ParquetWriter(file, self._schema)
+        else:
+            self._writer = pa.ipc.new_stream(file, self._schema)
+
+    def start(self) -> bytes:
+        return self._sink.drain()
+
+    def write(self, rows: List[tuple]) -> bytes:
+        columns = zip(*rows)
+        batch = pa.record_batch(
+            [
+                pa.array(column, type=field.type)
+                for column, field in zip(columns, self._schema)
+            ],
+            schema=self._schema,
+        )
+        self._writer.write_batch(batch)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+class PersonExporter:
+    """Exports the person table, see the module docstring"""
+
+    def __init__(self, batch_size: int):
+        self._batch_size = batch_size
+
+        self._exports = 0
+        self._rows = 0
+        self._seconds = 0.0
+        self._last_rows = 0
+        self._last_rows_per_second = 0.0
+
+    async def export(self, format: str) -> AsyncIterator[bytes]:
+        """The export file in format, in chunks of about one batch"""
+        writer = _CsvWriter() if format == "csv" else _ArrowWriter(format)
+        start = time.perf_counter()
+        rows = 0
+        try:
+            yield writer.start()
+            async with aclosing(repository.export_persons(self._batch_size)) as batches:
+                async for batch in batches:
+                    rows += len(batch)
+                    yield writer.write(batch)
+            yield writer.close()
+        finally:
+            elapsed = time.perf_counter() - start
+            self._exports += 1
+            self._rows += rows
+            self._seconds += elapsed
+            self._last_rows = rows
+            self._last_rows_per_second = rows / elapsed if elapsed else 0.0
+            logger.info(
+                f"Exported {rows} persons as {format} in {elapsed:.1f}s, "
+                f"{self._last_rows_per_second:.0f} rows/s"
+            )
+
+    def stats(self) -> dict:
+        return {
+            "batch_size": self._batch_size,
+            "exports": self._exports,
+            "rows": self._rows,
+            "rows_per_second": self._rows / self._seconds if self._seconds else 0.0,
+            "last_rows": self._last_rows,
+            "last_rows_per_second": self._last_rows_per_second,
+        }
@@ -0,0 +1,311 @@
+"""
+Bulk person import.
+
+Persons arrive as CSV with a header line or as NDJSON, read as a stream and
+imported chunk_size rows at a time. Every chunk costs one query for the
+usernames and emails already taken, one batch of bcrypt hashes and one batch of
+field encryptions spread over the crypto workers, and one transaction of
+multi-row INSERTs. The next chunk is checked, hashed and encrypted while the
+previous one is written.
+
+import_persons yields a report entry for every row that was not imported, with
+its line number and the reason, then a summary.
+"""
+
+import asyncio
+import codecs
+import csv
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Set, Tuple
+
+from pydantic import ValidationError
+
+from app.api.v1.persons.model import Person
+from app.preload import crypto_executor, password_hasher, repository, settings
+
+logger = logging.getLogger("uvicorn")
+
+FORMATS = ("csv", "ndjson")
+# longer lines stop the import instead of being buffered
+MAX_LINE_BYTES = 1 << 20
+
+# line number, fields and the error that makes the row unusable, if any
+Record = Tuple[int, Dict[str, Any] | None, str | None]
+
+
+class InvalidInput(ValueError):
+    """The input cannot be read any further"""
+
+
+async def _lines(
+    chunks: AsyncIterator[bytes],
+) -> AsyncIterator[Tuple[int, str | None]]:
+    """Numbered lines, None for a line that is not valid UTF-8"""
+    number = 0
+    buffer = b""
+    async for chunk in chunks:
+        # a newline byte is never part of a multi-byte UTF-8 character
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        for line in lines:
+            number += 1
+            yield number, _decode(line)
+        if len(buffer) > MAX_LINE_BYTES:
+            raise InvalidInput(
+                f"Line {number + 1} is longer than {MAX_LINE_BYTES} bytes"
+            )
+    if buffer:
+        yield number + 1, _decode(buffer)
+
+
+def _decode(line: bytes) -> str | None:
+    try:
+        return line.decode("utf-8").rstrip("\r")
+    except UnicodeDecodeError:
+        return None
+
+
+async def _csv_records(
+    lines: AsyncIterator[Tuple[int, str | None]],
+) -> AsyncIterator[Record]:
+    header = None
+    async for number, line in lines:
+        # a quoted field may span lines
+        while line is not None and line.count('"') % 2:
+            try:
+                _, more = await anext(lines)
+            except StopAsyncIteration:
+                break
+            line = None if more is None else line + "\n" + more
+        if line is None:
+            if header is None:
+                raise InvalidInput("The header line is not valid UTF-8")
+            yield number, None, "Not valid UTF-8"
+            continue
+        if not line.strip():
+            continue
+
+        try:
+            values = next(csv.reader([line]))
+        except csv.Error as e:
+            yield number, None, f"Invalid CSV: {e}"
+            continue
+        if header is None:
+            header = values
+        elif len(values) != len(header):
+            yield number, None, f"Expected {len(header)} fields, got {len(values)}"
+        else:
+            yield number, dict(zip(header, values)), None
+
+
+async def _ndjson_records(
+    lines: AsyncIterator[Tuple[int, str | None]],
+) -> AsyncIterator[Record]:
+    async for number, line in lines:
+        if line is None:
+            yield number, None, "Not valid UTF-8"
+            continue
+        if not line.strip():
+            continue
+        try:
+            fields = json.loads(line)
+        except ValueError:
+            yield number, None, "Invalid JSON"
+            continue
+        if not isinstance(fields, dict):
+            yield number, None, "Expected a JSON object"
+            continue
+        yield number, fields, None
+
+
+async def _chunks(
+    records: AsyncIterator[Record], size: int
+) -> AsyncIterator[List[Record]]:
+    chunk = []
+    async for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _validate(fields: Dict[str, Any]) -> Tuple[Person | None, str | None]:
+    try:
+        return Person.model_validate(fields), None
+    except ValidationError as e:
+        return None, "; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+            for error in e.errors()
+        )
+
+
+async def _check_unique(
+    persons: List[Tuple[int, Person]], writing: Tuple[Set[str], Set[str]]
+) -> Tuple[List[Tuple[int, Person]], List[dict]]:
+    """
+    Split persons into the ones that can be inserted and report entries for the
+    others: their username or email is taken in the database, by the chunk
+    being written or by an earlier row of this chunk.
+    """
+    existing = await repository.find_existing_persons(
+        [person.username for _, person in persons],
+        [person.email for _, person in persons],
+    )
+    usernames = {row["username"] for row in existing} | writing[0]
+    emails = {row["email"] for row in existing} | writing[1]
+
+    unique = []
+    duplicates = []
+    for line, person in persons:
+        if person.username in usernames:
+            duplicates.append({"line": line, "message": "Username already exists"})
+        elif person.email in emails:
+            duplicates.append({"line": line, "message": "Email already exists"})
+        else:
+            usernames.add(person.username)
+            emails.add(person.email)
+            unique.append((line, person))
+    return unique, duplicates
+
+
+async def _encrypt(persons: List[Tuple[int, Person]]) -> List[tuple]:
+    """insert_persons rows of persons"""
+    hashed, sealed = await asyncio.gather(
+        password_hasher.hash_many(
+            [person.password.encode("utf-8") for _, person in persons]
+        ),
+        crypto_executor.seal_new_records(
+            settings.master_key,
+            [
+                {
+                    "gender": person.gender.encode("utf-8"),
+                    "city": person.city.encode("utf-8"),
+                    "phone_number": person.phone_number.encode("utf-8"),
+                    "decrypt_frequency": b"0",
+                }
+                for _, person in persons
+            ],
+        ),
+    )
+    return [
+        (
+            person.email,
+            person.username,
+            password.decode("utf-8"),
+            fields["gender"],
+            fields["city"],
+            fields["phone_number"],
+            private_key,
+            settings.master_key_version,
+            fields["decrypt_frequency"],
+        )
+        for (_, person), password, (private_key, fields) in zip(persons, hashed, sealed)
+    ]
+
+
+async def _write(
+    persons: List[Tuple[int, Person]], rows: List[tuple]
+) -> Tuple[int, List[dict]]:
+    """Insert one chunk, returns the rows inserted and report entries of the others"""
+    inserted = await repository.insert_persons(rows)
+    failures = [
+        {"line": line, "message": "Username or email already exists"}
+        for (line, _), ok in zip(persons, inserted)
+        if not ok
+    ]
+    return len(persons) - len(failures), failures
+
+
+async def import_persons(
+    chunks: AsyncIterator[bytes], format: str, chunk_size: int
+) -> AsyncIterator[dict]:
+    """
+    Import the persons read from chunks, CSV or NDJSON as format says. Yields
+    {"line", "message"} for every row not imported, then a summary with the
+    rows created and failed, the rows per second and the error that stopped
+    the import, if any. Chunks written before an error stay imported.
+    """
+    start = time.perf_counter()
+    created = 0
+    failed = 0
+    error = None
+
+    lines = _lines(chunks)
+    records = _csv_records(lines) if format == "csv" else _ndjson_records(lines)
+
+    # the chunk being written and its usernames and emails, which the uniqueness
+    # query cannot see yet
+    write: asyncio.Task | None = None
+    writing: Tuple[Set[str], Set[str]] = (set(), set())
+    try:
+        async for chunk in _chunks(records, chunk_size):
+            persons = []
+            for line, fields, message in chunk:
+                person = None
+                if message is None:
+                    person, message = _validate(fields)
+                if person is None:
+                    failed += 1
+                    yield {"line": line, "message": message}
+                else:
+                    persons.append((line, person))
+
+            persons, duplicates = await _check_unique(persons, writing)
+            failed += len(duplicates)
+            for entry in duplicates:
+                yield entry
+            rows = await _encrypt(persons)
+
+            if write is not None:
+                written, failures = await write
+                created += written
+                failed += len(failures)
+                for entry in failures:
+                    yield entry
+            write = asyncio.create_task(_write(persons, rows))
+            writing = (
+                {person.username for _, person in persons},
+                {person.email for _, person in persons},
+            )
+
+        if write is not None:
+            written, failures = await write
+            write = None
+            created += written
+            failed += len(failures)
+            for entry in failures:
+                yield entry
+    except InvalidInput as e:
+        error = str(e)
+    except Exception:
+        logger.exception("Importing persons failed")
+        error = "Import failed"
+    finally:
+        if write is not None and not write.done():
+            # the transaction finishes anyway, do not leave it to the loop
+            await asyncio.wait([write])
+
+    if write is not None and write.exception() is None:
+        # written before the error stopped the import
+        written, failures = write.result()
+        created += written
+        failed += len(failures)
+        for entry in failures:
+            yield entry
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Imported {created} persons, {failed} failed, in {elapsed:.1f}s"
+        + (f": {error}" if error else "")
+    )
+    summary = {
+        "created": created,
+        "failed": failed,
+        "rows_per_second": (created + failed) / elapsed if elapsed else 0.0,
+    }
+    if error is not None:
+        summary["error"] = error
+    yield summary
@@ -29,4 +29,5 @@ class EncryptedPerson(TypedDict):
     city: bytes
     phone_number: bytes
     private_key: bytes
+    key_version: int
     decrypt_frequency: bytes
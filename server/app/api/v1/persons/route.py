@@ -1,60 +1,43 @@
+import json
 import logging
 import secrets
-from typing import List, cast
-from fastapi import APIRouter, Request
-import bcrypt
-from fastapi.responses import JSONResponse
-from mysql.connector.types import RowType
+from typing import AsyncIterator, List, Literal, cast
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
+from app.api.v1.persons.exporter import FORMATS, available_formats, default_format
 from app.api.v1.persons.model import EncryptedPerson, Person
-from app.crypto.cipher import AES
-from app.crypto.mode import GCMMode
-from app.preload import mydb, settings
+from app.api.v1.persons.service import (
+    access_counter,
+    decrypt_data,
+    decrypt_record,
+    encrypt_data,
+    encrypt_record,
+    masked_view_cache,
+    person_exporter,
+    profile_cache,
+)
+from app.db.repository import Row
+from app.preload import password_hasher, repository, settings
 
 
 api_router = APIRouter(prefix="/persons")
 logger = logging.getLogger("uvicorn")
 
-
-def _encrypt_data(key: bytes, data: str) -> bytes:
-    aes_cipher = AES(key)
-    encrypt_cipher = GCMMode(aes_cipher)
-    nonce = encrypt_cipher.nonce
-
-    ciphertext, tag = encrypt_cipher.encrypt(data.encode("utf-8"))
-    return nonce + ciphertext + tag
-
-
-def _decrypt_data(key: bytes, data: bytes) -> str:
-    """
-    Data must be in the format of nonce + ciphertext + tag
-    """
-    nonce = data[:12]
-    ciphertext = data[12:-16]
-    tag = data[-16:]
-
-    aes_cipher = AES(key)
-    decrypt_cipher = GCMMode(aes_cipher, nonce)
-    return decrypt_cipher.decrypt(ciphertext, tag).decode("utf-8")
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_AFTER_ID_HEADER = "X-Next-After-Id"
 
 
 @api_router.post("/", status_code=201)
 async def create_user(person: Person):
     global logger
 
-    sql = "SELECT id, username, email FROM person WHERE username = %s OR email = %s"
-    val = (person.username, person.email)
-    mycursor = mydb.cursor()
-    mycursor.execute(sql, val)
-    result = mycursor.fetchone()
+    result = await repository.find_person_by_username_or_email(
+        person.username, person.email
+    )
     if result:
-        if type(result) is not RowType and type(result) is not tuple:
-            logger.debug(f"Invalid result type: {type(result)}")
-            return JSONResponse(
-                status_code=500, content={"message": "Internal server error"}
-            )
-
-        username = str(result[1])
+        username = str(result["username"])
         if username == person.username:
             logger.debug("Username already exists")
             return JSONResponse(
@@ -73,125 +56,202 @@ async def create_user(person: Person):
     private_key = secrets.token_bytes(32)
 
     # AES encryption
-    encrypted_gender = _encrypt_data(private_key, person.gender)
-    encrypted_city = _encrypt_data(private_key, person.city)
-    encrypted_phone_number = _encrypt_data(private_key, person.phone_number)
-    encrypted_private_key = _encrypt_data(master_key, private_key.hex())
     decrypt_frequency = 0
-    encrypted_decrypt_frequency = _encrypt_data(private_key, str(decrypt_frequency))
+    encrypted = await encrypt_record(
+        private_key,
+        {
+            "gender": person.gender,
+            "city": person.city,
+            "phone_number": person.phone_number,
+            "decrypt_frequency": str(decrypt_frequency),
+        },
+    )
+    encrypted_private_key = await encrypt_data(master_key, private_key.hex())
 
     # bcrypt hashing
     password_bytes = person.password.encode("utf-8")
-    salt = bcrypt.gensalt(rounds=settings.rounds)
-    hashed = bcrypt.hashpw(password_bytes, salt)
+    hashed = await password_hasher.hash(password_bytes)
 
     logger.debug("creating user")
 
-    mycursor = mydb.cursor()
-    sql = "INSERT INTO person (email, username, password, gender, city, phone_number, private_key, decrypt_frequency) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
-    val = (
+    id = await repository.insert_person(
         person.email,
         person.username,
-        hashed,
-        encrypted_gender,
-        encrypted_city,
-        encrypted_phone_number,
+        hashed.decode("utf-8"),
+        encrypted["gender"],
+        encrypted["city"],
+        encrypted["phone_number"],
         encrypted_private_key,
-        encrypted_decrypt_frequency,
+        settings.master_key_version,
+        encrypted["decrypt_frequency"],
     )
-    mycursor.execute(sql, val)
-    mydb.commit()
+    # an id can be handed out again after a delete
+    profile_cache.invalidate([id])
+    masked_view_cache.invalidate([id])
 
     return {"message": "User created"}
 
 
-@api_router.get("/")
-async def get_users(request: Request):
+@api_router.get("/export")
+async def export_users(format: Literal["csv", "arrow", "parquet"] | None = None):
+    """
+    Every person as a file download, with the masked fields still encrypted.
+    format defaults to parquet when pyarrow is installed, csv otherwise.
+    """
     global logger
-    user_id: int = request.state.user_id
 
-    logger.debug("getting users")
-    mycursor = mydb.cursor(dictionary=True)
+    format = format or default_format()
+    if format not in available_formats():
+        logger.debug(f"{format} export is not available")
+        return JSONResponse(
+            status_code=400,
+            content={"message": f"The {format} format needs pyarrow"},
+        )
 
-    mycursor.execute(
-        "SELECT id, email, username, gender, city, phone_number, private_key, decrypt_frequency FROM person"
+    logger.debug(f"exporting users as {format}")
+    media_type, extension = FORMATS[format]
+    return StreamingResponse(
+        person_exporter.export(format),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="persons.{extension}"'
+        },
     )
-    rows = mycursor.fetchall()
-    encrypted_persons: List[EncryptedPerson] = [
-        EncryptedPerson(**cast(EncryptedPerson, row)) for row in rows
-    ]
 
-    persons = []
-
-    for encrypted_person in encrypted_persons:
-        id = encrypted_person["id"]
-        email = encrypted_person["email"]
-        username = encrypted_person["username"]
-        gender = encrypted_person["gender"].hex()
-        city = encrypted_person["city"].hex()
-        phone_number = encrypted_person["phone_number"].hex()
-
-        # the only information that the user has permission to decrypt is their own
-        if encrypted_person["id"] == user_id:
-            logger.debug(f"decrypting data of user {id}")
-            private_key = bytes.fromhex(
-                _decrypt_data(settings.master_key, encrypted_person["private_key"])
-            )
-            gender = _decrypt_data(private_key, encrypted_person["gender"])
-            city = _decrypt_data(private_key, encrypted_person["city"])
-            phone_number = _decrypt_data(private_key, encrypted_person["phone_number"])
-            decrypt_frequency = (
-                int(_decrypt_data(private_key, encrypted_person["decrypt_frequency"]))
-                + 1
-            )
 
-            if decrypt_frequency > settings.subkey_rotation_counter:
-                logger.debug("rotating subkey")
-                # rotate subkey
-                decrypt_frequency = 0
-                new_private_key = secrets.token_bytes(32)
-                encrypted_private_key = _encrypt_data(
-                    settings.master_key, new_private_key.hex()
-                )
-                new_encrypted_gender = _encrypt_data(new_private_key, gender)
-                new_encrypted_city = _encrypt_data(new_private_key, city)
-                new_encrypted_phone_number = _encrypt_data(
-                    new_private_key, phone_number
-                )
-                new_encrypted_decrypt_frequency = _encrypt_data(
-                    new_private_key, str(decrypt_frequency)
-                )
-
-                sql = "UPDATE person SET private_key = %s, gender = %s, city = %s, phone_number = %s, decrypt_frequency = %s WHERE id = %s"
-                val = (
-                    encrypted_private_key,
-                    new_encrypted_gender,
-                    new_encrypted_city,
-                    new_encrypted_phone_number,
-                    new_encrypted_decrypt_frequency,
-                    id,
-                )
-
-                mycursor.execute(sql, val)
-                mydb.commit()
-            else:
-                encrypted_decrypt_frequency = _encrypt_data(
-                    private_key, str(decrypt_frequency)
-                )
-                sql = "UPDATE person SET decrypt_frequency = %s WHERE id = %s"
-                val = (encrypted_decrypt_frequency, id)
-                mycursor.execute(sql, val)
-                mydb.commit()
-
-        persons.append(
+class JSONArrayResponse(Response):
+    """A JSON array of objects that are already encoded"""
+
+    media_type = "application/json"
+
+    def render(self, content: List[bytes]) -> bytes:
+        return b"[" + b",".join(content) + b"]"
+
+
+def _dumps(person: dict) -> bytes:
+    # as JSONResponse renders it
+    return json.dumps(
+        person, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _masked_person(encrypted_person: EncryptedPerson) -> bytes:
+    """The row of another user as JSON, with the hex of the ciphertexts"""
+    id = encrypted_person["id"]
+    wrapped_key = encrypted_person["private_key"]
+    view = masked_view_cache.get(id, wrapped_key)
+    if view is None:
+        view = _dumps(
             {
                 "id": id,
-                "email": email,
-                "username": username,
-                "gender": gender,
-                "city": city,
-                "phone_number": phone_number,
+                "email": encrypted_person["email"],
+                "username": encrypted_person["username"],
+                "gender": encrypted_person["gender"].hex(),
+                "city": encrypted_person["city"].hex(),
+                "phone_number": encrypted_person["phone_number"].hex(),
             }
         )
+        masked_view_cache.put(id, wrapped_key, view)
+    return view
+
+
+async def _own_person(encrypted_person: EncryptedPerson) -> bytes:
+    """
+    The row of the user as JSON, decrypted: the only information that the user
+    has permission to decrypt is their own. Reading it counts as a decryption.
+    """
+    id = encrypted_person["id"]
+    wrapped_key = encrypted_person["private_key"]
+    cached = profile_cache.get(id, wrapped_key)
+    if cached is None:
+        logger.debug(f"decrypting data of user {id}")
+        master_key = settings.master_keys[encrypted_person["key_version"]]
+        private_key = bytes.fromhex(await decrypt_data(master_key, wrapped_key))
+        decrypted = await decrypt_record(
+            private_key,
+            {
+                "gender": encrypted_person["gender"],
+                "city": encrypted_person["city"],
+                "phone_number": encrypted_person["phone_number"],
+                "decrypt_frequency": encrypted_person["decrypt_frequency"],
+            },
+        )
+        decrypt_frequency = decrypted.pop("decrypt_frequency")
+        profile_cache.put(id, wrapped_key, private_key, decrypted)
+    else:
+        # the count changes without a new subkey, it is always read
+        private_key, decrypted = cached
+        decrypt_frequency = await decrypt_data(
+            private_key, encrypted_person["decrypt_frequency"]
+        )
+
+    # written back, and the subkey rotated, in the background
+    access_counter.record(id, private_key, wrapped_key, int(decrypt_frequency))
+
+    return _dumps(
+        {
+            "id": id,
+            "email": encrypted_person["email"],
+            "username": encrypted_person["username"],
+            "gender": decrypted["gender"],
+            "city": decrypted["city"],
+            "phone_number": decrypted["phone_number"],
+        }
+    )
+
+
+async def _present_persons(rows: List[Row], user_id: int) -> List[bytes]:
+    """The rows as returned to the user, as JSON objects"""
+    return [
+        (
+            await _own_person(cast(EncryptedPerson, row))
+            if row["id"] == user_id
+            else _masked_person(cast(EncryptedPerson, row))
+        )
+        for row in rows
+    ]
+
+
+async def _stream_persons(
+    user_id: int, after_id: int, limit: int | None
+) -> AsyncIterator[bytes]:
+    async for rows in repository.iter_person_batches(after_id, limit):
+        persons = await _present_persons(rows, user_id)
+        yield b"\n".join(persons) + b"\n"
+
+
+@api_router.get("/")
+async def get_users(
+    request: Request,
+    after_id: int = Query(0, ge=0),
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+):
+    """
+    Persons ordered by id, a page of limit (default DEFAULT_PAGE_SIZE) persons
+    after after_id. The X-Next-After-Id header holds the after_id of the next
+    page when there may be one.
+
+    With stream=true, all persons after after_id (or the first limit of them) as
+    newline-delimited JSON, read a batch at a time as they are sent.
+    """
+    global logger
+    user_id: int = request.state.user_id
+
+    if stream:
+        logger.debug(f"streaming users after {after_id}")
+        return StreamingResponse(
+            _stream_persons(user_id, after_id, limit),
+            media_type="application/x-ndjson",
+        )
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    logger.debug(f"getting {limit} users after {after_id}")
+    rows = await repository.list_persons(after_id, limit)
+
+    persons = await _present_persons(rows, user_id)
 
-    return persons
+    headers = {}
+    if len(rows) == limit:
+        headers[NEXT_AFTER_ID_HEADER] = str(rows[-1]["id"])
+    return JSONArrayResponse(content=persons, headers=headers)
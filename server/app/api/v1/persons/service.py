@@ -0,0 +1,147 @@
+import asyncio
+import logging
+from typing import Dict, List
+
+from app.access_counter import AccessCounter, FlushRow
+from app.api.v1.persons.exporter import PersonExporter
+from app.db.repository import Row
+from app.masked_view_cache import MaskedViewCache
+from app.preload import crypto_executor, repository, settings
+from app.profile_cache import ProfileCache
+from app.rotation import RotationWorker
+
+logger = logging.getLogger("uvicorn")
+
+
+async def encrypt_data(key: bytes, data: str) -> bytes:
+    return await crypto_executor.seal(key, data.encode("utf-8"))
+
+
+async def decrypt_data(key: bytes, data: bytes) -> str:
+    """
+    Data must be in the format of nonce + ciphertext + tag
+    """
+    return (await crypto_executor.open_(key, data)).decode("utf-8")
+
+
+async def encrypt_record(key: bytes, data: Dict[str, str]) -> Dict[str, bytes]:
+    """
+    Encrypt all fields of a row under the same key in one call
+    """
+    fields = {name: value.encode("utf-8") for name, value in data.items()}
+    return await crypto_executor.seal_record(key, fields)
+
+
+async def decrypt_record(key: bytes, data: Dict[str, bytes]) -> Dict[str, str]:
+    """
+    Every field must be in the format of nonce + ciphertext + tag
+    """
+    fields = await crypto_executor.open_record(key, data)
+    return {name: value.decode("utf-8") for name, value in fields.items()}
+
+
+async def rotate_subkeys(ids: List[int]) -> int:
+    """
+    Re-encrypt the rows of persons ids under new subkeys and reset their
+    decrypt_frequency, in one crypto job per master key version and one
+    transaction. Rows that are gone, were rotated meanwhile or do not open are
+    skipped, without failing the rest of the batch. Returns the number of rows
+    rotated.
+    """
+    rows = await repository.find_persons(ids)
+    if not rows:
+        return 0
+
+    logger.debug(f"rotating subkeys of users {[row['id'] for row in rows]}")
+    # rows still wrapped under a previous master key move to the current one
+    by_version: Dict[int, List[Row]] = {}
+    for row in rows:
+        by_version.setdefault(row["key_version"], []).append(row)
+
+    written = []
+    old_keys = []
+    for key_version, version_rows in by_version.items():
+        unwrapping_key = settings.master_keys.get(key_version)
+        if unwrapping_key is None:
+            logger.warning(
+                f"Not rotating the subkeys of users "
+                f"{[row['id'] for row in version_rows]}: no master key of version "
+                f"{key_version}"
+            )
+            continue
+        rekeyed = await crypto_executor.rekey_records(
+            settings.master_key,
+            [
+                (
+                    row["private_key"],
+                    {
+                        "gender": row["gender"],
+                        "city": row["city"],
+                        "phone_number": row["phone_number"],
+                    },
+                )
+                for row in version_rows
+            ],
+            reset={"decrypt_frequency": b"0"},
+            unwrapping_key=unwrapping_key,
+        )
+        for row, result in zip(version_rows, rekeyed):
+            if result is None:
+                # logged by rekey_records, the row keeps its subkey
+                logger.warning(f"Not rotating the subkey of user {row['id']}")
+                continue
+            old_key, private_key, fields = result
+            written.append(
+                (
+                    row["id"],
+                    row["private_key"],
+                    private_key,
+                    settings.master_key_version,
+                    fields,
+                )
+            )
+            old_keys.append(old_key)
+
+    rotated = await repository.rotate_person_keys(written)
+    # their cached subkeys, fields and masked views are stale now. A batch run
+    # in a worker only forgot the old subkeys there, not in this process
+    for old_key in old_keys:
+        crypto_executor.evict(old_key)
+    ids = [row["id"] for row in rows]
+    profile_cache.invalidate(ids)
+    masked_view_cache.invalidate(ids)
+    return rotated
+
+
+async def _write_decrypt_frequencies(rows: List[FlushRow]):
+    encrypted = await asyncio.gather(
+        *(encrypt_data(private_key, str(count)) for _, private_key, _, count in rows)
+    )
+    await repository.update_decrypt_frequencies(
+        [
+            (id, wrapped_key, decrypt_frequency)
+            for (id, _, wrapped_key, _), decrypt_frequency in zip(rows, encrypted)
+        ]
+    )
+
+
+# all started and stopped by the app lifespan
+profile_cache = ProfileCache(
+    maxsize=settings.profile_cache_size, ttl=settings.profile_cache_ttl
+)
+
+masked_view_cache = MaskedViewCache(maxsize=settings.masked_view_cache_size)
+
+rotation_worker = RotationWorker(
+    rotate_subkeys, batch_size=settings.rotation_batch_size
+)
+
+access_counter = AccessCounter(
+    threshold=settings.subkey_rotation_counter,
+    flush=_write_decrypt_frequencies,
+    rotate=rotation_worker.rotate,
+    flush_interval=settings.access_flush_interval,
+    max_pending=settings.access_flush_max_pending,
+)
+
+person_exporter = PersonExporter(batch_size=settings.export_batch_size)
@@ -0,0 +1,132 @@
+"""
+Record-level AES-GCM.
+
+Seals or opens every field of a record under one key in a single call. Each field
+gets its own nonce and is stored as nonce (12 bytes) + ciphertext + tag (16 bytes),
+the same format GCMMode produces, so rows written either way are interchangeable.
+
+The key schedule and GHASH tables of the cipher are shared by all fields, and the
+counter blocks of every field (including the J0 blocks used for the tags) are
+encrypted together in a single multi-block cipher call.
+"""
+
+import hmac
+import secrets
+from typing import Dict, List, Tuple
+
+from app.crypto.mode import BlockCipher, xor_bytes
+
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+
+def _keystreams(
+    aes_cipher: BlockCipher, jobs: List[Tuple[bytes, int]]
+) -> List[Tuple[bytes, bytes]]:
+    """
+    For each (nonce, length) job return (E(K, J0), keystream of length bytes).
+    """
+    # J0 has counter 1 and is used for the tag, the data starts at counter 2
+    runs = [
+        ((int.from_bytes(nonce, byteorder="big") << 32) | 1, (length + 15) // 16 + 1)
+        for nonce, length in jobs
+    ]
+    # One cipher call for the blocks of every job
+    blocks = aes_cipher.encrypt_counter_runs(runs)
+
+    result = []
+    offset = 0
+    for _, n in runs:
+        end = offset + n * 16
+        result.append((blocks[offset : offset + 16], blocks[offset + 16 : end]))
+        offset = end
+    return result
+
+
+def _tag(aes_cipher: BlockCipher, E_J0: bytes, aad: bytes, ciphertext: bytes) -> bytes:
+    S = aes_cipher.ghash.digest(aad, ciphertext)
+    return xor_bytes(E_J0, S)
+
+
+def seal(
+    aes_cipher: BlockCipher,
+    plaintext: bytes,
+    associated_data: bytes = b"",
+    nonce: bytes | None = None,
+) -> bytes:
+    """
+    Encrypt a single value. Returns nonce + ciphertext + tag.
+    A random nonce is generated unless one is given.
+    """
+    if nonce is None:
+        nonce = secrets.token_bytes(NONCE_SIZE)
+    if len(nonce) != NONCE_SIZE:
+        raise ValueError("Nonce must be 12 bytes for GCM mode.")
+
+    [(E_J0, keystream)] = _keystreams(aes_cipher, [(nonce, len(plaintext))])
+    ciphertext = xor_bytes(plaintext, keystream)
+    return nonce + ciphertext + _tag(aes_cipher, E_J0, associated_data, ciphertext)
+
+
+def open_(aes_cipher: BlockCipher, blob: bytes, associated_data: bytes = b"") -> bytes:
+    """
+    Verify and decrypt a single value in the format of nonce + ciphertext + tag.
+    """
+    return open_record(aes_cipher, {"value": blob}, associated_data)["value"]
+
+
+def seal_record(
+    aes_cipher: BlockCipher, fields: Dict[str, bytes], associated_data: bytes = b""
+) -> Dict[str, bytes]:
+    """
+    Encrypt every field with a fresh nonce.
+    Returns field -> nonce + ciphertext + tag.
+    """
+    names = list(fields)
+    nonces = [secrets.token_bytes(NONCE_SIZE) for _ in names]
+    keystreams = _keystreams(
+        aes_cipher, [(nonce, len(fields[name])) for name, nonce in zip(names, nonces)]
+    )
+
+    sealed = {}
+    for name, nonce, (E_J0, keystream) in zip(names, nonces, keystreams):
+        ciphertext = xor_bytes(fields[name], keystream)
+        tag = _tag(aes_cipher, E_J0, associated_data, ciphertext)
+        sealed[name] = nonce + ciphertext + tag
+    return sealed
+
+
+def open_record(
+    aes_cipher: BlockCipher, blobs: Dict[str, bytes], associated_data: bytes = b""
+) -> Dict[str, bytes]:
+    """
+    Verify and decrypt every field of a record.
+    Blobs must be in the format of nonce + ciphertext + tag. Raises an error if any
+    tag does not match, in which case nothing is decrypted.
+    """
+    names = list(blobs)
+    for name in names:
+        if len(blobs[name]) < NONCE_SIZE + TAG_SIZE:
+            raise ValueError(f"Sealed field {name} is too short.")
+
+    parts = [
+        (
+            blobs[name][:NONCE_SIZE],
+            blobs[name][NONCE_SIZE:-TAG_SIZE],
+            blobs[name][-TAG_SIZE:],
+        )
+        for name in names
+    ]
+    keystreams = _keystreams(
+        aes_cipher, [(nonce, len(ciphertext)) for nonce, ciphertext, _ in parts]
+    )
+
+    for (_, ciphertext, tag), (E_J0, _) in zip(parts, keystreams):
+        expected_tag = _tag(aes_cipher, E_J0, associated_data, ciphertext)
+        if not hmac.compare_digest(expected_tag, tag):
+            raise ValueError("Authentication tag mismatch!")
+
+    return {
+        name: xor_bytes(ciphertext, keystream)
+        for name, (_, ciphertext, _), (_, keystream) in zip(names, parts, keystreams)
+    }
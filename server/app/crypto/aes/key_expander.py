@@ -109,3 +109,15 @@ class KeyExpander:
                     len_new_key += 4
 
         return new_key
+
+    def expand_words(self, key_array):
+        """
+        Expand the encryption key and pack it into 32 bit big-endian words.
+
+        Every round key is four consecutive words, one word per column.
+        """
+        expanded_key = self.expand(key_array)
+        return [
+            int.from_bytes(bytes(expanded_key[i : i + 4]), byteorder="big")
+            for i in range(0, len(expanded_key), 4)
+        ]
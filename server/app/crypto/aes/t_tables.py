@@ -0,0 +1,76 @@
+"""
+AES T-tables.
+
+Each encryption table Te0..Te3 merges SubBytes, ShiftRows and MixColumns for one
+byte of a column into a single 32 bit word lookup. The decryption tables Td0..Td3
+do the same for InvSubBytes and InvMixColumns.
+
+Words are big-endian: the most significant byte is row 0 of the column.
+"""
+
+from app.crypto.aes import aes_tables
+
+
+def _word(b0, b1, b2, b3):
+    return (b0 << 24) | (b1 << 16) | (b2 << 8) | b3
+
+
+def _ror8(w):
+    # Rotate a 32 bit word right by one byte
+    return ((w >> 8) | (w << 24)) & 0xFFFFFFFF
+
+
+def _build_tables():
+    gal1, gal2, gal3 = aes_tables.gal1, aes_tables.gal2, aes_tables.gal3
+    gal9, gal11, gal13, gal14 = (
+        aes_tables.gal9,
+        aes_tables.gal11,
+        aes_tables.gal13,
+        aes_tables.gal14,
+    )
+
+    te0 = []
+    td0 = []
+    for x in range(256):
+        s = aes_tables.sbox[x]
+        te0.append(_word(gal2[s], gal1[s], gal1[s], gal3[s]))
+        i = aes_tables.i_sbox[x]
+        td0.append(_word(gal14[i], gal9[i], gal13[i], gal11[i]))
+
+    te1 = [_ror8(w) for w in te0]
+    te2 = [_ror8(w) for w in te1]
+    te3 = [_ror8(w) for w in te2]
+    td1 = [_ror8(w) for w in td0]
+    td2 = [_ror8(w) for w in td1]
+    td3 = [_ror8(w) for w in td2]
+
+    return tuple(tuple(t) for t in (te0, te1, te2, te3, td0, td1, td2, td3))
+
+
+Te0, Te1, Te2, Te3, Td0, Td1, Td2, Td3 = _build_tables()
+
+# The last round has no MixColumns, so it only needs the sbox shifted into each byte
+# position of the word.
+sbox_24 = tuple(s << 24 for s in aes_tables.sbox)
+sbox_16 = tuple(s << 16 for s in aes_tables.sbox)
+sbox_8 = tuple(s << 8 for s in aes_tables.sbox)
+sbox_0 = aes_tables.sbox
+i_sbox_24 = tuple(s << 24 for s in aes_tables.i_sbox)
+i_sbox_16 = tuple(s << 16 for s in aes_tables.i_sbox)
+i_sbox_8 = tuple(s << 8 for s in aes_tables.i_sbox)
+i_sbox_0 = aes_tables.i_sbox
+
+
+def inv_mix_column_word(w):
+    """
+    Apply InvMixColumns to a single column word.
+
+    Used to turn encryption round keys into the round keys of the equivalent inverse
+    cipher (FIPS-197 section 5.3.5).
+    """
+    return (
+        Td0[aes_tables.sbox[(w >> 24) & 0xFF]]
+        ^ Td1[aes_tables.sbox[(w >> 16) & 0xFF]]
+        ^ Td2[aes_tables.sbox[(w >> 8) & 0xFF]]
+        ^ Td3[aes_tables.sbox[w & 0xFF]]
+    )
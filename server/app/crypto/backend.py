@@ -0,0 +1,247 @@
+"""
+AES-GCM backends.
+
+Every backend seals to and opens from the same nonce + ciphertext + tag format, so
+rows written by one backend are readable by any other. The pure-Python backend is
+always available; the native backend uses the AES-GCM implementation of the
+`cryptography` package (OpenSSL, AES-NI where the CPU has it) when it is installed.
+"""
+
+import logging
+import secrets
+from typing import Dict, List, Tuple, Type
+
+from app.crypto import aead
+from app.crypto.cache import CipherCache
+
+logger = logging.getLogger("uvicorn")
+
+
+class CryptoBackend:
+    name = ""
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    def seal(self, key: bytes, plaintext: bytes, nonce: bytes | None = None) -> bytes:
+        """Encrypt plaintext, returns nonce + ciphertext + tag"""
+        ...
+
+    def open(self, key: bytes, data: bytes) -> bytes:
+        """Verify and decrypt nonce + ciphertext + tag"""
+        ...
+
+    def seal_record(self, key: bytes, fields: Dict[str, bytes]) -> Dict[str, bytes]:
+        return {name: self.seal(key, value) for name, value in fields.items()}
+
+    def open_record(self, key: bytes, data: Dict[str, bytes]) -> Dict[str, bytes]:
+        return {name: self.open(key, value) for name, value in data.items()}
+
+    def rekey_records(
+        self,
+        wrapping_key: bytes,
+        records: List[Tuple[bytes, Dict[str, bytes]]],
+        reset: Dict[str, bytes] | None = None,
+        unwrapping_key: bytes | None = None,
+    ) -> List[Tuple[bytes, bytes, Dict[str, bytes]] | None]:
+        """
+        Move records to fresh 32 byte subkeys. A record is its wrapped subkey (the
+        hex of the subkey, sealed under unwrapping_key, wrapping_key by default)
+        and its sealed fields; reset adds or replaces plaintext fields. Returns
+        the old subkey, the new subkey wrapped under wrapping_key and the sealed
+        fields of every record, and forgets the old and new subkeys. The caller
+        evicts the old subkeys wherever else they may be cached.
+
+        A record that does not open (a bad tag, a subkey that is not one) is None
+        in the result and logged, the others are still rekeyed.
+        """
+        unwrapping_key = unwrapping_key or wrapping_key
+        rekeyed = []
+        for i, (wrapped_key, fields) in enumerate(records):
+            old_key = None
+            try:
+                old_key = bytes.fromhex(
+                    self.open(unwrapping_key, wrapped_key).decode("utf-8")
+                )
+                plaintext = {**self.open_record(old_key, fields), **(reset or {})}
+                new_key = secrets.token_bytes(32)
+                rekeyed.append(
+                    (
+                        old_key,
+                        self.seal(wrapping_key, new_key.hex().encode("utf-8")),
+                        self.seal_record(new_key, plaintext),
+                    )
+                )
+                self.evict(new_key)
+            except ValueError as e:
+                logger.warning(f"Rekeying record {i} of the batch failed: {e}")
+                rekeyed.append(None)
+            finally:
+                if old_key is not None:
+                    self.evict(old_key)
+        return rekeyed
+
+    def seal_new_records(
+        self, wrapping_key: bytes, records: List[Dict[str, bytes]]
+    ) -> List[Tuple[bytes, Dict[str, bytes]]]:
+        """
+        Seal every record under a fresh 32 byte subkey. Returns the subkey
+        wrapped under wrapping_key (the sealed hex of the subkey) and the sealed
+        fields of every record. The subkeys are not kept in the cache.
+        """
+        sealed = []
+        for fields in records:
+            key = secrets.token_bytes(32)
+            sealed.append(
+                (
+                    self.seal(wrapping_key, key.hex().encode("utf-8")),
+                    self.seal_record(key, fields),
+                )
+            )
+            self.evict(key)
+        return sealed
+
+    def evict(self, key: bytes):
+        """Forget anything derived from key, called when the key is rotated"""
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+_backends: Dict[str, Type[CryptoBackend]] = {}
+
+
+def register_backend(cls: Type[CryptoBackend]) -> Type[CryptoBackend]:
+    _backends[cls.name] = cls
+    return cls
+
+
+@register_backend
+class PythonBackend(CryptoBackend):
+    """The pure-Python AES and GCM in app.crypto"""
+
+    name = "python"
+
+    def __init__(self, cache_size: int = 128):
+        self.cipher_cache = CipherCache(cache_size)
+
+    def seal(self, key: bytes, plaintext: bytes, nonce: bytes | None = None) -> bytes:
+        return aead.seal(self.cipher_cache.get(key), plaintext, nonce=nonce)
+
+    def open(self, key: bytes, data: bytes) -> bytes:
+        return aead.open_(self.cipher_cache.get(key), data)
+
+    def seal_record(self, key: bytes, fields: Dict[str, bytes]) -> Dict[str, bytes]:
+        return aead.seal_record(self.cipher_cache.get(key), fields)
+
+    def open_record(self, key: bytes, data: Dict[str, bytes]) -> Dict[str, bytes]:
+        return aead.open_record(self.cipher_cache.get(key), data)
+
+    def evict(self, key: bytes):
+        self.cipher_cache.evict(key)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "cipher_cache": self.cipher_cache.stats()}
+
+
+@register_backend
+class NativeBackend(CryptoBackend):
+    """AES-GCM from the cryptography package"""
+
+    name = "native"
+
+    @classmethod
+    def is_available(cls) -> bool:
+        try:
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def __init__(self, cache_size: int = 128):
+        # OpenSSL key setup is cheap, so there is no cipher cache to size
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        from cryptography.exceptions import InvalidTag
+
+        self._AESGCM = AESGCM
+        self._InvalidTag = InvalidTag
+
+    def seal(self, key: bytes, plaintext: bytes, nonce: bytes | None = None) -> bytes:
+        if nonce is None:
+            nonce = secrets.token_bytes(aead.NONCE_SIZE)
+        # AESGCM.encrypt returns ciphertext + tag
+        return nonce + self._AESGCM(key).encrypt(nonce, plaintext, None)
+
+    def open(self, key: bytes, data: bytes) -> bytes:
+        if len(data) < aead.NONCE_SIZE + aead.TAG_SIZE:
+            raise ValueError("Sealed data is too short.")
+        try:
+            return self._AESGCM(key).decrypt(
+                data[: aead.NONCE_SIZE], data[aead.NONCE_SIZE :], None
+            )
+        except self._InvalidTag:
+            raise ValueError("Authentication tag mismatch!")
+
+
+def available_backends() -> List[str]:
+    return [name for name, cls in _backends.items() if cls.is_available()]
+
+
+def create_backend(name: str, cache_size: int = 128) -> CryptoBackend:
+    """
+    Create the backend registered under name.
+    "auto" picks the native backend when it is available, the python one otherwise.
+    """
+    if name == "auto":
+        name = "native" if _backends["native"].is_available() else "python"
+
+    cls = _backends.get(name)
+    if cls is None:
+        raise ValueError(f"Unknown crypto backend: {name}")
+    if not cls.is_available():
+        raise RuntimeError(f"Crypto backend {name} is not available")
+
+    return cls(cache_size=cache_size)
+
+
+def self_test(backend: CryptoBackend, rounds: int = 16):
+    """
+    Cross-check the backend against every other available backend on random inputs.
+
+    With the same nonce all backends must produce byte-identical output, and each
+    must open what the others sealed. Runs on fresh instances so the random test
+    keys never reach the caches of the live backend. Raises RuntimeError on any
+    mismatch.
+    """
+    candidate = type(backend)(cache_size=rounds)
+    others = [
+        _backends[name](cache_size=rounds)
+        for name in available_backends()
+        if name != backend.name
+    ]
+
+    for _ in range(rounds):
+        key = secrets.token_bytes(secrets.choice((16, 24, 32)))
+        nonce = secrets.token_bytes(aead.NONCE_SIZE)
+        plaintext = secrets.token_bytes(secrets.randbelow(100))
+
+        sealed = candidate.seal(key, plaintext, nonce)
+        if candidate.open(key, sealed) != plaintext:
+            raise RuntimeError(f"Crypto backend {backend.name} failed its round trip")
+
+        for other in others:
+            if (
+                other.seal(key, plaintext, nonce) != sealed
+                or other.open(key, sealed) != plaintext
+            ):
+                raise RuntimeError(
+                    f"Crypto backends {backend.name} and {other.name} disagree"
+                )
+
+    logger.info(
+        "Crypto backend %s passed self-test against %s",
+        backend.name,
+        [other.name for other in others] or "itself",
+    )
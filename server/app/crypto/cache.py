@@ -0,0 +1,82 @@
+"""
+Per-key cipher context cache.
+
+Building an AES context expands the key schedule and, on first GCM use, computes
+the hash subkey H and its GHASH tables. The cache keeps ready-to-use contexts in
+LRU order so repeated operations under the same key skip that work.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from app.crypto.cipher import AES
+
+
+class CipherCache:
+    """Bounded LRU cache of AES contexts keyed by a SHA-256 digest of the key"""
+
+    def __init__(self, maxsize: int = 128):
+        if maxsize < 1:
+            raise ValueError("Cache size must be a positive number")
+
+        self._maxsize = maxsize
+        self._contexts: OrderedDict[bytes, AES] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _digest(key: bytes) -> bytes:
+        # Never keep the raw key as a dictionary key
+        return hashlib.sha256(key).digest()
+
+    def get(self, key: bytes) -> AES:
+        """
+        Return the cipher context for key, building it on a miss.
+        """
+        digest = self._digest(key)
+        with self._lock:
+            context = self._contexts.get(digest)
+            if context is not None:
+                self._contexts.move_to_end(digest)
+                self.hits += 1
+                return context
+            self.misses += 1
+
+        # Build outside the lock, the key schedule and GHASH tables are the
+        # expensive part
+        context = AES(key)
+        context.ghash  # computes H and its tables now instead of on first use
+
+        with self._lock:
+            self._contexts[digest] = context
+            self._contexts.move_to_end(digest)
+            while len(self._contexts) > self._maxsize:
+                self._contexts.popitem(last=False)
+                self.evictions += 1
+        return context
+
+    def evict(self, key: bytes) -> bool:
+        """
+        Drop the context for key, e.g. when a subkey is rotated.
+        Returns whether the key was cached.
+        """
+        with self._lock:
+            return self._contexts.pop(self._digest(key), None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._contexts.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._contexts),
+                "maxsize": self._maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -8,10 +8,55 @@ The result of cipher or decipher operations is the transformed 16 element list o
 Algorithm per NIST FIPS-197 http://csrc.nist.gov/publications/fips/fips197/fips-197.pdf
 """
 
+from typing import Iterable, List, Tuple
+
 # Normally use relative import. In test mode use local import.
 from app.crypto.mode import BlockCipher
 from app.crypto.aes.key_expander import KeyExpander
 from app.crypto.aes import aes_tables
+from app.crypto.aes import t_tables
+
+# NumPy takes longer to import than the rest of the app's crypto, so it is only
+# imported by the first call with enough blocks to use it. None if missing.
+np = None
+_np_loaded = False
+
+# Below this many blocks the NumPy setup costs more than it saves
+NUMPY_MIN_BLOCKS = 64
+
+
+_np_tables = None
+
+
+def load_numpy():
+    """NumPy, imported on the first call, or None if it is not installed"""
+    global np, _np_loaded
+    if not _np_loaded:
+        _np_loaded = True
+        try:
+            import numpy
+
+            np = numpy
+        except ImportError:
+            pass
+    return np
+
+
+def _numpy_tables():
+    """T-tables and sbox as uint32 arrays, built on first use"""
+    global _np_tables
+    if _np_tables is None:
+        _np_tables = tuple(
+            np.array(table, dtype=np.uint32)
+            for table in (
+                t_tables.Te0,
+                t_tables.Te1,
+                t_tables.Te2,
+                t_tables.Te3,
+                t_tables.sbox_0,
+            )
+        )
+    return _np_tables
 
 
 class AESCipher:
@@ -131,9 +176,364 @@ class AESCipher:
         self._add_round_key(state, 0)
         return state
 
+    def encrypt_block(self, block: bytes) -> bytes:
+        """Perform AES block cipher on bytes"""
+        return bytes(self.cipher_block(list(block)))
+
+    def encrypt_blocks(self, counter_start: int, n: int) -> bytes:
+        """Perform AES block cipher on n consecutive counter blocks"""
+        prefix = counter_start & ~0xFFFFFFFF
+        part = counter_start & 0xFFFFFFFF
+        return b"".join(
+            self.encrypt_block(
+                (prefix | ((part + i) & 0xFFFFFFFF)).to_bytes(16, byteorder="big")
+            )
+            for i in range(n)
+        )
+
+    def decrypt_block(self, block: bytes) -> bytes:
+        """Perform AES block decipher on bytes"""
+        return bytes(self.decipher_block(list(block)))
+
+
+class AESTableCipher:
+    """
+    Perform single block AES cipher/decipher on four 32 bit column words.
+
+    SubBytes, ShiftRows and MixColumns are merged into the Te0..Te3 (and
+    Td0..Td3 for decipher) lookup tables, so a round is 16 lookups and XORs.
+    """
+
+    def __init__(self, expanded_key_words):
+        # Round keys for cipher, four words per round
+        self._ek = tuple(expanded_key_words)
+
+        # Number of rounds determined by expanded key length
+        self._Nr = len(self._ek) // 4 - 1
+
+        # Round keys for the equivalent inverse cipher: reversed round order and
+        # InvMixColumns applied to every round key but the first and the last
+        dk = []
+        for round in range(self._Nr, -1, -1):
+            words = self._ek[round * 4 : (round + 1) * 4]
+            if 0 < round < self._Nr:
+                words = [t_tables.inv_mix_column_word(w) for w in words]
+            dk.extend(words)
+        self._dk = tuple(dk)
+
+    def _cipher_ints(self, blocks: Iterable[int]) -> List[int]:
+        """
+        Cipher 128 bit integer blocks. All blocks go through one loop, so the tables
+        and round keys are looked up once per call instead of once per block.
+        """
+        Te0, Te1, Te2, Te3 = t_tables.Te0, t_tables.Te1, t_tables.Te2, t_tables.Te3
+        S24, S16, S8, S0 = (
+            t_tables.sbox_24,
+            t_tables.sbox_16,
+            t_tables.sbox_8,
+            t_tables.sbox_0,
+        )
+        rk = self._ek
+        rk0, rk1, rk2, rk3 = rk[0:4]
+        rounds = range(4, self._Nr * 4, 4)
+        last = self._Nr * 4
+
+        result = []
+        for block in blocks:
+            s0 = (block >> 96) ^ rk0
+            s1 = ((block >> 64) & 0xFFFFFFFF) ^ rk1
+            s2 = ((block >> 32) & 0xFFFFFFFF) ^ rk2
+            s3 = (block & 0xFFFFFFFF) ^ rk3
+
+            for i in rounds:
+                t0 = (
+                    Te0[s0 >> 24]
+                    ^ Te1[(s1 >> 16) & 0xFF]
+                    ^ Te2[(s2 >> 8) & 0xFF]
+                    ^ Te3[s3 & 0xFF]
+                    ^ rk[i]
+                )
+                t1 = (
+                    Te0[s1 >> 24]
+                    ^ Te1[(s2 >> 16) & 0xFF]
+                    ^ Te2[(s3 >> 8) & 0xFF]
+                    ^ Te3[s0 & 0xFF]
+                    ^ rk[i + 1]
+                )
+                t2 = (
+                    Te0[s2 >> 24]
+                    ^ Te1[(s3 >> 16) & 0xFF]
+                    ^ Te2[(s0 >> 8) & 0xFF]
+                    ^ Te3[s1 & 0xFF]
+                    ^ rk[i + 2]
+                )
+                t3 = (
+                    Te0[s3 >> 24]
+                    ^ Te1[(s0 >> 16) & 0xFF]
+                    ^ Te2[(s1 >> 8) & 0xFF]
+                    ^ Te3[s2 & 0xFF]
+                    ^ rk[i + 3]
+                )
+                s0, s1, s2, s3 = t0, t1, t2, t3
+
+            # Last round: SubBytes and ShiftRows only
+            t0 = (
+                S24[s0 >> 24]
+                | S16[(s1 >> 16) & 0xFF]
+                | S8[(s2 >> 8) & 0xFF]
+                | S0[s3 & 0xFF]
+            ) ^ rk[last]
+            t1 = (
+                S24[s1 >> 24]
+                | S16[(s2 >> 16) & 0xFF]
+                | S8[(s3 >> 8) & 0xFF]
+                | S0[s0 & 0xFF]
+            ) ^ rk[last + 1]
+            t2 = (
+                S24[s2 >> 24]
+                | S16[(s3 >> 16) & 0xFF]
+                | S8[(s0 >> 8) & 0xFF]
+                | S0[s1 & 0xFF]
+            ) ^ rk[last + 2]
+            t3 = (
+                S24[s3 >> 24]
+                | S16[(s0 >> 16) & 0xFF]
+                | S8[(s1 >> 8) & 0xFF]
+                | S0[s2 & 0xFF]
+            ) ^ rk[last + 3]
+
+            result.append((t0 << 96) | (t1 << 64) | (t2 << 32) | t3)
+        return result
+
+    @staticmethod
+    def _counter_columns_numpy(counter_start: int, n: int) -> tuple:
+        """The four uint32 columns of n counter blocks, arrays of shape (n,)"""
+        # Only the last column differs between counter blocks
+        part = counter_start & 0xFFFFFFFF
+        return (
+            np.full(n, (counter_start >> 96) & 0xFFFFFFFF, dtype=np.uint32),
+            np.full(n, (counter_start >> 64) & 0xFFFFFFFF, dtype=np.uint32),
+            np.full(n, (counter_start >> 32) & 0xFFFFFFFF, dtype=np.uint32),
+            (np.arange(part, part + n, dtype=np.uint64) & 0xFFFFFFFF).astype(np.uint32),
+        )
+
+    def _encrypt_blocks_numpy(self, counter_start: int, n: int) -> bytes:
+        """Cipher n counter blocks at once"""
+        return self._cipher_columns_numpy(
+            *self._counter_columns_numpy(counter_start, n)
+        )
+
+    def _cipher_columns_numpy(self, c0, c1, c2, c3) -> bytes:
+        """
+        Cipher blocks given as four uint32 arrays, one per column, all at once. The
+        T-table lookups are done by fancy indexing.
+        """
+        Te0, Te1, Te2, Te3, S = _numpy_tables()
+        rk = [np.uint32(w) for w in self._ek]
+        n = len(c0)
+
+        s0 = c0 ^ rk[0]
+        s1 = c1 ^ rk[1]
+        s2 = c2 ^ rk[2]
+        s3 = c3 ^ rk[3]
+
+        for i in range(4, self._Nr * 4, 4):
+            t0 = (
+                Te0[s0 >> 24]
+                ^ Te1[(s1 >> 16) & 0xFF]
+                ^ Te2[(s2 >> 8) & 0xFF]
+                ^ Te3[s3 & 0xFF]
+                ^ rk[i]
+            )
+            t1 = (
+                Te0[s1 >> 24]
+                ^ Te1[(s2 >> 16) & 0xFF]
+                ^ Te2[(s3 >> 8) & 0xFF]
+                ^ Te3[s0 & 0xFF]
+                ^ rk[i + 1]
+            )
+            t2 = (
+                Te0[s2 >> 24]
+                ^ Te1[(s3 >> 16) & 0xFF]
+                ^ Te2[(s0 >> 8) & 0xFF]
+                ^ Te3[s1 & 0xFF]
+                ^ rk[i + 2]
+            )
+            t3 = (
+                Te0[s3 >> 24]
+                ^ Te1[(s0 >> 16) & 0xFF]
+                ^ Te2[(s1 >> 8) & 0xFF]
+                ^ Te3[s2 & 0xFF]
+                ^ rk[i + 3]
+            )
+            s0, s1, s2, s3 = t0, t1, t2, t3
+
+        # Last round: SubBytes and ShiftRows only
+        i = self._Nr * 4
+        state = np.empty((n, 4), dtype=">u4")
+        state[:, 0] = (
+            (S[s0 >> 24] << 24)
+            | (S[(s1 >> 16) & 0xFF] << 16)
+            | (S[(s2 >> 8) & 0xFF] << 8)
+            | S[s3 & 0xFF]
+        ) ^ rk[i]
+        state[:, 1] = (
+            (S[s1 >> 24] << 24)
+            | (S[(s2 >> 16) & 0xFF] << 16)
+            | (S[(s3 >> 8) & 0xFF] << 8)
+            | S[s0 & 0xFF]
+        ) ^ rk[i + 1]
+        state[:, 2] = (
+            (S[s2 >> 24] << 24)
+            | (S[(s3 >> 16) & 0xFF] << 16)
+            | (S[(s0 >> 8) & 0xFF] << 8)
+            | S[s1 & 0xFF]
+        ) ^ rk[i + 2]
+        state[:, 3] = (
+            (S[s3 >> 24] << 24)
+            | (S[(s0 >> 16) & 0xFF] << 16)
+            | (S[(s1 >> 8) & 0xFF] << 8)
+            | S[s2 & 0xFF]
+        ) ^ rk[i + 3]
+        return state.tobytes()
+
+    def encrypt_block(self, block: bytes) -> bytes:
+        """Perform AES block cipher on a 16 byte block"""
+        if len(block) < 16:
+            # PKCS7 Padding, same as AESCipher.cipher_block
+            block = block + bytes([16 - len(block)]) * (16 - len(block))
+
+        [result] = self._cipher_ints((int.from_bytes(block, "big"),))
+        return result.to_bytes(16, "big")
+
+    def encrypt_blocks(self, counter_start: int, n: int) -> bytes:
+        """
+        Cipher n consecutive counter blocks and return them concatenated.
+
+        counter_start is the first 128 bit counter block as an integer. Only its last
+        32 bits count up, wrapping around like Counter.increment.
+        """
+        if n >= NUMPY_MIN_BLOCKS and load_numpy() is not None:
+            return self._encrypt_blocks_numpy(counter_start, n)
+
+        prefix = counter_start & ~0xFFFFFFFF
+        part = counter_start & 0xFFFFFFFF
+        result = self._cipher_ints(prefix | ((part + i) & 0xFFFFFFFF) for i in range(n))
+        return b"".join(block.to_bytes(16, "big") for block in result)
+
+    def encrypt_counter_runs(self, runs: List[Tuple[int, int]]) -> bytes:
+        """
+        Cipher several runs of (counter_start, n) counter blocks as one batch, so a
+        record of short fields still reaches NUMPY_MIN_BLOCKS. Returns the blocks
+        of every run concatenated, in order.
+        """
+        total = sum(n for _, n in runs)
+        if total >= NUMPY_MIN_BLOCKS and load_numpy() is not None:
+            columns = [self._counter_columns_numpy(start, n) for start, n in runs]
+            return self._cipher_columns_numpy(
+                *(np.concatenate(column) for column in zip(*columns))
+            )
+
+        result = self._cipher_ints(
+            (start & ~0xFFFFFFFF) | (((start & 0xFFFFFFFF) + i) & 0xFFFFFFFF)
+            for start, n in runs
+            for i in range(n)
+        )
+        return b"".join(block.to_bytes(16, "big") for block in result)
+
+    def decrypt_block(self, block: bytes) -> bytes:
+        """Perform AES block decipher on a 16 byte block"""
+        if len(block) < 16:
+            # null padding, same as AESCipher.decipher_block
+            block = block + b"\x00" * (16 - len(block))
+
+        Td0, Td1, Td2, Td3 = t_tables.Td0, t_tables.Td1, t_tables.Td2, t_tables.Td3
+        rk = self._dk
+
+        s0 = int.from_bytes(block[0:4], "big") ^ rk[0]
+        s1 = int.from_bytes(block[4:8], "big") ^ rk[1]
+        s2 = int.from_bytes(block[8:12], "big") ^ rk[2]
+        s3 = int.from_bytes(block[12:16], "big") ^ rk[3]
+
+        for i in range(4, self._Nr * 4, 4):
+            t0 = (
+                Td0[s0 >> 24]
+                ^ Td1[(s3 >> 16) & 0xFF]
+                ^ Td2[(s2 >> 8) & 0xFF]
+                ^ Td3[s1 & 0xFF]
+                ^ rk[i]
+            )
+            t1 = (
+                Td0[s1 >> 24]
+                ^ Td1[(s0 >> 16) & 0xFF]
+                ^ Td2[(s3 >> 8) & 0xFF]
+                ^ Td3[s2 & 0xFF]
+                ^ rk[i + 1]
+            )
+            t2 = (
+                Td0[s2 >> 24]
+                ^ Td1[(s1 >> 16) & 0xFF]
+                ^ Td2[(s0 >> 8) & 0xFF]
+                ^ Td3[s3 & 0xFF]
+                ^ rk[i + 2]
+            )
+            t3 = (
+                Td0[s3 >> 24]
+                ^ Td1[(s2 >> 16) & 0xFF]
+                ^ Td2[(s1 >> 8) & 0xFF]
+                ^ Td3[s0 & 0xFF]
+                ^ rk[i + 3]
+            )
+            s0, s1, s2, s3 = t0, t1, t2, t3
+
+        # Last round: InvShiftRows and InvSubBytes only
+        S24, S16, S8, S0 = (
+            t_tables.i_sbox_24,
+            t_tables.i_sbox_16,
+            t_tables.i_sbox_8,
+            t_tables.i_sbox_0,
+        )
+        i = self._Nr * 4
+        t0 = (
+            S24[s0 >> 24]
+            | S16[(s3 >> 16) & 0xFF]
+            | S8[(s2 >> 8) & 0xFF]
+            | S0[s1 & 0xFF]
+        ) ^ rk[i]
+        t1 = (
+            S24[s1 >> 24]
+            | S16[(s0 >> 16) & 0xFF]
+            | S8[(s3 >> 8) & 0xFF]
+            | S0[s2 & 0xFF]
+        ) ^ rk[i + 1]
+        t2 = (
+            S24[s2 >> 24]
+            | S16[(s1 >> 16) & 0xFF]
+            | S8[(s0 >> 8) & 0xFF]
+            | S0[s3 & 0xFF]
+        ) ^ rk[i + 2]
+        t3 = (
+            S24[s3 >> 24]
+            | S16[(s2 >> 16) & 0xFF]
+            | S8[(s1 >> 8) & 0xFF]
+            | S0[s0 & 0xFF]
+        ) ^ rk[i + 3]
+
+        return ((t0 << 96) | (t1 << 64) | (t2 << 32) | t3).to_bytes(16, "big")
+
 
 class AES(BlockCipher):
-    def __init__(self, key: bytes):
+    """
+    AES block cipher.
+
+    engine selects the implementation: "table" (default) runs on 32 bit words with
+    T-table lookups, "reference" runs the byte-list round functions of AESCipher.
+    Both produce identical output.
+    """
+
+    engines = ("table", "reference")
+
+    def __init__(self, key: bytes, engine: str = "table"):
         key_expander = None
         if len(key) == 16:
             key_expander = KeyExpander(128)
@@ -144,15 +544,25 @@ class AES(BlockCipher):
         else:
             raise ValueError("Invalid key size")
 
-        expanded_key = key_expander.expand(key)
-        self._cipher = AESCipher(expanded_key)
+        if engine == "table":
+            self._cipher = AESTableCipher(key_expander.expand_words(key))
+        elif engine == "reference":
+            self._cipher = AESCipher(key_expander.expand(key))
+        else:
+            raise ValueError("Invalid AES engine")
+
+        self.engine = engine
 
     def encrypt(self, plaintext: bytes) -> bytes:
-        state = list(bytearray(plaintext))
-        result = self._cipher.cipher_block(state)
-        return bytes(result)
+        return self._cipher.encrypt_block(plaintext)
 
     def decrypt(self, ciphertext: bytes) -> bytes:
-        state = list(bytearray(ciphertext))
-        result = self._cipher.decipher_block(state)
-        return bytes(result)
+        return self._cipher.decrypt_block(ciphertext)
+
+    def encrypt_blocks(self, counter_start: int, n: int) -> bytes:
+        return self._cipher.encrypt_blocks(counter_start, n)
+
+    def encrypt_counter_runs(self, runs: List[Tuple[int, int]]) -> bytes:
+        if self.engine == "table":
+            return self._cipher.encrypt_counter_runs(runs)
+        return super().encrypt_counter_runs(runs)
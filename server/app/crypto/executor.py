@@ -0,0 +1,281 @@
+"""
+Crypto executor.
+
+AES-GCM and bcrypt are CPU bound. Running them inside async handlers blocks the
+event loop for every other request, so the handlers await these wrappers instead.
+Jobs go to a process pool, small AES jobs to a thread pool where the pickling and
+IPC would cost more than the work itself.
+
+This module must not import app.preload: worker processes import it and must not
+open database connections.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import bcrypt
+
+from app.crypto.backend import CryptoBackend, create_backend
+
+logger = logging.getLogger("uvicorn")
+
+# Backend of a worker process, created by _init_worker
+_worker_backend: CryptoBackend | None = None
+
+
+def _init_worker(backend_name: str, cache_size: int):
+    # Creating the backend imports the cipher tables, so the first real job does
+    # not pay for it
+    global _worker_backend
+    _worker_backend = create_backend(backend_name, cache_size=cache_size)
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+# The workers never keep the subkey of a job in their cipher cache: an eviction in
+# the parent could not reach them. The cache still saves the key expansion over
+# the fields of a record, and rekey_records and seal_new_records forget their
+# subkeys themselves; only the wrapping keys stay cached.
+
+
+def _seal(key: bytes, plaintext: bytes) -> bytes:
+    try:
+        return _worker_backend.seal(key, plaintext)
+    finally:
+        _worker_backend.evict(key)
+
+
+def _open(key: bytes, data: bytes) -> bytes:
+    try:
+        return _worker_backend.open(key, data)
+    finally:
+        _worker_backend.evict(key)
+
+
+def _seal_record(key: bytes, fields: Dict[str, bytes]) -> Dict[str, bytes]:
+    try:
+        return _worker_backend.seal_record(key, fields)
+    finally:
+        _worker_backend.evict(key)
+
+
+def _open_record(key: bytes, data: Dict[str, bytes]) -> Dict[str, bytes]:
+    try:
+        return _worker_backend.open_record(key, data)
+    finally:
+        _worker_backend.evict(key)
+
+
+def _rekey_records(
+    wrapping_key: bytes,
+    records: List[Tuple[bytes, Dict[str, bytes]]],
+    reset: Dict[str, bytes] | None,
+    unwrapping_key: bytes | None,
+) -> List[Tuple[bytes, bytes, Dict[str, bytes]] | None]:
+    return _worker_backend.rekey_records(wrapping_key, records, reset, unwrapping_key)
+
+
+def _seal_new_records(
+    wrapping_key: bytes, records: List[Dict[str, bytes]]
+) -> List[Tuple[bytes, Dict[str, bytes]]]:
+    return _worker_backend.seal_new_records(wrapping_key, records)
+
+
+def _hash_password(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _hash_passwords(rounds: int, passwords: List[bytes]) -> List[bytes]:
+    return [_hash_password(password, rounds) for password in passwords]
+
+
+def _check_password(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+class CryptoExecutor:
+    """
+    Dispatch crypto work off the event loop.
+
+    processes=0 runs everything in the thread pool. AES jobs with at most
+    thread_max_bytes of payload always run in the thread pool, on the backend of
+    this process.
+    """
+
+    def __init__(
+        self,
+        backend: CryptoBackend,
+        processes: int,
+        threads: int,
+        thread_max_bytes: int,
+        cache_size: int = 128,
+    ):
+        self._backend = backend
+        self._processes = processes
+        self._threads = threads
+        self._thread_max_bytes = thread_max_bytes
+        self._cache_size = cache_size
+
+        self._process_pool: ProcessPoolExecutor | None = None
+        self._thread_pool: ThreadPoolExecutor | None = None
+
+        # Jobs submitted but not finished, per pool
+        self._queue_depth = {"process": 0, "thread": 0}
+        self._max_queue_depth = {"process": 0, "thread": 0}
+        self._completed = {"process": 0, "thread": 0}
+
+    async def start(self):
+        self._thread_pool = ThreadPoolExecutor(
+            max_workers=self._threads, thread_name_prefix="crypto"
+        )
+        if self._processes > 0:
+            # fork: spawned children would re-import __main__, and with it
+            # app.preload and the database connection
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self._processes,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_worker,
+                initargs=(self._backend.name, self._cache_size),
+            )
+            loop = asyncio.get_running_loop()
+            pids = await asyncio.gather(
+                *(
+                    loop.run_in_executor(self._process_pool, _warm_up)
+                    for _ in range(self._processes)
+                )
+            )
+            logger.info("Crypto workers ready: %s", sorted(set(pids)))
+
+    async def shutdown(self):
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=True, cancel_futures=True)
+            self._process_pool = None
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=True, cancel_futures=True)
+            self._thread_pool = None
+
+    async def _run(self, pool_name: str, pool: Executor, fn, *args):
+        # Only touched from the event loop thread, no lock needed
+        self._queue_depth[pool_name] += 1
+        self._max_queue_depth[pool_name] = max(
+            self._max_queue_depth[pool_name], self._queue_depth[pool_name]
+        )
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        finally:
+            self._queue_depth[pool_name] -= 1
+            self._completed[pool_name] += 1
+
+    async def _run_aes(self, size: int, process_fn, thread_fn, *args):
+        if self._process_pool is None or size <= self._thread_max_bytes:
+            return await self._run("thread", self._thread_pool, thread_fn, *args)
+        return await self._run("process", self._process_pool, process_fn, *args)
+
+    async def _run_cpu(self, fn, *args):
+        if self._process_pool is None:
+            return await self._run("thread", self._thread_pool, fn, *args)
+        return await self._run("process", self._process_pool, fn, *args)
+
+    async def seal(self, key: bytes, plaintext: bytes) -> bytes:
+        return await self._run_aes(
+            len(plaintext), _seal, self._backend.seal, key, plaintext
+        )
+
+    async def open_(self, key: bytes, data: bytes) -> bytes:
+        return await self._run_aes(len(data), _open, self._backend.open, key, data)
+
+    async def seal_record(
+        self, key: bytes, fields: Dict[str, bytes]
+    ) -> Dict[str, bytes]:
+        size = sum(len(value) for value in fields.values())
+        return await self._run_aes(
+            size, _seal_record, self._backend.seal_record, key, fields
+        )
+
+    async def open_record(self, key: bytes, data: Dict[str, bytes]) -> Dict[str, bytes]:
+        size = sum(len(value) for value in data.values())
+        return await self._run_aes(
+            size, _open_record, self._backend.open_record, key, data
+        )
+
+    async def rekey_records(
+        self,
+        wrapping_key: bytes,
+        records: List[Tuple[bytes, Dict[str, bytes]]],
+        reset: Dict[str, bytes] | None = None,
+        unwrapping_key: bytes | None = None,
+    ) -> List[Tuple[bytes, bytes, Dict[str, bytes]] | None]:
+        """One job for the whole batch, see CryptoBackend.rekey_records"""
+        size = sum(
+            len(wrapped_key) + sum(len(value) for value in fields.values())
+            for wrapped_key, fields in records
+        )
+        return await self._run_aes(
+            size,
+            _rekey_records,
+            self._backend.rekey_records,
+            wrapping_key,
+            records,
+            reset,
+            unwrapping_key,
+        )
+
+    async def _map(self, process_fn, thread_fn, items: list, *args) -> list:
+        """
+        fn(*args, slice) over items split in one slice per worker, on the process
+        pool if there is one. Results are in the order of items.
+        """
+        if self._process_pool is None:
+            pool_name, pool, fn = "thread", self._thread_pool, thread_fn
+            workers = self._threads
+        else:
+            pool_name, pool, fn = "process", self._process_pool, process_fn
+            workers = self._processes
+        size = max(1, -(-len(items) // workers))
+        results = await asyncio.gather(
+            *(
+                self._run(pool_name, pool, fn, *args, items[i : i + size])
+                for i in range(0, len(items), size)
+            )
+        )
+        return [item for result in results for item in result]
+
+    async def seal_new_records(
+        self, wrapping_key: bytes, records: List[Dict[str, bytes]]
+    ) -> List[Tuple[bytes, Dict[str, bytes]]]:
+        """Batch job spread over every worker, see CryptoBackend.seal_new_records"""
+        return await self._map(
+            _seal_new_records, self._backend.seal_new_records, records, wrapping_key
+        )
+
+    async def hash_password(self, password: bytes, rounds: int) -> bytes:
+        return await self._run_cpu(_hash_password, password, rounds)
+
+    async def hash_passwords(self, passwords: List[bytes], rounds: int) -> List[bytes]:
+        """Hash a batch of passwords, spread over every worker"""
+        return await self._map(_hash_passwords, _hash_passwords, passwords, rounds)
+
+    async def check_password(self, password: bytes, hashed: bytes) -> bool:
+        return await self._run_cpu(_check_password, password, hashed)
+
+    def evict(self, key: bytes):
+        """
+        Forget key, e.g. the old subkeys returned by rekey_records. Only this
+        process has to: the workers forget the key of a job when it ends.
+        """
+        self._backend.evict(key)
+
+    def stats(self) -> dict:
+        return {
+            "processes": self._processes,
+            "threads": self._threads,
+            "queue_depth": dict(self._queue_depth),
+            "max_queue_depth": dict(self._max_queue_depth),
+            "completed": dict(self._completed),
+        }
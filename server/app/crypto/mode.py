@@ -1,10 +1,13 @@
+import hmac
 import secrets
-from typing import Tuple
+from typing import List, Tuple
 
 
 # GF(2^128) defined by 1 + a + a^2 + a^7 + a^128
 # 0xE1000000000000000000000000000000: 1 + a + a^2 + a^7
 # Please note the MSB is x0 and LSB is x127
+# Bit-serial reference multiplication. GCM uses the table-driven GHASH below, this
+# one is kept as the oracle it is checked against.
 def gf_2_128_mul(x, y):
     assert x < (1 << 128)
     assert y < (1 << 128)
@@ -16,6 +19,138 @@ def gf_2_128_mul(x, y):
     return res
 
 
+class GHASH:
+    """
+    Multiplication by a fixed hash subkey H in GF(2^128) with Shoup-style tables.
+
+    Multiplication by H is linear, so X * H is the XOR of (each chunk of X) * H.
+    The tables hold the product for every value of every bits-wide chunk of X,
+    so one multiplication is 128 / bits lookups instead of a 128 step loop.
+    bits=4 needs 512 entries per key, bits=8 needs 4096 entries but half the
+    lookups.
+    """
+
+    def __init__(self, h: int, bits: int = 4):
+        if bits not in (4, 8):
+            raise ValueError("GHASH table width must be 4 or 8 bits.")
+        self.h = h
+        self._bits = bits
+
+        # powers[i] = H * x^i, multiplying by x is a right shift with reduction
+        powers = [h]
+        for _ in range(127):
+            v = powers[-1]
+            powers.append((v >> 1) ^ ((v & 1) * 0xE1000000000000000000000000000000))
+
+        # tables[j][v] = (v placed in the j-th chunk, counting from the MSB) * H.
+        # Bit k of chunk j is int bit p = shift + k, which stands for x^(127 - p).
+        tables = []
+        for j in range(128 // bits):
+            shift = 128 - bits * (j + 1)
+            table = [0] * (1 << bits)
+            for v in range(1, 1 << bits):
+                low = v & -v
+                k = low.bit_length() - 1
+                table[v] = table[v ^ low] ^ powers[127 - shift - k]
+            tables.append(tuple(table))
+        self._tables = tuple(tables)
+
+    def mul(self, x: int) -> int:
+        """
+        Return x * H.
+        """
+        res = 0
+        if self._bits == 8:
+            for table, b in zip(self._tables, x.to_bytes(16, byteorder="big")):
+                res ^= table[b]
+        else:
+            tables = self._tables
+            for j, b in enumerate(x.to_bytes(16, byteorder="big")):
+                res ^= tables[2 * j][b >> 4] ^ tables[2 * j + 1][b & 0x0F]
+        return res
+
+    def digest(self, A: bytes, C: bytes) -> bytes:
+        """
+        Compute GHASH over the AAD (A) and ciphertext (C).
+
+        A partial last block is zero padded by shifting its integer value instead of
+        copying the data.
+        """
+        mul = self.mul
+        X = 0
+        for data in (A, C):
+            for i in range(0, len(data), 16):
+                block = data[i : i + 16]
+                X = mul(
+                    X
+                    ^ (
+                        int.from_bytes(block, byteorder="big")
+                        << (8 * (16 - len(block)))
+                    )
+                )
+        # Process lengths (in bits) of AAD and ciphertext.
+        X = mul(X ^ ((len(A) * 8) << 64) ^ (len(C) * 8))
+        return X.to_bytes(16, byteorder="big")
+
+
+class GHASHStream:
+    """
+    Incremental GHASH: the AAD is given up front, the ciphertext arrives in chunks.
+
+    Only a partial block (less than 16 bytes) is carried between chunks, full blocks
+    are read in place through a memoryview.
+    """
+
+    def __init__(self, ghash: GHASH, associated_data: bytes = b""):
+        self._mul = ghash.mul
+        self._a_len = len(associated_data)
+        self._c_len = 0
+        self._X = 0
+        self._partial = b""
+
+        self._absorb(memoryview(associated_data))
+        self._flush_partial()
+
+    def _absorb(self, data: memoryview):
+        mul = self._mul
+        X = self._X
+        end = len(data) - len(data) % 16
+        for i in range(0, end, 16):
+            X = mul(X ^ int.from_bytes(data[i : i + 16], byteorder="big"))
+        self._X = X
+        self._partial = bytes(data[end:])
+
+    def _flush_partial(self):
+        # Zero pad the partial block by shifting its integer value
+        if self._partial:
+            block = int.from_bytes(self._partial, byteorder="big")
+            self._X = self._mul(self._X ^ (block << (8 * (16 - len(self._partial)))))
+            self._partial = b""
+
+    def update(self, ciphertext: bytes):
+        self._c_len += len(ciphertext)
+        data = memoryview(ciphertext)
+
+        if self._partial:
+            # Complete the carried partial block first
+            fill = 16 - len(self._partial)
+            self._partial += bytes(data[:fill])
+            data = data[fill:]
+            if len(self._partial) < 16:
+                return
+            self._X = self._mul(
+                self._X ^ int.from_bytes(self._partial, byteorder="big")
+            )
+            self._partial = b""
+
+        self._absorb(data)
+
+    def digest(self) -> bytes:
+        self._flush_partial()
+        X = self._mul(self._X ^ ((self._a_len * 8) << 64) ^ (self._c_len * 8))
+        return X.to_bytes(16, byteorder="big")
+
+
 class Counter(object):
     """
     A counter object for CTR mode that combines a 12-byte nonce with a 4-byte counter.
@@ -37,43 +172,90 @@ class Counter(object):
                 "Initial counter value must be a 32-bit integer (0 <= value < 2^32)."
             )
 
-        # Store nonce as a list of integers (bytes)
-        self._nonce = list(nonce)
-        # Convert the initial counter to a 4-byte big-endian list of integers.
-        self._counter_part = list(initial_value.to_bytes(4, byteorder="big"))
-        # The complete counter is the nonce concatenated with the counter part.
-        self._counter = self._nonce + self._counter_part
+        # The nonce is kept pre-shifted, so a counter block is a single OR
+        self._nonce = int.from_bytes(nonce, byteorder="big") << 32
+        self._counter_part = initial_value
 
     @property
     def value(self) -> bytes:
         """
         Return the current 16-byte counter block as bytes.
         """
-        return bytes(self._counter)
+        return (self._nonce | self._counter_part).to_bytes(16, byteorder="big")
 
     def increment(self):
         """
         Increment the counter portion (the last 4 bytes) by one.
         If the counter portion overflows, it wraps around to zero.
         """
-        # We increment only the last 4 bytes (indexes 12 to 15)
-        for i in range(15, 11, -1):
-            self._counter[i] += 1
-            if self._counter[i] < 256:
-                break
-            # Carry over: set current byte to 0 and continue with the next.
-            self._counter[i] = 0
-        # Note: When the 4-byte counter overflows, it wraps around.
+        self._counter_part = (self._counter_part + 1) & 0xFFFFFFFF
+
+    def take(self, n: int) -> int:
+        """
+        Return the current counter block as an integer and advance the counter by n.
+        """
+        block = self._nonce | self._counter_part
+        self._counter_part = (self._counter_part + n) & 0xFFFFFFFF
+        return block
 
 
 class BlockCipher:
+    _ghash: GHASH | None = None
+
     def __init__(self, key):
         self.key = key
 
+    @property
+    def ghash(self) -> GHASH:
+        """
+        GHASH tables for the hash subkey H = E(K, 0^128).
+
+        Built on first use and kept on the cipher, so every GCM operation under the
+        same key object reuses them.
+        """
+        if self._ghash is None:
+            H_block = self.encrypt(b"\x00" * 16)
+            self._ghash = GHASH(int.from_bytes(H_block, byteorder="big"))
+        return self._ghash
+
     def encrypt(self, plaintext: bytes) -> bytes: ...
 
     def decrypt(self, ciphertext: bytes) -> bytes: ...
 
+    def encrypt_blocks(self, counter_start: int, n: int) -> bytes:
+        """
+        Encrypt n consecutive counter blocks starting at counter_start (the 128 bit
+        block as an integer, only the last 32 bits count up) and concatenate them.
+        Ciphers can override this with a faster multi-block implementation.
+        """
+        prefix = counter_start & ~0xFFFFFFFF
+        part = counter_start & 0xFFFFFFFF
+        return b"".join(
+            self.encrypt(
+                (prefix | ((part + i) & 0xFFFFFFFF)).to_bytes(16, byteorder="big")
+            )
+            for i in range(n)
+        )
+
+    def encrypt_counter_runs(self, runs: List[Tuple[int, int]]) -> bytes:
+        """
+        encrypt_blocks over every (counter_start, n) run, concatenated in order.
+        Ciphers can override this to cipher all the runs in one batch.
+        """
+        return b"".join(self.encrypt_blocks(start, n) for start, n in runs)
+
+
+def xor_bytes(data, keystream) -> bytes:
+    """
+    XOR data with the first len(data) bytes of keystream as two big integers.
+    Both can be any bytes-like object, e.g. a memoryview into a larger buffer.
+    """
+    n = len(data)
+    return (
+        int.from_bytes(data, byteorder="big")
+        ^ int.from_bytes(keystream[:n], byteorder="big")
+    ).to_bytes(n, byteorder="big")
+
 
 class CTRMode:
     def __init__(self, block_cipher: BlockCipher, counter: Counter | None = None):
@@ -84,24 +266,43 @@ class CTRMode:
             counter = Counter(nonce, 2)
 
         self._counter = counter
-        self._remaining_counter = []
+        # Keystream generated by an earlier call but not used yet (less than a block)
+        self._remaining_keystream = b""
 
-    def encrypt(self, plaintext: bytes) -> bytes:
-        while len(self._remaining_counter) < len(plaintext):
-            self._remaining_counter += self._block_cipher.encrypt(self._counter.value)
-            self._counter.increment()
+    def update(self, data: bytes) -> bytes:
+        """
+        Encrypt (or decrypt) the next chunk of a stream.
+        Chunks can have any length, the keystream continues where the previous
+        call stopped.
+        """
+        n = len(data)
+        remaining = self._remaining_keystream
+
+        if len(remaining) >= n:
+            keystream = memoryview(remaining)
+        else:
+            # Preallocate the whole keystream once, all new blocks come from a single
+            # multi-block cipher call
+            blocks = (n - len(remaining) + 15) // 16
+            buffer = bytearray(len(remaining) + blocks * 16)
+            buffer[: len(remaining)] = remaining
+            buffer[len(remaining) :] = self._block_cipher.encrypt_blocks(
+                self._counter.take(blocks), blocks
+            )
+            keystream = memoryview(buffer)
 
-        encrypted = [(p ^ c) for (p, c) in zip(plaintext, self._remaining_counter)]
-        # Remove the bytes we used, so we don't use them again. We still keep the
-        # remaining counter for the next call, so we don't need to generate a new
+        # Keep the unused tail for the next call, so we don't need to generate a new
         # block every time.
-        self._remaining_counter = self._remaining_counter[len(encrypted) :]
+        self._remaining_keystream = bytes(keystream[n:])
 
-        return bytes(encrypted)
+        return xor_bytes(data, keystream)
+
+    def encrypt(self, plaintext: bytes) -> bytes:
+        return self.update(plaintext)
 
     def decrypt(self, ciphertext: bytes) -> bytes:
         # AES-CTR is symetric
-        return self.encrypt(ciphertext)
+        return self.update(ciphertext)
 
 
 class GCMMode:
@@ -126,9 +327,9 @@ class GCMMode:
         self.Y0 = counter.value
         counter.increment()
 
-        # Compute hash subkey H = E(K, 0^128)
-        H_block = self.aes_cipher.encrypt(b"\x00" * 16)
-        self.H_int = int.from_bytes(H_block, byteorder="big")
+        # Hash subkey H = E(K, 0^128) and its tables are computed once per key
+        self._ghash = self.aes_cipher.ghash
+        self.H_int = self._ghash.h
 
         # Initialize your CTR mode with the underlying AES cipher.
         # We assume your CTR mode class (e.g., cipher_mode.CTRMode) allows resetting its counter.
@@ -138,27 +339,7 @@ class GCMMode:
         """
         Compute GHASH over the AAD (A) and ciphertext (C).
         """
-
-        def pad(data: bytes) -> bytes:
-            if len(data) % 16 == 0:
-                return data
-            return data + b"\x00" * (16 - len(data) % 16)
-
-        X = 0
-        # Process padded AAD and ciphertext.
-        for data in (pad(A), pad(C)):
-            for i in range(0, len(data), 16):
-                block = data[i : i + 16]
-                block_int = int.from_bytes(block, byteorder="big")
-                X = gf_2_128_mul(X ^ block_int, self.H_int)
-        # Process lengths (in bits) of AAD and ciphertext.
-        a_len = len(A) * 8
-        c_len = len(C) * 8
-        len_block = a_len.to_bytes(8, byteorder="big") + c_len.to_bytes(
-            8, byteorder="big"
-        )
-        X = gf_2_128_mul(X ^ int.from_bytes(len_block, byteorder="big"), self.H_int)
-        return X.to_bytes(16, byteorder="big")
+        return self._ghash.digest(A, C)
 
     def encrypt(self, plaintext: bytes) -> Tuple[bytes, bytes]:
         """
@@ -197,3 +378,110 @@ class GCMMode:
         # Decrypt using CTR mode.
         plaintext = self.ctr.decrypt(ciphertext)
         return plaintext
+
+
+class GCMEncryptor:
+    """
+    Streaming GCM encryption.
+
+    Feed plaintext chunks to update(), each returns the matching ciphertext chunk.
+    finalize() returns the tag. Memory use does not depend on the payload size.
+    """
+
+    def __init__(
+        self,
+        block_cipher: BlockCipher,
+        nonce: bytes | None = None,
+        associated_data: bytes = b"",
+    ):
+        if nonce is None:
+            nonce = secrets.token_bytes(12)
+        if len(nonce) != 12:
+            raise ValueError("Nonce must be 12 bytes for GCM mode.")
+        self.nonce = nonce
+
+        counter = Counter(nonce, 1)
+        self._E_Y0 = block_cipher.encrypt(counter.value)
+        counter.increment()
+
+        self._ctr = CTRMode(block_cipher, counter)
+        self._ghash = GHASHStream(block_cipher.ghash, associated_data)
+        self._finalized = False
+
+    def update(self, plaintext: bytes) -> bytes:
+        if self._finalized:
+            raise ValueError("GCM encryptor is already finalized.")
+        ciphertext = self._ctr.update(plaintext)
+        self._ghash.update(ciphertext)
+        return ciphertext
+
+    def finalize(self) -> bytes:
+        """
+        Return the authentication tag.
+        """
+        if self._finalized:
+            raise ValueError("GCM encryptor is already finalized.")
+        self._finalized = True
+        return xor_bytes(self._E_Y0, self._ghash.digest())
+
+
+class GCMDecryptor:
+    """
+    Streaming GCM decryption.
+
+    By default no plaintext is released before the tag is verified: update() folds
+    the ciphertext into GHASH and buffers it, finalize(tag) verifies and returns the
+    whole plaintext. The buffer grows with the payload.
+
+    With unverified=True, update() returns plaintext right away and memory use stays
+    bounded, but the plaintext must not be trusted (or acted upon) until finalize(tag)
+    has returned without raising.
+    """
+
+    def __init__(
+        self,
+        block_cipher: BlockCipher,
+        nonce: bytes,
+        associated_data: bytes = b"",
+        unverified: bool = False,
+    ):
+        if len(nonce) != 12:
+            raise ValueError("Nonce must be 12 bytes for GCM mode.")
+        self.nonce = nonce
+
+        counter = Counter(nonce, 1)
+        self._E_Y0 = block_cipher.encrypt(counter.value)
+        counter.increment()
+
+        self._ctr = CTRMode(block_cipher, counter)
+        self._ghash = GHASHStream(block_cipher.ghash, associated_data)
+        self._unverified = unverified
+        self._buffer = bytearray()
+        self._finalized = False
+
+    def update(self, ciphertext: bytes) -> bytes:
+        if self._finalized:
+            raise ValueError("GCM decryptor is already finalized.")
+        self._ghash.update(ciphertext)
+        if self._unverified:
+            return self._ctr.update(ciphertext)
+        self._buffer += ciphertext
+        return b""
+
+    def finalize(self, tag: bytes) -> bytes:
+        """
+        Verify the tag and return the plaintext not released by update() yet.
+        Raises an error if tag verification fails.
+        """
+        if self._finalized:
+            raise ValueError("GCM decryptor is already finalized.")
+        self._finalized = True
+
+        expected_tag = xor_bytes(self._E_Y0, self._ghash.digest())
+        if not hmac.compare_digest(expected_tag, tag):
+            self._buffer = bytearray()
+            raise ValueError("Authentication tag mismatch!")
+
+        plaintext = self._ctr.update(self._buffer)
+        self._buffer = bytearray()
+        return plaintext
@@ -0,0 +1,61 @@
+"""
+Schema migrations of the MySQL database.
+
+database/init.sql creates the current schema. A database created from an older
+init.sql is brought up to it by the files in database/migrations/, named
+<version>_<name>.sql and applied in version order by app/migrate.py. The
+versions applied are recorded in the schema_migration table, which init.sql
+fills with every migration it already includes.
+
+MySQL commits every DDL statement on its own, so a migration that fails halfway
+stays half applied and is not recorded. Each file holds one schema change.
+"""
+
+import os
+import re
+from typing import List, Tuple
+
+MIGRATIONS_DIR = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "..", "database", "migrations")
+)
+
+SCHEMA_MIGRATION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migration (
+    version INT UNSIGNED PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# version, name, statements
+Migration = Tuple[int, str, List[str]]
+
+_FILE_NAME = re.compile(r"(\d+)_(\w+)\.sql")
+
+
+def split_statements(sql: str) -> List[str]:
+    """The statements of a file, without the -- comments. No ; inside literals"""
+    lines = [line for line in sql.splitlines() if not line.lstrip().startswith("--")]
+    return [
+        statement.strip()
+        for statement in "\n".join(lines).split(";")
+        if statement.strip()
+    ]
+
+
+def load_migrations(path: str = MIGRATIONS_DIR) -> List[Migration]:
+    """Every migration in path, by version. Raises ValueError on a bad file name"""
+    migrations = []
+    for file_name in sorted(os.listdir(path)):
+        match = _FILE_NAME.fullmatch(file_name)
+        if match is None:
+            raise ValueError(f"Migration {file_name} is not named <version>_<name>.sql")
+        with open(os.path.join(path, file_name)) as f:
+            statements = split_statements(f.read())
+        migrations.append((int(match[1]), match[2], statements))
+
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Migration versions are given twice in {path}")
+    return migrations
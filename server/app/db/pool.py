@@ -0,0 +1,195 @@
+"""
+MySQL connection pool.
+
+Connections are borrowed per request and returned afterwards. A borrowed
+connection is health-checked first and reconnected (or replaced) if the server
+dropped it, so one dead connection never takes the service down.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List
+
+from mysql.connector.abstracts import MySQLConnectionAbstract
+
+logger = logging.getLogger("uvicorn")
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the acquire timeout"""
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        connect: Callable[[], MySQLConnectionAbstract],
+        min_size: int,
+        max_size: int,
+        acquire_timeout: float,
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size >= 1")
+
+        self._connect = connect
+        self._min_size = min_size
+        self._max_size = max_size
+        self._acquire_timeout = acquire_timeout
+
+        self._idle: List[MySQLConnectionAbstract] = []
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._acquired = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def open(self):
+        """Create the first min_size connections, also reopens a closed pool"""
+        with self._cond:
+            self._closed = False
+        for _ in range(self._min_size - self._size):
+            connection = self._connect()
+            with self._cond:
+                self._idle.append(connection)
+                self._size += 1
+
+    def _checked(self, connection: MySQLConnectionAbstract) -> MySQLConnectionAbstract:
+        """Return a live connection: the given one, reconnected, or a new one"""
+        try:
+            # is_connected pings the server
+            if connection.is_connected():
+                return connection
+            logger.debug("Pooled connection is dead, reconnecting")
+            connection.reconnect(attempts=1)
+            self._reconnects += 1
+            return connection
+        except Exception:
+            logger.debug("Reconnecting failed, replacing the connection")
+            try:
+                connection.close()
+            except Exception:
+                pass
+            self._reconnects += 1
+            return self._connect()
+
+    def acquire(self, timeout: float | None = None) -> MySQLConnectionAbstract:
+        """
+        Borrow a connection, waiting up to timeout seconds (the pool's acquire
+        timeout by default) for one to be returned when the pool is at max size.
+        """
+        timeout = self._acquire_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        connection = None
+
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Connection pool is closed")
+                    if self._idle:
+                        connection = self._idle.pop()
+                        break
+                    if self._size < self._max_size:
+                        # reserve the slot, connect outside the lock
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        if not self._idle and self._size >= self._max_size:
+                            self._timeouts += 1
+                            raise PoolTimeout(
+                                f"No database connection available after {timeout}s"
+                            )
+            finally:
+                self._waiting -= 1
+            self._in_use += 1
+
+        try:
+            if connection is None:
+                connection = self._connect()
+            else:
+                connection = self._checked(connection)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        wait_time = time.monotonic() - start
+        with self._cond:
+            self._acquired += 1
+            self._wait_time_total += wait_time
+            self._wait_time_max = max(self._wait_time_max, wait_time)
+        return connection
+
+    def release(self, connection: MySQLConnectionAbstract):
+        """Return a borrowed connection, dropping anything left uncommitted"""
+        try:
+            connection.rollback()
+            broken = False
+        except Exception:
+            broken = True
+
+        with self._cond:
+            self._in_use -= 1
+            if broken or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append(connection)
+            self._cond.notify()
+
+        if broken or self._closed:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for connection in idle:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "min_size": self._min_size,
+                "max_size": self._max_size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "acquired": self._acquired,
+                "timeouts": self._timeouts,
+                "reconnects": self._reconnects,
+                "wait_time_avg_ms": (
+                    1000 * self._wait_time_total / self._acquired
+                    if self._acquired
+                    else 0.0
+                ),
+                "wait_time_max_ms": 1000 * self._wait_time_max,
+            }
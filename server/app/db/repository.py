@@ -0,0 +1,614 @@
+"""
+Async access to the database.
+
+The MySQL driver is blocking, so every query runs on a bounded thread pool and the
+handlers await it instead of stalling the event loop. The SQLite repository runs
+the same queries against an in-memory (or file) database, to run the app and its
+scripts without a MySQL server.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Sequence, Tuple
+
+import mysql.connector
+
+from app.db.migrations import SCHEMA_MIGRATION_TABLE
+from app.db.pool import ConnectionPool
+
+logger = logging.getLogger("uvicorn")
+
+Row = Dict[str, Any]
+
+PERSON_COLUMNS = (
+    "id, email, username, gender, city, phone_number, private_key, key_version, "
+    "decrypt_frequency"
+)
+
+# seconds, the longest wait between two attempts to connect to the database
+MAX_CONNECT_BACKOFF = 30
+
+# what every user may see of a person, the fields still encrypted
+MASKED_PERSON_COLUMNS = ("id", "email", "username", "gender", "city", "phone_number")
+
+
+def _rows(cursor, rows: Sequence[Sequence[Any]]) -> List[Row]:
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+class Repository:
+    """
+    Every query the app runs. Subclasses provide the connections and the
+    placeholder of their driver; the SQL is written with %s.
+    """
+
+    name = ""
+    placeholder = "%s"
+    # raised by the driver on a duplicate unique key
+    integrity_error: type = Exception
+
+    def __init__(self, threads: int):
+        self._threads = threads
+        self._executor: ThreadPoolExecutor | None = None
+
+        # Only touched from the event loop thread, no lock needed
+        self._queue_depth = 0
+        self._max_queue_depth = 0
+        self._completed = 0
+
+    async def start(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._threads, thread_name_prefix="db"
+        )
+
+    async def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self.close()
+
+    def close(self):
+        pass
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Borrow a DB-API connection for one unit of work"""
+        ...
+
+    def _sql(self, sql: str) -> str:
+        return sql if self.placeholder == "%s" else sql.replace("%s", self.placeholder)
+
+    def _fetchone(self, sql: str, val: tuple = ()) -> Row | None:
+        # read the whole result, an unbuffered MySQL cursor with unread rows
+        # makes the connection unusable
+        rows = self._fetchall(sql, val)
+        return rows[0] if rows else None
+
+    def _fetchall(self, sql: str, val: tuple = ()) -> List[Row]:
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self._sql(sql), val)
+            return _rows(cursor, cursor.fetchall())
+
+    def _fetchall_tuples(self, sql: str, val: tuple = ()) -> List[tuple]:
+        """Like _fetchall, rows as tuples in the order of the selected columns"""
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self._sql(sql), val)
+            return cursor.fetchall()
+
+    def _write_many(self, sql: str, vals: List[tuple]) -> int:
+        """Execute for every val in one transaction, returns the rows changed"""
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.executemany(self._sql(sql), vals)
+            connection.commit()
+            return cursor.rowcount
+
+    def _insert_many(self, sql: str, vals: List[tuple]) -> List[bool]:
+        """
+        Insert every val in one transaction, a multi-row INSERT where the driver
+        supports it. If a row breaks a unique key the rows are inserted one by one
+        instead, still in one transaction. Returns whether each row was inserted.
+        """
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.executemany(self._sql(sql), vals)
+                connection.commit()
+                return [True] * len(vals)
+            except self.integrity_error:
+                connection.rollback()
+
+            inserted = []
+            for val in vals:
+                try:
+                    cursor.execute(self._sql(sql), val)
+                    inserted.append(True)
+                except self.integrity_error:
+                    inserted.append(False)
+            connection.commit()
+            return inserted
+
+    def _write(self, sql: str, val: tuple = ()) -> int:
+        """Execute and commit, returns the id of the inserted row if any"""
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self._sql(sql), val)
+            connection.commit()
+            return cursor.lastrowid
+
+    async def _run(self, fn: Callable, *args):
+        if self._executor is None:
+            raise RuntimeError("Repository is not started")
+
+        self._queue_depth += 1
+        self._max_queue_depth = max(self._max_queue_depth, self._queue_depth)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, fn, *args
+            )
+        finally:
+            self._queue_depth -= 1
+            self._completed += 1
+
+    # person
+
+    async def ping(self):
+        """Raises if the database does not answer"""
+        await self._run(self._fetchone, "SELECT 1")
+
+    async def find_person_by_username_or_email(
+        self, username: str, email: str
+    ) -> Row | None:
+        return await self._run(
+            self._fetchone,
+            "SELECT id, username, email FROM person WHERE username = %s OR email = %s",
+            (username, email),
+        )
+
+    async def find_person(self, id: int) -> Row | None:
+        return await self._run(
+            self._fetchone, f"SELECT {PERSON_COLUMNS} FROM person WHERE id = %s", (id,)
+        )
+
+    async def find_persons(self, ids: List[int]) -> List[Row]:
+        if not ids:
+            return []
+        placeholders = ", ".join(["%s"] * len(ids))
+        return await self._run(
+            self._fetchall,
+            f"SELECT {PERSON_COLUMNS} FROM person WHERE id IN ({placeholders})",
+            tuple(ids),
+        )
+
+    async def find_person_by_email(self, email: str) -> Row | None:
+        return await self._run(
+            self._fetchone,
+            "SELECT id, username, password FROM person WHERE email = %s",
+            (email,),
+        )
+
+    async def update_password(self, id: int, old_password: str, password: str) -> bool:
+        """
+        Replace the password hash of person id, unless it is no longer
+        old_password. Returns whether it was replaced.
+        """
+        changed = await self._run(
+            self._write_many,
+            "UPDATE person SET password = %s WHERE id = %s AND password = %s",
+            [(password, id, old_password)],
+        )
+        return changed > 0
+
+    async def insert_person(
+        self,
+        email: str,
+        username: str,
+        password: str,
+        gender: bytes,
+        city: bytes,
+        phone_number: bytes,
+        private_key: bytes,
+        key_version: int,
+        decrypt_frequency: bytes,
+    ) -> int:
+        return await self._run(
+            self._write,
+            "INSERT INTO person (email, username, password, gender, city, phone_number, private_key, key_version, decrypt_frequency) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            (
+                email,
+                username,
+                password,
+                gender,
+                city,
+                phone_number,
+                private_key,
+                key_version,
+                decrypt_frequency,
+            ),
+        )
+
+    async def find_existing_persons(
+        self, usernames: List[str], emails: List[str]
+    ) -> List[Row]:
+        """username and email of the persons with any of usernames or emails"""
+        if not usernames and not emails:
+            return []
+        username_placeholders = ", ".join(["%s"] * len(usernames)) or "NULL"
+        email_placeholders = ", ".join(["%s"] * len(emails)) or "NULL"
+        return await self._run(
+            self._fetchall,
+            f"SELECT username, email FROM person WHERE username IN ({username_placeholders}) OR email IN ({email_placeholders})",
+            (*usernames, *emails),
+        )
+
+    async def insert_persons(
+        self, rows: List[Tuple[str, str, str, bytes, bytes, bytes, bytes, int, bytes]]
+    ) -> List[bool]:
+        """
+        Insert rows with the arguments of insert_person in one transaction.
+        Returns whether each row was inserted, a row is not if its username or
+        email was taken meanwhile.
+        """
+        if not rows:
+            return []
+        return await self._run(
+            self._insert_many,
+            "INSERT INTO person (email, username, password, gender, city, phone_number, private_key, key_version, decrypt_frequency) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            rows,
+        )
+
+    async def list_persons(self, after_id: int, limit: int) -> List[Row]:
+        """Keyset page: the first limit persons with an id above after_id"""
+        return await self._run(
+            self._fetchall,
+            f"SELECT {PERSON_COLUMNS} FROM person WHERE id > %s ORDER BY id LIMIT %s",
+            (after_id, limit),
+        )
+
+    async def _person_batches(
+        self,
+        columns: str,
+        after_id: int,
+        batch_size: int,
+        limit: int | None = None,
+        tuples: bool = False,
+    ) -> AsyncIterator[List]:
+        """
+        Persons with an id above after_id in id order, at most limit of them, in
+        batches of batch_size. Every batch is its own keyset query, so the
+        connection goes back to the pool between batches and a slow consumer holds
+        none. columns must start with id; with tuples, rows are tuples in the
+        order of columns instead of dicts.
+        """
+        fetch = self._fetchall_tuples if tuples else self._fetchall
+        sql = f"SELECT {columns} FROM person WHERE id > %s ORDER BY id LIMIT %s"
+        while limit is None or limit > 0:
+            size = batch_size if limit is None else min(batch_size, limit)
+            rows = await self._run(fetch, sql, (after_id, size))
+            if rows:
+                yield rows
+            if len(rows) < size:
+                break
+            after_id = rows[-1][0] if tuples else rows[-1]["id"]
+            if limit is not None:
+                limit -= len(rows)
+
+    def iter_person_batches(
+        self, after_id: int = 0, limit: int | None = None, batch_size: int = 100
+    ) -> AsyncIterator[List[Row]]:
+        """Persons with an id above after_id, in id order, in batches"""
+        return self._person_batches(PERSON_COLUMNS, after_id, batch_size, limit)
+
+    def export_persons(self, batch_size: int) -> AsyncIterator[List[tuple]]:
+        """Every person in id order, MASKED_PERSON_COLUMNS tuples in batches"""
+        return self._person_batches(
+            ", ".join(MASKED_PERSON_COLUMNS), 0, batch_size, tuples=True
+        )
+
+    async def update_decrypt_frequencies(self, rows: List[Tuple[int, bytes, bytes]]):
+        """
+        Write (id, private_key, decrypt_frequency) rows in one transaction. A row
+        is skipped if its private_key changed, its count was sealed under the old
+        subkey.
+        """
+        await self._run(
+            self._write_many,
+            "UPDATE person SET decrypt_frequency = %s WHERE id = %s AND private_key = %s",
+            [
+                (decrypt_frequency, id, private_key)
+                for id, private_key, decrypt_frequency in rows
+            ],
+        )
+
+    async def rotate_person_keys(
+        self, rows: List[Tuple[int, bytes, bytes, int, Dict[str, bytes]]]
+    ) -> int:
+        """
+        Write (id, old private_key, new private_key, key_version, fields) rows in
+        one transaction, fields being gender, city, phone_number and
+        decrypt_frequency. A row is skipped if its private_key is no longer the
+        old one, so running a batch twice is harmless. Returns the rows changed.
+        """
+        return await self._run(
+            self._write_many,
+            "UPDATE person SET private_key = %s, key_version = %s, gender = %s, city = %s, phone_number = %s, decrypt_frequency = %s WHERE id = %s AND private_key = %s",
+            [
+                (
+                    private_key,
+                    key_version,
+                    fields["gender"],
+                    fields["city"],
+                    fields["phone_number"],
+                    fields["decrypt_frequency"],
+                    id,
+                    old_private_key,
+                )
+                for id, old_private_key, private_key, key_version, fields in rows
+            ],
+        )
+
+    async def list_wrapped_keys(
+        self, after_id: int, limit: int, exclude_version: int
+    ) -> List[Row]:
+        """
+        Keyset page of id, key_version and private_key of the persons whose
+        subkey is not wrapped under master key version exclude_version
+        """
+        return await self._run(
+            self._fetchall,
+            "SELECT id, key_version, private_key FROM person WHERE id > %s AND key_version <> %s ORDER BY id LIMIT %s",
+            (after_id, exclude_version, limit),
+        )
+
+    async def rewrap_person_keys(
+        self, rows: List[Tuple[int, bytes, bytes, int]]
+    ) -> int:
+        """
+        Write (id, old private_key, new private_key, key_version) rows in one
+        transaction, skipping rows whose private_key changed meanwhile. Returns
+        the rows changed.
+        """
+        return await self._run(
+            self._write_many,
+            "UPDATE person SET private_key = %s, key_version = %s WHERE id = %s AND private_key = %s",
+            [
+                (private_key, key_version, id, old_private_key)
+                for id, old_private_key, private_key, key_version in rows
+            ],
+        )
+
+    # refresh token, stored as the SHA-256 digest of the token
+
+    async def insert_refresh_token(
+        self, person_id: int, token_digest: bytes, expires_at: int
+    ):
+        await self._run(
+            self._write,
+            "INSERT INTO person_refresh_token (person_id, token_digest, expires_at) VALUES (%s, %s, %s)",
+            (person_id, token_digest, expires_at),
+        )
+
+    def _rotate_refresh_token(
+        self,
+        person_id: int,
+        old_digest: bytes,
+        token_digest: bytes,
+        expires_at: int,
+        now: int,
+    ) -> bool:
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                self._sql(
+                    "DELETE FROM person_refresh_token WHERE token_digest = %s AND person_id = %s AND expires_at > %s"
+                ),
+                (old_digest, person_id, now),
+            )
+            if cursor.rowcount != 1:
+                connection.rollback()
+                return False
+            cursor.execute(
+                self._sql(
+                    "INSERT INTO person_refresh_token (person_id, token_digest, expires_at) VALUES (%s, %s, %s)"
+                ),
+                (person_id, token_digest, expires_at),
+            )
+            connection.commit()
+            return True
+
+    async def rotate_refresh_token(
+        self,
+        person_id: int,
+        old_digest: bytes,
+        token_digest: bytes,
+        expires_at: int,
+        now: int,
+    ) -> bool:
+        """
+        Replace the refresh token old_digest of person_id, if it has not expired
+        at now, with token_digest in one transaction. Of two concurrent rotations
+        of the same token only one succeeds. Returns whether it was replaced.
+        """
+        return await self._run(
+            self._rotate_refresh_token,
+            person_id,
+            old_digest,
+            token_digest,
+            expires_at,
+            now,
+        )
+
+    async def delete_refresh_token(self, token_digest: bytes):
+        await self._run(
+            self._write,
+            "DELETE FROM person_refresh_token WHERE token_digest = %s",
+            (token_digest,),
+        )
+
+    async def delete_refresh_tokens(self, person_id: int):
+        await self._run(
+            self._write,
+            "DELETE FROM person_refresh_token WHERE person_id = %s",
+            (person_id,),
+        )
+
+    async def delete_expired_refresh_tokens(self, now: int, limit: int) -> int:
+        """
+        Delete at most limit refresh tokens expired at now in one transaction,
+        returns the rows deleted
+        """
+        # MySQL has no LIMIT in an IN subquery, but takes it in a derived table
+        return await self._run(
+            self._write_many,
+            "DELETE FROM person_refresh_token WHERE id IN (SELECT id FROM (SELECT id FROM person_refresh_token WHERE expires_at <= %s LIMIT %s) AS expired)",
+            [(now, limit)],
+        )
+
+    # schema
+
+    def _applied_migrations(self) -> List[int]:
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(SCHEMA_MIGRATION_TABLE)
+            connection.commit()
+            cursor.execute("SELECT version FROM schema_migration ORDER BY version")
+            return [version for (version,) in cursor.fetchall()]
+
+    async def applied_migrations(self) -> List[int]:
+        """The versions of the migrations applied, creates their table if needed"""
+        return await self._run(self._applied_migrations)
+
+    def _apply_migration(self, version: int, name: str, statements: List[str]):
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(
+                self._sql(
+                    "INSERT INTO schema_migration (version, name) VALUES (%s, %s)"
+                ),
+                (version, name),
+            )
+            connection.commit()
+
+    async def apply_migration(self, version: int, name: str, statements: List[str]):
+        """Run the statements of a migration and record it as applied"""
+        await self._run(self._apply_migration, version, name, statements)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "threads": self._threads,
+            "queue_depth": self._queue_depth,
+            "max_queue_depth": self._max_queue_depth,
+            "completed": self._completed,
+        }
+
+
+class MySQLRepository(Repository):
+    name = "mysql"
+    integrity_error = mysql.connector.errors.IntegrityError
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        threads: int,
+        connect_attempts: int = 1,
+        connect_backoff: float = 1.0,
+    ):
+        super().__init__(threads)
+        self.pool = pool
+        self._connect_attempts = connect_attempts
+        self._connect_backoff = connect_backoff
+
+    async def start(self):
+        # opens the pool, also after a shutdown. The database may come up after
+        # the app, so failed attempts are retried with a doubling delay
+        delay = self._connect_backoff
+        for attempt in range(1, self._connect_attempts + 1):
+            try:
+                await asyncio.to_thread(self.pool.open)
+                break
+            except mysql.connector.Error as e:
+                if attempt == self._connect_attempts:
+                    raise
+                logger.warning(
+                    f"Connecting to the database failed ({e}), attempt {attempt} "
+                    f"of {self._connect_attempts}, retrying in {delay:.0f}s"
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_CONNECT_BACKOFF)
+        await super().start()
+
+    def close(self):
+        self.pool.close()
+
+    @contextmanager
+    def connection(self):
+        with self.pool.connection() as connection:
+            yield connection
+
+    def stats(self) -> dict:
+        return {**super().stats(), "pool": self.pool.stats()}
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS person (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(50) NOT NULL UNIQUE,
+    email VARCHAR(255) NOT NULL UNIQUE,
+    password VARCHAR(255) NOT NULL,
+    gender BLOB NOT NULL,
+    city BLOB NOT NULL,
+    phone_number BLOB NOT NULL,
+    private_key BLOB NOT NULL,
+    key_version INTEGER NOT NULL DEFAULT 0,
+    decrypt_frequency BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS person_refresh_token (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    token_digest BLOB NOT NULL UNIQUE,
+    person_id INTEGER NOT NULL REFERENCES person (id) ON DELETE CASCADE,
+    expires_at INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS person_refresh_token_expires_at
+    ON person_refresh_token (expires_at);
+"""
+
+
+class SQLiteRepository(Repository):
+    """
+    Stand-in for MySQL with the same tables, for tests and local runs.
+    One shared connection, so queries are serialised.
+    """
+
+    name = "sqlite"
+    placeholder = "?"
+    integrity_error = sqlite3.IntegrityError
+
+    def __init__(self, path: str = ":memory:"):
+        super().__init__(threads=1)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SQLITE_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._connection.close()
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            try:
+                yield self._connection
+            finally:
+                # same as returning a connection to the pool
+                self._connection.rollback()
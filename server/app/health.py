@@ -1,9 +1,58 @@
-from fastapi import APIRouter
+import logging
 
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from app.api.v1.auth.service import refresh_token_sweeper, token_cache
+from app.api.v1.persons.service import (
+    access_counter,
+    masked_view_cache,
+    person_exporter,
+    profile_cache,
+    rotation_worker,
+)
+from app.preload import crypto, crypto_executor, password_hasher, repository
+
+logger = logging.getLogger("uvicorn")
 
 api_router = APIRouter(prefix="/health")
 
 
 @api_router.get("/")
 async def health():
+    """Liveness: the process answers"""
     return {"status": "ok"}
+
+
+@api_router.get("/ready")
+async def ready(request: Request):
+    """
+    Readiness: the app finished starting, is not shutting down, and the database
+    answers
+    """
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "not ready"})
+    try:
+        await repository.ping()
+    except Exception as e:
+        logger.warning(f"Readiness check failed: {e}")
+        return JSONResponse(status_code=503, content={"status": "not ready"})
+    return {"status": "ready"}
+
+
+@api_router.get("/metrics")
+async def metrics():
+    """The counters of every component, for an authenticated caller only"""
+    return {
+        "crypto": crypto.stats(),
+        "crypto_executor": crypto_executor.stats(),
+        "password_hasher": password_hasher.stats(),
+        "db": repository.stats(),
+        "access_counter": access_counter.stats(),
+        "rotation": rotation_worker.stats(),
+        "export": person_exporter.stats(),
+        "profile_cache": profile_cache.stats(),
+        "masked_view_cache": masked_view_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "refresh_token_sweeper": refresh_token_sweeper.stats(),
+    }
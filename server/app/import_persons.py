@@ -0,0 +1,76 @@
+"""
+Bulk person import from a file.
+
+    make import_persons FILE=customers.csv
+
+The rows are imported by app/api/v1/persons/importer.py. Bulk import is only run
+from here, by whoever can reach the database: the API has no route for it. The
+report goes to stdout as NDJSON as the import runs: one line per row that was not
+imported, then the summary.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from typing import AsyncIterator, BinaryIO
+
+from app.api.v1.persons.importer import FORMATS, import_persons
+from app.preload import crypto_executor, password_hasher, repository, settings
+
+READ_SIZE = 1 << 16
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        prog="python app/import_persons.py",
+        description="Import persons from a CSV (with a header line) or NDJSON file.",
+    )
+    parser.add_argument("file", help="the file to import, - for stdin")
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        help="the format of file (default: csv for a .csv file, ndjson otherwise)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=settings.import_chunk_size,
+        help="rows per transaction (default: %(default)s)",
+    )
+    return parser.parse_args()
+
+
+async def _read(file: BinaryIO) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    while chunk := await loop.run_in_executor(None, file.read, READ_SIZE):
+        yield chunk
+
+
+async def run(file: BinaryIO, format: str, chunk_size: int) -> int:
+    await crypto_executor.start()
+    # no stop to match: the hasher only holds a semaphore and its counters, its
+    # hashes run on crypto_executor, shut down below
+    await password_hasher.start()
+    await repository.start()
+    try:
+        async for entry in import_persons(_read(file), format, chunk_size):
+            print(json.dumps(entry), flush=True)
+    finally:
+        await repository.shutdown()
+        await crypto_executor.shutdown()
+    # the summary is the last entry
+    return 1 if "error" in entry else 0
+
+
+def main() -> int:
+    args = _parse_args()
+    format = args.format or ("csv" if args.file.endswith(".csv") else "ndjson")
+    if args.file == "-":
+        return asyncio.run(run(sys.stdin.buffer, format, args.chunk_size))
+    with open(args.file, "rb") as file:
+        return asyncio.run(run(file, format, args.chunk_size))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
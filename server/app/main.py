@@ -1,30 +1,120 @@
 import uvicorn
 import logging
-from fastapi import FastAPI
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 from app.middleware import AuthMiddleware
 from app.config import LOGGING_CONFIG
 from app.health import api_router as health_router
 from app.api.v1.route import api_router as api_v1_router
-from app.preload import settings
+from app.api.v1.auth.service import refresh_token_sweeper, token_cache
+from app.api.v1.persons.route import NEXT_AFTER_ID_HEADER
+from app.api.v1.persons.service import (
+    access_counter,
+    profile_cache,
+    rotation_worker,
+)
+from app.crypto.backend import self_test
+from app.db.pool import PoolTimeout
+from app.password_hasher import PasswordHasherBusy
+from app.preload import crypto, crypto_executor, password_hasher, repository, settings
 
 logger = logging.getLogger("uvicorn")
 
 
+def _process_seconds() -> float | None:
+    """
+    Wall time since this process started, interpreter start and imports included,
+    from /proc. None where there is no /proc
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # the command name may hold spaces, the fields after it do not
+            fields = f.read().rpartition(")")[2].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        # field 22, starttime, in clock ticks since boot
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - started
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # cold start: the process so far was nearly all imports
+    import_seconds = _process_seconds()
+    startup_start = time.perf_counter()
+    logger.info(f"Settings: {settings.redacted()}")
+    # refuse to serve if the selected crypto backend disagrees with the others
+    self_test(crypto)
+    await crypto_executor.start()
+    await password_hasher.start()
+    await repository.start()
+    await rotation_worker.start()
+    await access_counter.start()
+    await profile_cache.start()
+    await token_cache.start()
+    await refresh_token_sweeper.start()
+    app.state.ready = True
+    end = time.perf_counter()
+    if import_seconds is None:
+        logger.info(f"Started in {end - startup_start:.2f}s")
+    else:
+        logger.info(
+            f"Started in {end - startup_start:.2f}s, after {import_seconds:.2f}s of "
+            "process start and imports (wall time)"
+        )
+    yield
+    # /health/ready fails from here on, so no new traffic is sent
+    app.state.ready = False
+    await refresh_token_sweeper.stop()
+    await token_cache.stop()
+    await profile_cache.stop()
+    # writes the pending decrypt counts and waits for the rotations it queued,
+    # the rotation worker then needs the repository and crypto to finish
+    await access_counter.stop()
+    await rotation_worker.stop()
+    await repository.shutdown()
+    await crypto_executor.shutdown()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     debug=settings.debug,
     title=settings.title,
     description=settings.description,
     version=settings.version,
 )
 
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    logger.warning(f"Database pool exhausted: {exc}")
+    return JSONResponse(status_code=503, content={"message": "Service unavailable"})
+
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    logger.warning("Too many password hashes waiting")
+    return JSONResponse(
+        status_code=429,
+        content={"message": "Too many requests"},
+        headers={"Retry-After": "1"},
+    )
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_AFTER_ID_HEADER],
 )
 app.add_middleware(AuthMiddleware)
 
@@ -0,0 +1,73 @@
+"""
+Masked view cache.
+
+Every user sees the rows of the others masked: id, email, username and the hex
+of the encrypted fields. Building that JSON per row and request dominated the
+list endpoints, so the encoded JSON object of each row is kept here, for at most
+maxsize rows in LRU order, and spliced into the response bodies as is.
+
+An entry only serves the row it was built from: it is keyed by person id and the
+wrapped subkey as stored, which changes with every re-encryption of the fields.
+The masked view holds nothing secret, so entries do not expire.
+"""
+
+from collections import OrderedDict
+from typing import Iterable, Tuple
+
+
+class MaskedViewCache:
+    """Only touched from the event loop, no lock needed. maxsize 0 disables it."""
+
+    def __init__(self, maxsize: int):
+        self._maxsize = maxsize
+        # id -> (wrapped subkey, JSON object)
+        self._views: OrderedDict[int, Tuple[bytes, bytes]] = OrderedDict()
+
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, id: int, wrapped_key: bytes) -> bytes | None:
+        """The masked view of person id, if cached for the row whose subkey is
+        stored as wrapped_key"""
+        view = self._views.get(id)
+        if view is not None and view[0] == wrapped_key:
+            self._views.move_to_end(id)
+            self._hits += 1
+            return view[1]
+
+        if view is not None:
+            del self._views[id]
+            self._stale += 1
+        self._misses += 1
+        return None
+
+    def put(self, id: int, wrapped_key: bytes, view: bytes):
+        if self._maxsize == 0:
+            return
+        self._views[id] = (wrapped_key, view)
+        self._views.move_to_end(id)
+        while len(self._views) > self._maxsize:
+            self._views.popitem(last=False)
+            self._evictions += 1
+
+    def invalidate(self, ids: Iterable[int]):
+        """Drop the entries of rows that were rewritten"""
+        for id in ids:
+            if self._views.pop(id, None) is not None:
+                self._invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "size": len(self._views),
+            "maxsize": self._maxsize,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / lookups if lookups else 0.0,
+            "stale": self._stale,
+            "evictions": self._evictions,
+            "invalidations": self._invalidations,
+        }
@@ -1,75 +1,81 @@
 import logging
-import jwt
-from fastapi import Request
+from typing import Dict, FrozenSet
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from app.preload import settings
+from starlette.types import ASGIApp, Receive, Scope, Send
+from app.api.v1.auth.service import verify_authorization
 
 logger = logging.getLogger("uvicorn")
 
+# paths served without a token, with the methods that may skip it (None for all)
+PUBLIC_ROUTES: Dict[str, FrozenSet[str] | None] = {
+    "/health": None,
+    "/health/ready": None,
+    "/api/v1/auth/authorize": None,
+    "/api/v1/auth/login": None,
+    "/api/v1/auth/refresh": None,
+    "/api/v1/auth/signup": None,
+    "/api/v1/auth/logout": None,
+    # signing up
+    "/api/v1/persons": frozenset(["POST"]),
+}
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        global logger
+# the methods of the other paths that may skip the token
+_PROTECTED: FrozenSet[str] = frozenset()
 
-        logger.debug(f"Request: {request.method} {request.url.path}")
 
-        # Skip authentication for CORS preflight (OPTIONS)
-        if request.method == "OPTIONS":
-            return await call_next(request)
+def _compile_policies(
+    routes: Dict[str, FrozenSet[str] | None],
+) -> Dict[str, FrozenSet[str] | None]:
+    """The routes keyed by their path with and without the trailing slash"""
+    policies = {}
+    for path, methods in routes.items():
+        policies[path] = methods
+        policies[path + "/"] = methods
+    return policies
+
 
-        url_path = request.url.path.rstrip("/")
+class AuthMiddleware:
+    """
+    Plain ASGI middleware: the request and the response pass through untouched,
+    a request without a valid token gets the 401 of verify_authorization. The id
+    of the user goes to request.state.user_id.
+    """
 
-        if url_path in [
-            "/health",
-            "/api/v1/auth/authorize",
-            "/api/v1/auth/login",
-            "/api/v1/auth/refresh",
-            "/api/v1/auth/signup",
-            "/api/v1/auth/logout",
-        ]:
-            response = await call_next(request)
-            return response
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._policies = _compile_policies(PUBLIC_ROUTES)
 
-        if url_path.startswith("/api/v1/persons") and request.method in [
-            "POST",
-        ]:
-            response = await call_next(request)
-            return response
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-        # add your auth logic here
-        auth_key = request.headers.get("Authorization")
-        if auth_key is None:
-            logger.debug("Unauthorized")
-            return JSONResponse(status_code=401, content={"message": "Unauthorized"})
+        method = scope["method"]
+        path = scope["path"]
+        logger.debug("Request: %s %s", method, path)
+
+        # Skip authentication for CORS preflight (OPTIONS)
+        if method == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
 
-        components = auth_key.split(" ")
-        if len(components) != 2:
-            logger.debug(f"Invalid token: {auth_key} (the length is not 2)")
-            return JSONResponse(
-                status_code=401, content={"message": "Unauthorized token"}
-            )
+        methods = self._policies.get(path, _PROTECTED)
+        if methods is _PROTECTED and path.endswith("//"):
+            methods = self._policies.get(path.rstrip("/"), _PROTECTED)
+        if methods is None or method in methods:
+            await self.app(scope, receive, send)
+            return
 
-        if components[0] != "Bearer":
-            logger.debug(f"Invalid token: {auth_key} (the type is not Bearer)")
-            return JSONResponse(
-                status_code=401, content={"message": "Unauthorized token"}
-            )
+        auth_key = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                auth_key = value.decode("latin-1")
+                break
 
-        jwt_token = components[1]
-        try:
-            logger.debug(f"Decoding token: {jwt_token}")
-            decoded_token = jwt.decode(
-                jwt_token, settings.jwt_secret, algorithms=["HS256"]
-            )
-            id = int(str(decoded_token["id"]))
-            request.state.user_id = id
-        except jwt.ExpiredSignatureError:
-            logger.debug(f"Token expired: {jwt_token}")
-            return JSONResponse(status_code=401, content={"message": "Token expired"})
-        except jwt.InvalidTokenError:
-            logger.debug(f"Invalid token: {jwt_token}")
-            return JSONResponse(status_code=401, content={"message": "Invalid token"})
+        user_id = verify_authorization(auth_key)
+        if isinstance(user_id, JSONResponse):
+            await user_id(scope, receive, send)
+            return
+        scope.setdefault("state", {})["user_id"] = user_id
 
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send)
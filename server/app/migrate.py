@@ -0,0 +1,80 @@
+"""
+Schema migrations.
+
+    make migrate
+
+Applies the migrations of database/migrations/ the database has not recorded
+yet, in version order, see app/db/migrations.py. Stops at the first one that
+fails; fix it and run again, the ones applied before are not run twice.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from app.db.migrations import MIGRATIONS_DIR, load_migrations
+from app.preload import repository, settings
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        prog="python app/migrate.py",
+        description="Apply the pending schema migrations.",
+    )
+    parser.add_argument(
+        "--dir",
+        default=MIGRATIONS_DIR,
+        help="the migration files (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only list the pending migrations",
+    )
+    return parser.parse_args()
+
+
+async def migrate(path: str, dry_run: bool) -> int:
+    if settings.db_backend != "mysql":
+        # created with the current schema by the repository
+        print(f"Nothing to migrate on {settings.db_backend}")
+        return 0
+
+    try:
+        migrations = load_migrations(path)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    await repository.start()
+    try:
+        applied = set(await repository.applied_migrations())
+        pending = [m for m in migrations if m[0] not in applied]
+        if not pending:
+            print("The schema is up to date")
+            return 0
+
+        for version, name, statements in pending:
+            if dry_run:
+                print(f"Pending {version} {name}")
+                continue
+            print(f"Applying {version} {name}")
+            try:
+                await repository.apply_migration(version, name, statements)
+            except Exception as e:
+                print(f"Migration {version} {name} failed: {e}", file=sys.stderr)
+                return 1
+    finally:
+        await repository.shutdown()
+
+    if not dry_run:
+        print(f"Done, {len(pending)} migrations applied")
+    return 0
+
+
+def main() -> int:
+    args = _parse_args()
+    return asyncio.run(migrate(args.dir, args.dry_run))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
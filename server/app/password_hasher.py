@@ -0,0 +1,176 @@
+"""
+Password hashing service.
+
+bcrypt runs on the crypto executor, but a burst of logins could still queue
+without limit in front of it and hold every worker away from the AES jobs. Here
+at most concurrency hashes run at a time and at most max_waiting more wait for
+their turn; a login or signup beyond that gets PasswordHasherBusy, answered with
+429. The batches of the bulk import CLI wait for a slot but are never turned away.
+
+The bcrypt cost is pinned by ROUNDS, the same on every host and start, so the
+replicas agree on it. start only measures a cheap hash on the executor and logs
+how long a hash of that cost takes here, and the highest cost (never less than
+MIN_ROUNDS) whose hash would take at most target_ms: a hint for ROUNDS, never
+applied by itself.
+
+A stored hash of a lower cost is replaced with one of the current cost when its
+user logs in, see needs_rehash. Hashes are never moved to a lower cost.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List
+
+from app.crypto.executor import CryptoExecutor
+
+logger = logging.getLogger("uvicorn")
+
+# bcrypt's default
+MIN_ROUNDS = 12
+MAX_ROUNDS = 31
+# the cost measured by the calibration, cheap enough to run at every start
+CALIBRATION_ROUNDS = 8
+CALIBRATION_RUNS = 3
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def hash_rounds(hashed: bytes) -> int | None:
+    """The cost of a bcrypt hash ($2b$12$...), None if it is not one"""
+    parts = hashed.split(b"$")
+    if len(parts) != 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+class PasswordHasher:
+    """Only touched from the event loop, no lock needed. Started by the app lifespan"""
+
+    def __init__(
+        self,
+        executor: CryptoExecutor,
+        rounds: int,
+        target_ms: int,
+        concurrency: int,
+        max_waiting: int,
+    ):
+        self._executor = executor
+        self._rounds = rounds
+        self._target_ms = target_ms
+        self._concurrency = concurrency
+        self._max_waiting = max_waiting
+        self._slots: asyncio.Semaphore | None = None
+        self._calibrated_ms = 0.0
+
+        self._running = 0
+        self._waiting = 0
+        self._max_waiting_seen = 0
+        self._hashes = 0
+        self._checks = 0
+        self._rehashes = 0
+        self._rejected = 0
+
+    @property
+    def rounds(self) -> int:
+        return self._rounds
+
+    async def start(self):
+        self._slots = asyncio.Semaphore(self._concurrency)
+        await self._calibrate()
+
+    async def _calibrate(self):
+        password = b"calibration"
+        elapsed = []
+        for _ in range(CALIBRATION_RUNS):
+            start = time.perf_counter()
+            await self._executor.hash_password(password, CALIBRATION_ROUNDS)
+            elapsed.append(time.perf_counter() - start)
+        # every extra round doubles the work
+        base_ms = min(elapsed) * 1000
+        rounds = CALIBRATION_ROUNDS
+        while (
+            rounds < MAX_ROUNDS
+            and base_ms * 2 ** (rounds + 1 - CALIBRATION_ROUNDS) <= self._target_ms
+        ):
+            rounds += 1
+        rounds = max(rounds, MIN_ROUNDS)
+        self._calibrated_ms = base_ms * 2 ** (self._rounds - CALIBRATION_ROUNDS)
+        logger.info(
+            f"Password hashing at {self._rounds} rounds takes about "
+            f"{self._calibrated_ms:.0f}ms here, {rounds} rounds would fit the "
+            f"target of {self._target_ms}ms"
+        )
+        if self._rounds < MIN_ROUNDS:
+            logger.warning(
+                f"ROUNDS is {self._rounds}, below the bcrypt default of {MIN_ROUNDS}"
+            )
+
+    @asynccontextmanager
+    async def _slot(self, reject: bool):
+        if reject and self._running + self._waiting >= (
+            self._concurrency + self._max_waiting
+        ):
+            self._rejected += 1
+            raise PasswordHasherBusy()
+
+        self._waiting += 1
+        self._max_waiting_seen = max(self._max_waiting_seen, self._waiting)
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._running += 1
+        try:
+            yield
+        finally:
+            self._running -= 1
+            self._slots.release()
+
+    async def hash(self, password: bytes) -> bytes:
+        """Raises PasswordHasherBusy if too many hashes are waiting"""
+        async with self._slot(reject=True):
+            self._hashes += 1
+            return await self._executor.hash_password(password, self._rounds)
+
+    async def hash_many(self, passwords: List[bytes]) -> List[bytes]:
+        """A batch spread over every worker, waits for a slot however long"""
+        async with self._slot(reject=False):
+            self._hashes += len(passwords)
+            return await self._executor.hash_passwords(passwords, self._rounds)
+
+    async def check(self, password: bytes, hashed: bytes) -> bool:
+        """Raises PasswordHasherBusy if too many hashes are waiting"""
+        async with self._slot(reject=True):
+            self._checks += 1
+            return await self._executor.check_password(password, hashed)
+
+    def needs_rehash(self, hashed: bytes) -> bool:
+        """Whether hashed is of a lower cost than the current one"""
+        rounds = hash_rounds(hashed)
+        return rounds is not None and rounds < self._rounds
+
+    async def rehash(self, password: bytes) -> bytes:
+        """Like hash, counted as a rehash in the stats"""
+        hashed = await self.hash(password)
+        self._rehashes += 1
+        return hashed
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self._rounds,
+            "target_ms": self._target_ms,
+            "calibrated_ms": self._calibrated_ms,
+            "concurrency": self._concurrency,
+            "max_waiting": self._max_waiting,
+            "running": self._running,
+            "waiting": self._waiting,
+            "max_waiting_seen": self._max_waiting_seen,
+            "hashes": self._hashes,
+            "checks": self._checks,
+            "rehashes": self._rehashes,
+            "rejected": self._rejected,
+        }
@@ -1,6 +1,15 @@
 import os
-import sys
 import mysql.connector
+from mysql.connector.abstracts import MySQLConnectionAbstract
+
+from app.crypto.backend import create_backend
+from app.crypto.executor import CryptoExecutor
+from app.db.pool import ConnectionPool
+from app.db.repository import MySQLRepository, Repository, SQLiteRepository
+from app.password_hasher import PasswordHasher
+
+# never logged
+SECRET_SETTINGS = ("db_password", "jwt_secret", "master_key", "master_keys")
 
 
 class Settings:
@@ -8,6 +17,28 @@ class Settings:
         master_key = os.getenv("MASTER_KEY")
         assert master_key is not None, "MASTER_KEY must be provided"
 
+        master_key_version = os.getenv("MASTER_KEY_VERSION")
+        if master_key_version is not None and not master_key_version.isnumeric():
+            raise ValueError("MASTER_KEY_VERSION must be a number")
+        master_key_version = (
+            int(master_key_version) if master_key_version is not None else 0
+        )
+
+        # keys of wraps not yet moved to MASTER_KEY, as version:key pairs
+        master_keys = {master_key_version: bytes.fromhex(master_key)}
+        previous_master_keys = os.getenv("PREVIOUS_MASTER_KEYS")
+        for pair in (previous_master_keys or "").split(","):
+            if not pair:
+                continue
+            version, _, key = pair.partition(":")
+            if not version.isnumeric() or not key:
+                raise ValueError(
+                    "PREVIOUS_MASTER_KEYS must be a comma separated list of version:key"
+                )
+            if int(version) in master_keys:
+                raise ValueError(f"Master key version {version} is given twice")
+            master_keys[int(version)] = bytes.fromhex(key)
+
         subkey_rotation_counter = os.getenv("SUBKEY_ROTATION_COUNTER")
         if (
             subkey_rotation_counter is not None
@@ -16,6 +47,72 @@ class Settings:
         ):
             raise ValueError("SUBKEY_ROTATION_COUNTER must be a non-negative number")
 
+        access_flush_interval = os.getenv("ACCESS_FLUSH_INTERVAL")
+        if access_flush_interval is not None and (
+            not access_flush_interval.isnumeric() or int(access_flush_interval) < 1
+        ):
+            raise ValueError("ACCESS_FLUSH_INTERVAL must be a positive number")
+
+        access_flush_max_pending = os.getenv("ACCESS_FLUSH_MAX_PENDING")
+        if access_flush_max_pending is not None and (
+            not access_flush_max_pending.isnumeric()
+            or int(access_flush_max_pending) < 1
+        ):
+            raise ValueError("ACCESS_FLUSH_MAX_PENDING must be a positive number")
+
+        rotation_batch_size = os.getenv("ROTATION_BATCH_SIZE")
+        if rotation_batch_size is not None and (
+            not rotation_batch_size.isnumeric() or int(rotation_batch_size) < 1
+        ):
+            raise ValueError("ROTATION_BATCH_SIZE must be a positive number")
+
+        import_chunk_size = os.getenv("IMPORT_CHUNK_SIZE")
+        if import_chunk_size is not None and (
+            not import_chunk_size.isnumeric() or int(import_chunk_size) < 1
+        ):
+            raise ValueError("IMPORT_CHUNK_SIZE must be a positive number")
+
+        export_batch_size = os.getenv("EXPORT_BATCH_SIZE")
+        if export_batch_size is not None and (
+            not export_batch_size.isnumeric() or int(export_batch_size) < 1
+        ):
+            raise ValueError("EXPORT_BATCH_SIZE must be a positive number")
+
+        profile_cache_size = os.getenv("PROFILE_CACHE_SIZE")
+        if profile_cache_size is not None and not profile_cache_size.isnumeric():
+            raise ValueError("PROFILE_CACHE_SIZE must be a number")
+
+        profile_cache_ttl = os.getenv("PROFILE_CACHE_TTL")
+        if profile_cache_ttl is not None and (
+            not profile_cache_ttl.isnumeric() or int(profile_cache_ttl) < 1
+        ):
+            raise ValueError("PROFILE_CACHE_TTL must be a positive number")
+
+        masked_view_cache_size = os.getenv("MASKED_VIEW_CACHE_SIZE")
+        if (
+            masked_view_cache_size is not None
+            and not masked_view_cache_size.isnumeric()
+        ):
+            raise ValueError("MASKED_VIEW_CACHE_SIZE must be a number")
+
+        refresh_token_sweep_interval = os.getenv("REFRESH_TOKEN_SWEEP_INTERVAL")
+        if refresh_token_sweep_interval is not None and (
+            not refresh_token_sweep_interval.isnumeric()
+            or int(refresh_token_sweep_interval) < 1
+        ):
+            raise ValueError("REFRESH_TOKEN_SWEEP_INTERVAL must be a positive number")
+
+        refresh_token_sweep_batch_size = os.getenv("REFRESH_TOKEN_SWEEP_BATCH_SIZE")
+        if refresh_token_sweep_batch_size is not None and (
+            not refresh_token_sweep_batch_size.isnumeric()
+            or int(refresh_token_sweep_batch_size) < 1
+        ):
+            raise ValueError("REFRESH_TOKEN_SWEEP_BATCH_SIZE must be a positive number")
+
+        token_cache_size = os.getenv("TOKEN_CACHE_SIZE")
+        if token_cache_size is not None and not token_cache_size.isnumeric():
+            raise ValueError("TOKEN_CACHE_SIZE must be a number")
+
         port = os.getenv("PORT")
         if port is not None and not port.isnumeric():
             raise ValueError("PORT must be a number")
@@ -24,10 +121,61 @@ class Settings:
         if debug is not None and debug not in ["True", "False"]:
             raise ValueError("DEBUG must be a boolean")
 
+        cipher_cache_size = os.getenv("CIPHER_CACHE_SIZE")
+        if cipher_cache_size is not None and (
+            not cipher_cache_size.isnumeric() or int(cipher_cache_size) < 1
+        ):
+            raise ValueError("CIPHER_CACHE_SIZE must be a positive number")
+
+        crypto_backend = os.getenv("CRYPTO_BACKEND")
+        if crypto_backend is not None and crypto_backend not in [
+            "auto",
+            "python",
+            "native",
+        ]:
+            raise ValueError("CRYPTO_BACKEND must be one of auto, python, native")
+
+        crypto_processes = os.getenv("CRYPTO_PROCESSES")
+        if crypto_processes is not None and not crypto_processes.isnumeric():
+            raise ValueError("CRYPTO_PROCESSES must be a number")
+
+        crypto_threads = os.getenv("CRYPTO_THREADS")
+        if crypto_threads is not None and (
+            not crypto_threads.isnumeric() or int(crypto_threads) < 1
+        ):
+            raise ValueError("CRYPTO_THREADS must be a positive number")
+
+        crypto_thread_max_bytes = os.getenv("CRYPTO_THREAD_MAX_BYTES")
+        if (
+            crypto_thread_max_bytes is not None
+            and not crypto_thread_max_bytes.isnumeric()
+        ):
+            raise ValueError("CRYPTO_THREAD_MAX_BYTES must be a number")
+
         rounds = os.getenv("ROUNDS")
         if rounds is not None and not rounds.isnumeric():
             raise ValueError("ROUNDS must be a number")
 
+        password_hash_target_ms = os.getenv("PASSWORD_HASH_TARGET_MS")
+        if password_hash_target_ms is not None and (
+            not password_hash_target_ms.isnumeric() or int(password_hash_target_ms) < 1
+        ):
+            raise ValueError("PASSWORD_HASH_TARGET_MS must be a positive number")
+
+        password_hash_concurrency = os.getenv("PASSWORD_HASH_CONCURRENCY")
+        if password_hash_concurrency is not None and (
+            not password_hash_concurrency.isnumeric()
+            or int(password_hash_concurrency) < 1
+        ):
+            raise ValueError("PASSWORD_HASH_CONCURRENCY must be a positive number")
+
+        password_hash_max_waiting = os.getenv("PASSWORD_HASH_MAX_WAITING")
+        if (
+            password_hash_max_waiting is not None
+            and not password_hash_max_waiting.isnumeric()
+        ):
+            raise ValueError("PASSWORD_HASH_MAX_WAITING must be a number")
+
         jwt_secret = os.getenv("JWT_SECRET")
         assert jwt_secret is not None, "JWT_SECRET must be provided"
 
@@ -42,17 +190,46 @@ class Settings:
         origins = os.getenv("ORIGINS")
         origins = [] if origins is None else origins.split(",")
 
-        host = os.getenv("DB_HOST")
-        assert host is not None, "DB_HOST must be provided"
+        db_backend = os.getenv("DB_BACKEND")
+        if db_backend is not None and db_backend not in ["mysql", "sqlite"]:
+            raise ValueError("DB_BACKEND must be one of mysql, sqlite")
+        db_backend = db_backend or "mysql"
 
+        host = os.getenv("DB_HOST")
         user = os.getenv("DB_USER")
-        assert user is not None, "DB_USER must be provided"
-
         password = os.getenv("DB_PASSWORD")
-        assert password is not None, "DB_PASSWORD must be provided"
-
         database = os.getenv("DB_DATABASE")
-        assert database is not None, "DB_DATABASE must be provided"
+        if db_backend == "mysql":
+            assert host is not None, "DB_HOST must be provided"
+            assert user is not None, "DB_USER must be provided"
+            assert password is not None, "DB_PASSWORD must be provided"
+            assert database is not None, "DB_DATABASE must be provided"
+
+        db_pool_min_size = os.getenv("DB_POOL_MIN_SIZE")
+        if db_pool_min_size is not None and not db_pool_min_size.isnumeric():
+            raise ValueError("DB_POOL_MIN_SIZE must be a number")
+
+        db_pool_max_size = os.getenv("DB_POOL_MAX_SIZE")
+        if db_pool_max_size is not None and (
+            not db_pool_max_size.isnumeric() or int(db_pool_max_size) < 1
+        ):
+            raise ValueError("DB_POOL_MAX_SIZE must be a positive number")
+
+        db_pool_timeout = os.getenv("DB_POOL_TIMEOUT")
+        if db_pool_timeout is not None and not db_pool_timeout.isnumeric():
+            raise ValueError("DB_POOL_TIMEOUT must be a number")
+
+        db_connect_attempts = os.getenv("DB_CONNECT_ATTEMPTS")
+        if db_connect_attempts is not None and (
+            not db_connect_attempts.isnumeric() or int(db_connect_attempts) < 1
+        ):
+            raise ValueError("DB_CONNECT_ATTEMPTS must be a positive number")
+
+        db_connect_backoff = os.getenv("DB_CONNECT_BACKOFF")
+        if db_connect_backoff is not None and (
+            not db_connect_backoff.isnumeric() or int(db_connect_backoff) < 1
+        ):
+            raise ValueError("DB_CONNECT_BACKOFF must be a positive number")
 
         self.version = os.getenv("VERSION") or "v1"
         self.port = int(port) if port is not None else 8200
@@ -60,10 +237,40 @@ class Settings:
         self.title = os.getenv("TITLE") or "FastAPI"
         self.description = os.getenv("DESCRIPTION") or "FastAPI application"
         self.rounds = int(rounds) if rounds is not None else 12
+        self.password_hash_target_ms = (
+            int(password_hash_target_ms) if password_hash_target_ms is not None else 250
+        )
+        self.password_hash_concurrency = (
+            int(password_hash_concurrency)
+            if password_hash_concurrency is not None
+            else 2
+        )
+        self.password_hash_max_waiting = (
+            int(password_hash_max_waiting)
+            if password_hash_max_waiting is not None
+            else 32
+        )
+        self.db_backend = db_backend
         self.db_host = host
         self.db_user = user
         self.db_password = password
-        self.db_database = database
+        # for sqlite, the database file
+        self.db_database = database or ":memory:"
+        self.db_pool_min_size = (
+            int(db_pool_min_size) if db_pool_min_size is not None else 1
+        )
+        self.db_pool_max_size = (
+            int(db_pool_max_size) if db_pool_max_size is not None else 10
+        )
+        self.db_pool_timeout = (
+            int(db_pool_timeout) if db_pool_timeout is not None else 5
+        )  # seconds
+        self.db_connect_attempts = (
+            int(db_connect_attempts) if db_connect_attempts is not None else 5
+        )
+        self.db_connect_backoff = (
+            int(db_connect_backoff) if db_connect_backoff is not None else 1
+        )  # seconds, doubled after every failed attempt
         self.jwt_secret = jwt_secret
         self.at_duration_minutes = (
             int(at_duration_minutes) if at_duration_minutes is not None else 15
@@ -73,11 +280,72 @@ class Settings:
         )  # 1 day
         self.origins = origins
         self.master_key = bytes.fromhex(master_key)
+        self.master_key_version = master_key_version
+        self.master_keys = master_keys
         self.subkey_rotation_counter = (
             int(subkey_rotation_counter) if subkey_rotation_counter is not None else 5
         )
+        self.access_flush_interval = (
+            int(access_flush_interval) if access_flush_interval is not None else 5
+        )  # seconds
+        self.access_flush_max_pending = (
+            int(access_flush_max_pending)
+            if access_flush_max_pending is not None
+            else 1000
+        )
+        self.rotation_batch_size = (
+            int(rotation_batch_size) if rotation_batch_size is not None else 100
+        )
+        self.import_chunk_size = (
+            int(import_chunk_size) if import_chunk_size is not None else 500
+        )
+        self.export_batch_size = (
+            int(export_batch_size) if export_batch_size is not None else 1000
+        )
+        self.profile_cache_size = (
+            int(profile_cache_size) if profile_cache_size is not None else 1024
+        )
+        self.profile_cache_ttl = (
+            int(profile_cache_ttl) if profile_cache_ttl is not None else 30
+        )
+        self.masked_view_cache_size = (
+            int(masked_view_cache_size)
+            if masked_view_cache_size is not None
+            else 100000
+        )
+        self.refresh_token_sweep_interval = (
+            int(refresh_token_sweep_interval)
+            if refresh_token_sweep_interval is not None
+            else 300
+        )
+        self.refresh_token_sweep_batch_size = (
+            int(refresh_token_sweep_batch_size)
+            if refresh_token_sweep_batch_size is not None
+            else 1000
+        )
+        self.token_cache_size = (
+            int(token_cache_size) if token_cache_size is not None else 4096
+        )
+        self.cipher_cache_size = (
+            int(cipher_cache_size) if cipher_cache_size is not None else 128
+        )
+        self.crypto_backend = crypto_backend or "auto"
+        self.crypto_processes = (
+            int(crypto_processes)
+            if crypto_processes is not None
+            else min(4, os.cpu_count() or 1)
+        )
+        self.crypto_threads = int(crypto_threads) if crypto_threads is not None else 4
+        self.crypto_thread_max_bytes = (
+            int(crypto_thread_max_bytes) if crypto_thread_max_bytes is not None else 256
+        )
 
-        print(f"Settings: {self.__dict__}")
+    def redacted(self) -> dict:
+        """The settings to log, secrets masked"""
+        return {
+            name: "***" if name in SECRET_SETTINGS else value
+            for name, value in self.__dict__.items()
+        }
 
 
 # remember to update the path when adding new modules
@@ -98,16 +366,55 @@ class Settings:
 # print("Resolving path")
 # resolve_path()
 
-print("pythonpath:", sys.path)
-
-print("Loading settings")
+# parsing the environment is all that happens at import, the database and the
+# crypto workers are started by the app lifespan
 settings = Settings()
 
-print("Connecting to MySQL")
-mydb = mysql.connector.connect(
-    host=settings.db_host,
-    user=settings.db_user,
-    password=settings.db_password,
-    database=settings.db_database,
-    port=3306,
+
+def _connect() -> MySQLConnectionAbstract:
+    return mysql.connector.connect(
+        host=settings.db_host,
+        user=settings.db_user,
+        password=settings.db_password,
+        database=settings.db_database,
+        port=3306,
+    )
+
+
+if settings.db_backend == "mysql":
+    # opened by repository.start
+    db_pool = ConnectionPool(
+        _connect,
+        min_size=settings.db_pool_min_size,
+        max_size=settings.db_pool_max_size,
+        acquire_timeout=settings.db_pool_timeout,
+    )
+    # more threads than connections would only wait on the pool
+    repository: Repository = MySQLRepository(
+        db_pool,
+        threads=settings.db_pool_max_size,
+        connect_attempts=settings.db_connect_attempts,
+        connect_backoff=settings.db_connect_backoff,
+    )
+else:
+    repository = SQLiteRepository(settings.db_database)
+
+crypto = create_backend(settings.crypto_backend, cache_size=settings.cipher_cache_size)
+
+# started and stopped by the app lifespan, like the repository
+crypto_executor = CryptoExecutor(
+    crypto,
+    processes=settings.crypto_processes,
+    threads=settings.crypto_threads,
+    thread_max_bytes=settings.crypto_thread_max_bytes,
+    cache_size=settings.cipher_cache_size,
+)
+
+# started by the app lifespan, after the crypto executor it runs on
+password_hasher = PasswordHasher(
+    crypto_executor,
+    rounds=settings.rounds,
+    target_ms=settings.password_hash_target_ms,
+    concurrency=settings.password_hash_concurrency,
+    max_waiting=settings.password_hash_max_waiting,
 )
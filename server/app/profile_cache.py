@@ -0,0 +1,157 @@
+"""
+Decrypted profile cache.
+
+A user reading their own row costs unwrapping the subkey under the master key
+and opening every field, and dashboards poll. The subkey and the decrypted fields
+are kept here for ttl seconds, for at most maxsize users in LRU order.
+
+An entry only serves the row it was decrypted from: it is keyed by person id and
+the wrapped subkey as stored, which changes whenever the row is re-encrypted, so
+a row rewritten by another process (or the master key rotation) misses too.
+create_user and the subkey rotation also drop the entries of their rows.
+
+Entries live in the memory of this process only, they are never sent to the
+crypto workers or written anywhere. The subkey and the fields are kept in
+bytearrays and overwritten with zeros when an entry is dropped; the str copies
+handed to the responses are left to the garbage collector.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple
+
+
+class _Profile:
+    __slots__ = ("wrapped_key", "private_key", "fields", "expires")
+
+    def __init__(
+        self,
+        wrapped_key: bytes,
+        private_key: bytes,
+        fields: Dict[str, str],
+        expires: float,
+    ):
+        self.wrapped_key = wrapped_key
+        self.private_key = bytearray(private_key)
+        self.fields = {
+            name: bytearray(value.encode("utf-8")) for name, value in fields.items()
+        }
+        self.expires = expires
+
+    def zeroize(self):
+        for value in (self.private_key, *self.fields.values()):
+            value[:] = bytes(len(value))
+
+
+class ProfileCache:
+    """
+    Only touched from the event loop, no lock needed. start and stop are called
+    by the app lifespan; maxsize 0 disables the cache.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._profiles: OrderedDict[int, _Profile] = OrderedDict()
+        self._task: asyncio.Task | None = None
+
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+        self._expired = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Drop every entry"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.clear()
+
+    async def _run(self):
+        # expired entries are dropped even if nobody reads them again
+        while True:
+            await asyncio.sleep(self._ttl)
+            now = time.monotonic()
+            for id in [id for id, p in self._profiles.items() if p.expires <= now]:
+                self._drop(id)
+                self._expired += 1
+
+    def _drop(self, id: int) -> bool:
+        profile = self._profiles.pop(id, None)
+        if profile is None:
+            return False
+        profile.zeroize()
+        return True
+
+    def get(self, id: int, wrapped_key: bytes) -> Tuple[bytes, Dict[str, str]] | None:
+        """
+        The subkey and decrypted fields of person id, if cached for the row whose
+        subkey is stored as wrapped_key
+        """
+        profile = self._profiles.get(id)
+        if profile is not None and profile.wrapped_key != wrapped_key:
+            self._drop(id)
+            self._stale += 1
+            profile = None
+        elif profile is not None and profile.expires <= time.monotonic():
+            self._drop(id)
+            self._expired += 1
+            profile = None
+        if profile is None:
+            self._misses += 1
+            return None
+
+        self._profiles.move_to_end(id)
+        self._hits += 1
+        return bytes(profile.private_key), {
+            name: value.decode("utf-8") for name, value in profile.fields.items()
+        }
+
+    def put(
+        self, id: int, wrapped_key: bytes, private_key: bytes, fields: Dict[str, str]
+    ):
+        if self._maxsize == 0:
+            return
+        self._drop(id)
+        self._profiles[id] = _Profile(
+            wrapped_key, private_key, fields, time.monotonic() + self._ttl
+        )
+        while len(self._profiles) > self._maxsize:
+            _, profile = self._profiles.popitem(last=False)
+            profile.zeroize()
+            self._evictions += 1
+
+    def invalidate(self, ids: Iterable[int]):
+        """Drop the entries of rows that were rewritten"""
+        for id in ids:
+            if self._drop(id):
+                self._invalidations += 1
+
+    def clear(self):
+        for id in list(self._profiles):
+            self._drop(id)
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "size": len(self._profiles),
+            "maxsize": self._maxsize,
+            "ttl": self._ttl,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / lookups if lookups else 0.0,
+            "stale": self._stale,
+            "expired": self._expired,
+            "evictions": self._evictions,
+            "invalidations": self._invalidations,
+        }
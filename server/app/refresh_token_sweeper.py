@@ -0,0 +1,86 @@
+"""
+Expired refresh token sweeper.
+
+A refresh token row is only deleted when it is used or its user logs out, so the
+rows of every session that just lapsed piled up. Every interval seconds the
+expired rows are deleted here, batch_size rows per transaction so the sweep
+never holds long locks, until a batch comes back short.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+logger = logging.getLogger("uvicorn")
+
+
+class RefreshTokenSweeper:
+    """
+    delete deletes at most limit tokens expired at now and returns how many. Runs
+    on the event loop; start and stop are called by the app lifespan.
+    """
+
+    def __init__(
+        self,
+        delete: Callable[[int, int], Awaitable[int]],
+        interval: float,
+        batch_size: int,
+    ):
+        self._delete = delete
+        self._interval = interval
+        self._batch_size = batch_size
+        self._task: asyncio.Task | None = None
+
+        self._sweeps = 0
+        self._deleted = 0
+        self._failures = 0
+        self._last_deleted = 0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.sweep()
+            except Exception:
+                # the next sweep tries again
+                self._failures += 1
+                logger.exception("Deleting expired refresh tokens failed")
+
+    async def sweep(self) -> int:
+        """Delete every token expired by now, returns how many"""
+        now = int(time.time())
+        deleted = 0
+        while True:
+            batch = await self._delete(now, self._batch_size)
+            deleted += batch
+            if batch < self._batch_size:
+                break
+        self._sweeps += 1
+        self._deleted += deleted
+        self._last_deleted = deleted
+        if deleted:
+            logger.info(f"Deleted {deleted} expired refresh tokens")
+        return deleted
+
+    def stats(self) -> dict:
+        return {
+            "interval": self._interval,
+            "batch_size": self._batch_size,
+            "sweeps": self._sweeps,
+            "deleted": self._deleted,
+            "failures": self._failures,
+            "last_deleted": self._last_deleted,
+        }
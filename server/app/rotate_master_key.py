@@ -0,0 +1,198 @@
+"""
+Master key rotation.
+
+Every person's subkey is stored wrapped under a master key, tagged with the
+version of that key. To rotate the master key:
+
+1. Set MASTER_KEY and MASTER_KEY_VERSION to the new key and a new version, add
+   the old key to PREVIOUS_MASTER_KEYS as version:key, and restart the server.
+   New and rotated rows get the new key, the others still read with the old one.
+2. Run this tool until it reports nothing left to rewrap:
+
+       make rotate_master_key
+
+3. Remove the old key from PREVIOUS_MASTER_KEYS.
+
+The table is read in id order, a chunk at a time. Each chunk is rewrapped across
+a process pool and committed in one transaction, then its last id is saved to
+the checkpoint file, so an interrupted run resumes after it. Rows already under
+the new key are skipped by the query itself, so a lost checkpoint only costs a
+rescan.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from app.crypto.backend import CryptoBackend, create_backend
+from app.preload import repository, settings
+
+DEFAULT_CHECKPOINT = ".master_key_rotation.json"
+
+# Backend of a worker process, created by _init_worker
+_worker_backend: CryptoBackend | None = None
+
+
+def _init_worker(backend_name: str):
+    global _worker_backend
+    # only the master keys are ever cached
+    _worker_backend = create_backend(backend_name, cache_size=8)
+
+
+def _rewrap(
+    master_keys: Dict[int, bytes], master_key: bytes, rows: List[Tuple[int, bytes]]
+) -> List[bytes]:
+    """(key_version, wrapped subkey) rows to the same subkeys wrapped under master_key"""
+    return [
+        _worker_backend.seal(
+            master_key, _worker_backend.open(master_keys[key_version], wrapped_key)
+        )
+        for key_version, wrapped_key in rows
+    ]
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        prog="python app/rotate_master_key.py",
+        description="Rewrap every subkey under the current MASTER_KEY.",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1000,
+        help="rows per transaction (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="worker processes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=DEFAULT_CHECKPOINT,
+        help="file recording the progress (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="ignore the checkpoint and start from the first row",
+    )
+    return parser.parse_args()
+
+
+def _load_checkpoint(path: str) -> int:
+    """The last id done towards the current master key version"""
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return 0
+    if checkpoint.get("key_version") != settings.master_key_version:
+        # left over from an earlier rotation
+        return 0
+    return int(checkpoint["last_id"])
+
+
+def _save_checkpoint(path: str, last_id: int):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"key_version": settings.master_key_version, "last_id": last_id}, f)
+    os.replace(tmp, path)
+
+
+async def _rewrap_chunk(
+    pool: ProcessPoolExecutor, processes: int, rows: List[dict]
+) -> List[bytes]:
+    loop = asyncio.get_running_loop()
+    size = -(-len(rows) // processes)
+    slices = [rows[i : i + size] for i in range(0, len(rows), size)]
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                pool,
+                _rewrap,
+                settings.master_keys,
+                settings.master_key,
+                [(row["key_version"], row["private_key"]) for row in rows_slice],
+            )
+            for rows_slice in slices
+        )
+    )
+    return [wrapped_key for result in results for wrapped_key in result]
+
+
+async def rotate(
+    chunk_size: int, processes: int, checkpoint: str, restart: bool
+) -> int:
+    after_id = 0 if restart else _load_checkpoint(checkpoint)
+    if after_id:
+        print(f"Resuming after id {after_id}")
+
+    version = settings.master_key_version
+    rewrapped = 0
+    start = time.perf_counter()
+
+    # fork: spawned children would re-import app.preload
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_worker,
+        initargs=(settings.crypto_backend,),
+    ) as pool:
+        await repository.start()
+        try:
+            rows = await repository.list_wrapped_keys(after_id, chunk_size, version)
+            while rows:
+                unknown = {
+                    row["key_version"] for row in rows
+                } - settings.master_keys.keys()
+                if unknown:
+                    print(
+                        f"No master key for versions {sorted(unknown)}, add them to "
+                        "PREVIOUS_MASTER_KEYS",
+                        file=sys.stderr,
+                    )
+                    return 1
+
+                # read the next chunk while this one is rewrapped
+                next_rows = asyncio.create_task(
+                    repository.list_wrapped_keys(rows[-1]["id"], chunk_size, version)
+                )
+                wrapped_keys = await _rewrap_chunk(pool, processes, rows)
+                rewrapped += await repository.rewrap_person_keys(
+                    [
+                        (row["id"], row["private_key"], wrapped_key, version)
+                        for row, wrapped_key in zip(rows, wrapped_keys)
+                    ]
+                )
+                _save_checkpoint(checkpoint, rows[-1]["id"])
+
+                elapsed = time.perf_counter() - start
+                print(
+                    f"Rewrapped {rewrapped} rows up to id {rows[-1]['id']}, "
+                    f"{rewrapped / elapsed:.0f} rows/s"
+                )
+                rows = await next_rows
+        finally:
+            await repository.shutdown()
+
+    print(f"Done, {rewrapped} rows rewrapped to master key version {version}")
+    return 0
+
+
+def main() -> int:
+    args = _parse_args()
+    return asyncio.run(
+        rotate(args.chunk_size, args.processes, args.checkpoint, args.restart)
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
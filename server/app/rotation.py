@@ -0,0 +1,120 @@
+"""
+Subkey rotation queue.
+
+Persons due for rotation are queued by id and rotated in batches by one
+background task: one read, one crypto job and one transaction per batch instead
+of per person, and never on a request.
+
+The queue lives in memory. A batch interrupted before its commit changes
+nothing, and a batch that runs again rotates again: the writes only apply to
+rows whose subkey is still the one that was read. Ids lost in a crash are queued
+again by the next reads of those rows, whose counts are still past the threshold.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List
+
+logger = logging.getLogger("uvicorn")
+
+
+class RotationWorker:
+    """
+    rotate rotates a batch of person ids and returns the number of rows it
+    changed. start and stop are called by the app lifespan.
+    """
+
+    def __init__(self, rotate: Callable[[List[int]], Awaitable[int]], batch_size: int):
+        self._rotate_fn = rotate
+        self._batch_size = batch_size
+
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        # one per queued or running id, resolved when its batch is done
+        self._futures: Dict[int, asyncio.Future] = {}
+
+        self._batches = 0
+        self._failures = 0
+        self._rotated = 0
+        self._busy_seconds = 0.0
+        self._last_batch_size = 0
+        self._last_rows_per_second = 0.0
+
+    async def start(self):
+        # bound to the running loop
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Rotate what is queued, then stop"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    async def rotate(self, id: int):
+        """Queue person id, returns when its batch has been written"""
+        future = self._futures.get(id)
+        if future is None:
+            future = self._futures[id] = asyncio.get_running_loop().create_future()
+            self._queue.put_nowait(id)
+        # shared by every caller of the same id
+        await asyncio.shield(future)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            ids = []
+            id = await self._queue.get()
+            while True:
+                if id is None:
+                    stopping = True
+                    break
+                ids.append(id)
+                if len(ids) >= self._batch_size or self._queue.empty():
+                    break
+                id = self._queue.get_nowait()
+            if ids:
+                await self._process(ids)
+
+    async def _process(self, ids: List[int]):
+        start = time.perf_counter()
+        error = None
+        try:
+            rotated = await self._rotate_fn(ids)
+        except Exception as e:
+            # dropped, the next reads of these rows queue them again
+            error = e
+            self._failures += 1
+            logger.exception(f"Rotating the subkeys of {len(ids)} persons failed")
+        else:
+            elapsed = time.perf_counter() - start
+            self._batches += 1
+            self._rotated += rotated
+            self._busy_seconds += elapsed
+            self._last_batch_size = len(ids)
+            self._last_rows_per_second = rotated / elapsed if elapsed else 0.0
+            logger.debug(f"rotated {rotated} of {len(ids)} subkeys in {elapsed:.3f}s")
+
+        for id in ids:
+            future = self._futures.pop(id)
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    def stats(self) -> dict:
+        return {
+            "backlog": len(self._futures),
+            "batch_size": self._batch_size,
+            "batches": self._batches,
+            "failures": self._failures,
+            "rotated": self._rotated,
+            "rows_per_second": (
+                self._rotated / self._busy_seconds if self._busy_seconds else 0.0
+            ),
+            "last_batch_size": self._last_batch_size,
+            "last_rows_per_second": self._last_rows_per_second,
+        }
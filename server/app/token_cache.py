@@ -0,0 +1,138 @@
+"""
+Verified access token cache.
+
+The frontend sends the same access token with every call of a page, and every
+call paid a full jwt.decode: base64, JSON, the HMAC and the claim checks. A token
+that verified is kept here, keyed by its SHA-256, with the user id and the exp
+claim, for at most maxsize tokens in LRU order. A hit skips the decode.
+
+An entry is served strictly before exp, the instant jwt.decode would start
+raising ExpiredSignatureError, and dropped from then on. Tokens without exp are
+verified every time. Tokens that fail verification are never cached. Logging
+out drops the tokens of the user.
+
+Tokens are stateless: a token dropped before its exp is still accepted, after
+decoding it again.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+import jwt
+
+# seconds between two sweeps of the expired entries
+SWEEP_INTERVAL = 60
+
+
+class TokenCache:
+    """
+    Only touched from the event loop, no lock needed. start and stop are called
+    by the app lifespan; maxsize 0 disables the cache, not the verification.
+    """
+
+    def __init__(self, secret: str, maxsize: int):
+        self._secret = secret
+        self._maxsize = maxsize
+        # SHA-256 of the token -> (user id, exp)
+        self._tokens: OrderedDict[bytes, Tuple[int, int]] = OrderedDict()
+        self._task: asyncio.Task | None = None
+
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._decodes = 0
+        self._decode_seconds = 0.0
+        self._rejected = 0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Drop every entry"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._tokens.clear()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            now = time.time()
+            for digest in [d for d, (_, exp) in self._tokens.items() if exp <= now]:
+                del self._tokens[digest]
+                self._expired += 1
+
+    def verify(self, token: str) -> int:
+        """
+        The user id of token. Raises jwt.ExpiredSignatureError or
+        jwt.InvalidTokenError like jwt.decode does
+        """
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        entry = self._tokens.get(digest)
+        if entry is not None and entry[1] <= time.time():
+            del self._tokens[digest]
+            self._expired += 1
+            entry = None
+        if entry is not None:
+            self._tokens.move_to_end(digest)
+            self._hits += 1
+            return entry[0]
+        self._misses += 1
+
+        start = time.perf_counter()
+        try:
+            decoded = jwt.decode(token, self._secret, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            self._rejected += 1
+            raise
+        finally:
+            self._decodes += 1
+            self._decode_seconds += time.perf_counter() - start
+
+        id = int(str(decoded["id"]))
+        # nbf is never set by create_token, such tokens are not worth caching
+        if self._maxsize > 0 and "exp" in decoded and "nbf" not in decoded:
+            self._tokens[digest] = (id, int(decoded["exp"]))
+            while len(self._tokens) > self._maxsize:
+                self._tokens.popitem(last=False)
+                self._evictions += 1
+        return id
+
+    def invalidate(self, token: str):
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        if self._tokens.pop(digest, None) is not None:
+            self._invalidations += 1
+
+    def invalidate_user(self, id: int):
+        """Drop every token of user id"""
+        for digest in [d for d, (user_id, _) in self._tokens.items() if user_id == id]:
+            del self._tokens[digest]
+            self._invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "size": len(self._tokens),
+            "maxsize": self._maxsize,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / lookups if lookups else 0.0,
+            "expired": self._expired,
+            "evictions": self._evictions,
+            "invalidations": self._invalidations,
+            "decodes": self._decodes,
+            "rejected": self._rejected,
+            "decode_seconds": self._decode_seconds,
+            "decode_microseconds": (
+                self._decode_seconds / self._decodes * 1e6 if self._decodes else 0.0
+            ),
+        }
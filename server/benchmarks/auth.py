@@ -0,0 +1,99 @@
+"""
+Requests/sec of the app behind its middleware stack, on the public /health/ and
+the authenticated GET /api/v1/persons/, called in process through httpx so the
+numbers leave out the HTTP parsing and the network.
+
+Needs the database of the server and signs up a benchmark user on first run.
+Run from server/: ./scripts/run_with_env.sh python -m benchmarks.auth
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from app.main import app
+
+EMAIL = "benchmark@example.com"
+PASSWORD = "benchmark"
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.auth")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=10,
+        help="requests in flight (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=5.0,
+        help="seconds to spend on each path (default: %(default)s)",
+    )
+    return parser.parse_args()
+
+
+async def _access_token(client: httpx.AsyncClient) -> str:
+    await client.post(
+        "/api/v1/persons/",
+        json={
+            "email": EMAIL,
+            "username": "benchmark",
+            "password": PASSWORD,
+            "gender": "female",
+            "city": "Hanoi",
+        },
+    )
+    response = await client.post(
+        "/api/v1/auth/login", json={"email": EMAIL, "password": PASSWORD}
+    )
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def _rate(
+    client: httpx.AsyncClient, path: str, headers: dict, concurrency: int, duration
+) -> float:
+    requests = 0
+    end = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal requests
+        while time.perf_counter() < end:
+            response = await client.get(path, headers=headers)
+            response.raise_for_status()
+            requests += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return requests / (time.perf_counter() - start)
+
+
+async def run(concurrency: int, duration: float):
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark"
+        ) as client:
+            token = await _access_token(client)
+            print(f"{'path':<20} {'requests/sec':>12}")
+            for path, headers in (
+                ("/health/", {}),
+                ("/api/v1/persons/", {"Authorization": f"Bearer {token}"}),
+            ):
+                # warm the caches first
+                await _rate(client, path, headers, concurrency, duration / 5)
+                rate = await _rate(client, path, headers, concurrency, duration)
+                print(f"{path:<20} {rate:12.0f}")
+
+
+def main():
+    args = _parse_args()
+    asyncio.run(run(args.concurrency, args.duration))
+
+
+if __name__ == "__main__":
+    main()
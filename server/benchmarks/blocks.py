@@ -0,0 +1,55 @@
+"""
+Blocks/sec of AES counter-block encryption: one encrypt() call per block (scalar)
+versus a single encrypt_blocks() call (multi-block, with and without NumPy).
+
+Run from server/: python -m benchmarks.blocks
+"""
+
+import secrets
+import time
+
+from app.crypto import cipher
+from app.crypto.cipher import AES
+
+
+def _rate(fn, n: int, min_time: float = 0.2) -> float:
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return runs * n / elapsed
+
+
+def main():
+    aes = AES(secrets.token_bytes(32))
+    counter_start = int.from_bytes(secrets.token_bytes(12), "big") << 32
+
+    def scalar(n):
+        encrypt = aes.encrypt
+        for i in range(n):
+            encrypt((counter_start | i).to_bytes(16, "big"))
+
+    def multi_block(n):
+        aes.encrypt_blocks(counter_start, n)
+
+    numpy = cipher.load_numpy()
+    print(
+        f"{'blocks':>8} {'scalar':>12} {'multi-block':>12} {'numpy':>12}  (blocks/sec)"
+    )
+    for n in (1, 4, 16, 64, 256, 1024, 4096):
+        cipher.np = None
+        scalar_rate = _rate(lambda: scalar(n), n)
+        multi_rate = _rate(lambda: multi_block(n), n)
+        cipher.np = numpy
+        if numpy is not None and n >= cipher.NUMPY_MIN_BLOCKS:
+            numpy_rate = f"{_rate(lambda: multi_block(n), n):12.0f}"
+        else:
+            numpy_rate = f"{'-':>12}"
+        print(f"{n:>8} {scalar_rate:12.0f} {multi_rate:12.0f} {numpy_rate}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Crypto micro-benchmarks.
+
+Run from server/:
+
+    python -m benchmarks.crypto                      # compare with the baseline
+    python -m benchmarks.crypto --save-baseline      # store this run as the baseline
+
+Exits with status 1 if a GCM test vector fails, there is no baseline yet or a
+metric dropped by more than --threshold percent against the baseline.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+
+from benchmarks.crypto.suite import DEFAULT_SIZES, check_vectors, run_suite
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.crypto")
+    parser.add_argument(
+        "--baseline",
+        default=DEFAULT_BASELINE,
+        help="baseline JSON to compare with (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="write the results to the baseline file instead of comparing",
+    )
+    parser.add_argument("--output", help="also write the results JSON to this file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=20.0,
+        help="allowed drop against the baseline in percent (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=DEFAULT_SIZES,
+        help="comma separated payload sizes in bytes (default: 1 B to 1 MB)",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="seconds to spend on each measurement (default: %(default)s)",
+    )
+    return parser.parse_args()
+
+
+def _compare(results: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    print(f"{'metric':<28} {'baseline':>14} {'current':>14} {'change':>8}")
+    for metric, current in results.items():
+        base = baseline.get(metric)
+        if not base:
+            print(f"{metric:<28} {'-':>14} {current:14.1f} {'new':>8}")
+            continue
+        change = (current - base) / base * 100
+        flag = ""
+        if change < -threshold:
+            regressions.append(metric)
+            flag = "  REGRESSION"
+        print(f"{metric:<28} {base:14.1f} {current:14.1f} {change:+7.1f}%{flag}")
+    return regressions
+
+
+def main() -> int:
+    args = _parse_args()
+
+    failures = check_vectors()
+    for failure in failures:
+        print(f"test vector failed: {failure}", file=sys.stderr)
+
+    results = run_suite(args.sizes, args.min_time)
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "sizes": args.sizes,
+            "vectors_failed": len(failures),
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 1 if failures else 0
+
+    if not os.path.exists(args.baseline):
+        # a run without a baseline checks nothing, it must not pass as one that did
+        print(json.dumps(report, indent=2))
+        print(
+            f"no baseline at {args.baseline}, run make bench_baseline (or "
+            f"--save-baseline) on this host first",
+            file=sys.stderr,
+        )
+        return 1
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = _compare(results, baseline, args.threshold)
+
+    if regressions:
+        print(
+            f"{len(regressions)} metric(s) dropped more than {args.threshold}%",
+            file=sys.stderr,
+        )
+    return 1 if failures or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
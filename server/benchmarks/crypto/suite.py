@@ -0,0 +1,156 @@
+"""
+Measurements and correctness checks for app.crypto.
+
+Every metric is a rate (higher is better), so a regression is a drop against the
+baseline.
+"""
+
+import secrets
+import time
+from typing import Callable, Dict, List
+
+from app.crypto import aead
+from app.crypto.aes.key_expander import KeyExpander
+from app.crypto.backend import available_backends, create_backend
+from app.crypto.cipher import AES
+from app.crypto.mode import GCMDecryptor, GCMEncryptor, GCMMode, GHASH
+from benchmarks.crypto.vectors import GCM_VECTORS
+
+DEFAULT_SIZES = [1, 16, 256, 4096, 65536, 1048576]
+
+
+def _rate(fn: Callable[[], object], min_time: float) -> float:
+    """Calls of fn per second, running it at least once and for at least min_time"""
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return runs / elapsed
+
+
+def bench_key_expansion(min_time: float) -> Dict[str, float]:
+    results = {}
+    for bits in (128, 192, 256):
+        expander = KeyExpander(bits)
+        key = list(secrets.token_bytes(bits // 8))
+        results[f"key_expansion.aes{bits}"] = _rate(
+            lambda: expander.expand_words(key), min_time
+        )
+
+    # A cipher cache miss: key schedule, H and the GHASH tables
+    key = secrets.token_bytes(32)
+    results["context_setup.aes256"] = _rate(lambda: AES(key).ghash, min_time)
+    return results
+
+
+def bench_blocks(min_time: float) -> Dict[str, float]:
+    results = {}
+    key = secrets.token_bytes(32)
+    block = secrets.token_bytes(16)
+    for engine in AES.engines:
+        aes = AES(key, engine)
+        results[f"block.encrypt.{engine}"] = _rate(lambda: aes.encrypt(block), min_time)
+        results[f"block.decrypt.{engine}"] = _rate(lambda: aes.decrypt(block), min_time)
+    return results
+
+
+def bench_ghash(sizes: List[int], min_time: float) -> Dict[str, float]:
+    results = {}
+    ghash = GHASH(int.from_bytes(secrets.token_bytes(16), "big"))
+    for size in sizes:
+        data = secrets.token_bytes(size)
+        results[f"ghash.{size}"] = size * _rate(
+            lambda: ghash.digest(b"", data), min_time
+        )
+    return results
+
+
+def bench_gcm(sizes: List[int], min_time: float) -> Dict[str, float]:
+    results = {}
+    aes = AES(secrets.token_bytes(32))
+    for size in sizes:
+        data = secrets.token_bytes(size)
+        sealed = aead.seal(aes, data)
+        results[f"gcm_seal.{size}"] = size * _rate(
+            lambda: aead.seal(aes, data), min_time
+        )
+        results[f"gcm_open.{size}"] = size * _rate(
+            lambda: aead.open_(aes, sealed), min_time
+        )
+    return results
+
+
+def run_suite(sizes: List[int], min_time: float) -> Dict[str, float]:
+    results = {}
+    results.update(bench_key_expansion(min_time))
+    results.update(bench_blocks(min_time))
+    results.update(bench_ghash(sizes, min_time))
+    results.update(bench_gcm(sizes, min_time))
+    return results
+
+
+def check_vectors() -> List[str]:
+    """
+    Run the GCM test vectors through every implementation.
+    Returns a description of each failure.
+    """
+    failures = []
+    for name, key, iv, plaintext, aad, ciphertext, tag in GCM_VECTORS:
+        key, iv, plaintext, aad = (
+            bytes.fromhex(key),
+            bytes.fromhex(iv),
+            bytes.fromhex(plaintext),
+            bytes.fromhex(aad),
+        )
+        expected = iv + bytes.fromhex(ciphertext) + bytes.fromhex(tag)
+
+        for engine in AES.engines:
+            aes = AES(key, engine)
+
+            c, t = GCMMode(aes, iv, aad).encrypt(plaintext)
+            if iv + c + t != expected:
+                failures.append(f"{name}: GCMMode encrypt ({engine} engine)")
+            try:
+                GCMMode(aes, iv, aad).decrypt(c, t)
+            except ValueError:
+                failures.append(f"{name}: GCMMode decrypt ({engine} engine)")
+
+            if aead.seal(aes, plaintext, aad, nonce=iv) != expected:
+                failures.append(f"{name}: aead.seal ({engine} engine)")
+            try:
+                if aead.open_(aes, expected, aad) != plaintext:
+                    raise ValueError()
+            except ValueError:
+                failures.append(f"{name}: aead.open_ ({engine} engine)")
+
+            encryptor = GCMEncryptor(aes, iv, aad)
+            streamed = encryptor.update(plaintext[:17]) + encryptor.update(
+                plaintext[17:]
+            )
+            if iv + streamed + encryptor.finalize() != expected:
+                failures.append(f"{name}: GCMEncryptor ({engine} engine)")
+            decryptor = GCMDecryptor(aes, iv, aad)
+            decryptor.update(expected[12:-16])
+            try:
+                if decryptor.finalize(expected[-16:]) != plaintext:
+                    raise ValueError()
+            except ValueError:
+                failures.append(f"{name}: GCMDecryptor ({engine} engine)")
+
+        if aad:
+            # backends seal without associated data
+            continue
+        for backend_name in available_backends():
+            backend = create_backend(backend_name)
+            if backend.seal(key, plaintext, iv) != expected:
+                failures.append(f"{name}: {backend_name} backend seal")
+            try:
+                if backend.open(key, expected) != plaintext:
+                    raise ValueError()
+            except ValueError:
+                failures.append(f"{name}: {backend_name} backend open")
+
+    return failures
@@ -0,0 +1,16 @@
+import pytest
+
+from app.db.repository import SQLiteRepository
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def repository():
+    repository = SQLiteRepository()
+    await repository.start()
+    yield repository
+    await repository.shutdown()
@@ -0,0 +1,167 @@
+import anyio
+import pytest
+
+from app.access_counter import AccessCounter
+
+pytestmark = pytest.mark.anyio
+
+
+class Recorder:
+    """The flush and rotate callbacks, writing the counts to the repository"""
+
+    def __init__(self, repository):
+        self.repository = repository
+        self.flushes = []
+        self.rotated = []
+        self.rotation_done = anyio.Event()
+        self.fail_flush = False
+
+    async def flush(self, rows):
+        if self.fail_flush:
+            raise ConnectionError("database gone")
+        self.flushes.append(rows)
+        await self.repository.update_decrypt_frequencies(
+            [
+                (id, wrapped_key, str(count).encode())
+                for id, _, wrapped_key, count in rows
+            ]
+        )
+
+    async def rotate(self, id: int):
+        self.rotated.append(id)
+        await self.rotation_done.wait()
+
+
+async def _person(repository, wrapped_key: bytes = b"wrapped") -> int:
+    await repository.insert_persons(
+        [("a@example.com", "a", "hash", b"", b"", b"", wrapped_key, 1, b"0")]
+    )
+    [row] = await repository.list_persons(0, 1)
+    return row["id"]
+
+
+async def _stored_count(repository, id: int) -> int:
+    return int((await repository.find_person(id))["decrypt_frequency"])
+
+
+@pytest.fixture
+def recorder(repository):
+    return Recorder(repository)
+
+
+@pytest.fixture
+async def counter(recorder):
+    counter = AccessCounter(
+        threshold=3,
+        flush=recorder.flush,
+        rotate=recorder.rotate,
+        flush_interval=60,
+        max_pending=100,
+    )
+    await counter.start()
+    yield counter
+    recorder.rotation_done.set()
+    await counter.stop()
+
+
+async def test_rotates_past_the_threshold(counter, recorder):
+    for _ in range(3):
+        counter.record(1, b"key", b"wrapped", 0)
+    await anyio.sleep(0)
+    assert recorder.rotated == []
+
+    counter.record(1, b"key", b"wrapped", 0)
+    await anyio.sleep(0)
+    assert recorder.rotated == [1]
+    assert counter.stats()["pending"] == 0
+
+    # reads during the rotation do not count, nor start another one
+    counter.record(1, b"key", b"wrapped", 0)
+    await anyio.sleep(0)
+    assert recorder.rotated == [1]
+    assert counter.stats()["rotating"] == 1
+
+    recorder.rotation_done.set()
+    await anyio.sleep(0)
+    assert counter.stats()["rotating"] == 0
+    assert counter.stats()["rotations"] == 1
+
+
+async def test_stored_count_counts_toward_the_threshold(counter, recorder):
+    counter.record(1, b"key", b"wrapped", 3)
+    await anyio.sleep(0)
+    assert recorder.rotated == [1]
+
+
+async def test_flush_on_stop(repository, counter, recorder):
+    id = await _person(repository)
+    counter.record(id, b"key", b"wrapped", 0)
+    counter.record(id, b"key", b"wrapped", 0)
+    assert counter.stats()["pending"] == 2
+
+    await counter.stop()
+    assert recorder.flushes == [[(id, b"key", b"wrapped", 2)]]
+    assert await _stored_count(repository, id) == 2
+    assert counter.stats()["pending"] == 0
+
+
+async def test_flush_adds_to_the_stored_count(repository, counter):
+    id = await _person(repository)
+    counter.record(id, b"key", b"wrapped", 0)
+    await counter.flush()
+    counter.record(id, b"key", b"wrapped", 1)
+    await counter.flush()
+    assert await _stored_count(repository, id) == 2
+
+
+async def test_new_subkey_restarts_the_count(repository, counter, recorder):
+    id = await _person(repository, b"new")
+    counter.record(id, b"old key", b"old", 0)
+    counter.record(id, b"old key", b"old", 0)
+    # the row was re-encrypted meanwhile, the counts under the old subkey are moot
+    counter.record(id, b"new key", b"new", 0)
+    await counter.flush()
+    assert recorder.flushes == [[(id, b"new key", b"new", 1)]]
+    assert await _stored_count(repository, id) == 1
+
+
+async def test_write_skipped_for_a_rotated_row(repository, counter):
+    id = await _person(repository, b"current")
+    counter.record(id, b"key", b"stale", 0)
+    await counter.flush()
+    # the update only applies to the subkey the count was sealed under
+    assert await _stored_count(repository, id) == 0
+
+
+async def test_failed_flush_keeps_the_counts(repository, counter, recorder):
+    id = await _person(repository)
+    recorder.fail_flush = True
+    counter.record(id, b"key", b"wrapped", 0)
+    await counter.flush()
+    assert counter.stats()["flush_failures"] == 1
+    assert counter.stats()["pending"] == 1
+
+    recorder.fail_flush = False
+    await counter.flush()
+    assert await _stored_count(repository, id) == 1
+
+
+async def test_max_pending_wakes_the_flush(repository):
+    recorder = Recorder(repository)
+    counter = AccessCounter(
+        threshold=100,
+        flush=recorder.flush,
+        rotate=recorder.rotate,
+        flush_interval=60,
+        max_pending=2,
+    )
+    await counter.start()
+    try:
+        counter.record(1, b"key", b"wrapped", 0)
+        counter.record(2, b"key", b"wrapped", 0)
+        with anyio.fail_after(5):
+            while not recorder.flushes:
+                await anyio.sleep(0.01)
+        assert len(recorder.flushes[0]) == 2
+    finally:
+        await counter.stop()
@@ -0,0 +1,322 @@
+import random
+
+import pytest
+
+from app.crypto import aead
+from app.crypto.backend import (
+    NativeBackend,
+    PythonBackend,
+    available_backends,
+    create_backend,
+    self_test,
+)
+from app.crypto.cipher import AES, NUMPY_MIN_BLOCKS
+from benchmarks.crypto.vectors import GCM_VECTORS
+from app.crypto.mode import (
+    GCMDecryptor,
+    GCMEncryptor,
+    GHASH,
+    GHASHStream,
+    gf_2_128_mul,
+)
+
+# FIPS-197 appendix C: (key, plaintext, ciphertext), all hex
+FIPS_197_VECTORS = [
+    (
+        "000102030405060708090a0b0c0d0e0f",
+        "00112233445566778899aabbccddeeff",
+        "69c4e0d86a7b0430d8cdb78070b4c55a",
+    ),
+    (
+        "000102030405060708090a0b0c0d0e0f1011121314151617",
+        "00112233445566778899aabbccddeeff",
+        "dda97ca4864cdfe06eaf70a0ec0d7191",
+    ),
+    (
+        "000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f",
+        "00112233445566778899aabbccddeeff",
+        "8ea2b7ca516745bfeafc49904b496089",
+    ),
+]
+
+
+@pytest.mark.parametrize("engine", AES.engines)
+@pytest.mark.parametrize("key, plaintext, ciphertext", FIPS_197_VECTORS)
+def test_aes_fips_197(engine, key, plaintext, ciphertext):
+    aes = AES(bytes.fromhex(key), engine=engine)
+    assert aes.encrypt(bytes.fromhex(plaintext)).hex() == ciphertext
+    assert aes.decrypt(bytes.fromhex(ciphertext)).hex() == plaintext
+
+
+def test_aes_rejects_bad_key_size():
+    with pytest.raises(ValueError):
+        AES(b"\x00" * 20)
+
+
+# GHASH
+
+
+def _ghash_reference(h: int, A: bytes, C: bytes) -> bytes:
+    """GHASH with explicit zero padding and the bit-serial multiplication"""
+    X = 0
+    for data in (A, C):
+        padded = data + b"\x00" * (-len(data) % 16)
+        for i in range(0, len(padded), 16):
+            X = gf_2_128_mul(X ^ int.from_bytes(padded[i : i + 16], "big"), h)
+    X = gf_2_128_mul(X ^ ((len(A) * 8) << 64) ^ (len(C) * 8), h)
+    return X.to_bytes(16, "big")
+
+
+@pytest.mark.parametrize("bits", [4, 8])
+def test_ghash_mul_matches_reference(bits):
+    rng = random.Random(bits)
+    for _ in range(20):
+        h = rng.getrandbits(128)
+        ghash = GHASH(h, bits)
+        for x in [0, 1, 1 << 127, (1 << 128) - 1] + [
+            rng.getrandbits(128) for _ in range(10)
+        ]:
+            assert ghash.mul(x) == gf_2_128_mul(x, h)
+
+
+@pytest.mark.parametrize("bits", [4, 8])
+@pytest.mark.parametrize("a_len, c_len", [(0, 0), (20, 0), (0, 1), (16, 33), (5, 47)])
+def test_ghash_digest_partial_blocks(bits, a_len, c_len):
+    rng = random.Random(a_len * 100 + c_len)
+    h = rng.getrandbits(128)
+    A = rng.randbytes(a_len)
+    C = rng.randbytes(c_len)
+    expected = _ghash_reference(h, A, C)
+    assert GHASH(h, bits).digest(A, C) == expected
+
+    stream = GHASHStream(GHASH(h, bits), A)
+    for i in range(0, c_len, 7):
+        stream.update(C[i : i + 7])
+    assert stream.digest() == expected
+
+
+def test_ghash_rejects_bad_width():
+    with pytest.raises(ValueError):
+        GHASH(1, 5)
+
+
+# record AES-GCM
+
+
+@pytest.mark.parametrize("engine", AES.engines)
+@pytest.mark.parametrize(
+    "name, key, iv, plaintext, aad, ciphertext, tag",
+    GCM_VECTORS,
+    ids=[vector[0] for vector in GCM_VECTORS],
+)
+def test_gcm_vectors(engine, name, key, iv, plaintext, aad, ciphertext, tag):
+    aes = AES(bytes.fromhex(key), engine=engine)
+    plaintext, aad = bytes.fromhex(plaintext), bytes.fromhex(aad)
+    sealed = aead.seal(aes, plaintext, aad, nonce=bytes.fromhex(iv))
+    assert sealed.hex() == iv + ciphertext + tag
+    assert aead.open_(aes, sealed, aad) == plaintext
+    assert aead.open_record(aes, {"field": sealed}, aad) == {"field": plaintext}
+
+
+@pytest.mark.parametrize("count, length", [(1, 0), (3, 10), (40, 20), (4, 300)])
+def test_seal_record_round_trip(count, length):
+    rng = random.Random(count * length)
+    aes = AES(rng.randbytes(32))
+    fields = {f"field{i}": rng.randbytes(length + i) for i in range(count)}
+
+    sealed = aead.seal_record(aes, fields, b"aad")
+    assert aead.open_record(aes, sealed, b"aad") == fields
+    # every field is a standalone nonce + ciphertext + tag
+    for name, value in fields.items():
+        assert len(sealed[name]) == aead.NONCE_SIZE + len(value) + aead.TAG_SIZE
+        assert aead.open_(aes, sealed[name], b"aad") == value
+    assert len({blob[: aead.NONCE_SIZE] for blob in sealed.values()}) == count
+
+
+def test_encrypt_counter_runs_matches_reference():
+    rng = random.Random(0)
+    key = rng.randbytes(16)
+    table, reference = AES(key, "table"), AES(key, "reference")
+    # below and above NUMPY_MIN_BLOCKS, and a counter wrapping around
+    for runs in [
+        [(rng.getrandbits(128), 3), (rng.getrandbits(128), 2)],
+        [(rng.getrandbits(128), 5) for _ in range(NUMPY_MIN_BLOCKS // 4)],
+        [((1 << 64) | 0xFFFFFFFE, 4)],
+    ]:
+        expected = b"".join(reference.encrypt_blocks(start, n) for start, n in runs)
+        assert table.encrypt_counter_runs(runs) == expected
+        assert reference.encrypt_counter_runs(runs) == expected
+
+
+@pytest.mark.parametrize("part", ["nonce", "ciphertext", "tag"])
+@pytest.mark.parametrize("field", ["first", "last"])
+def test_open_record_tampered(monkeypatch, part, field):
+    aes = AES(bytes(32))
+    sealed = aead.seal_record(aes, {"first": b"a" * 20, "last": b"b" * 40})
+    blob = bytearray(sealed[field])
+    offset = {"nonce": 0, "ciphertext": aead.NONCE_SIZE, "tag": -1}[part]
+    blob[offset] ^= 0x80
+    sealed[field] = bytes(blob)
+
+    # the tags are 16 bytes, a keystream XOR of a 20 or 40 byte field is a decrypt
+    xored = []
+    xor_bytes = aead.xor_bytes
+    monkeypatch.setattr(
+        aead,
+        "xor_bytes",
+        lambda data, key: xored.append(len(data)) or xor_bytes(data, key),
+    )
+    with pytest.raises(ValueError):
+        aead.open_record(aes, sealed)
+    assert set(xored) <= {16}
+
+
+def test_open_record_rejects_short_field():
+    with pytest.raises(ValueError):
+        aead.open_record(AES(bytes(16)), {"field": b"\x00" * 27})
+
+
+# backends
+
+BACKENDS = [
+    PythonBackend,
+    pytest.param(
+        NativeBackend,
+        marks=pytest.mark.skipif(
+            not NativeBackend.is_available(), reason="needs cryptography"
+        ),
+    ),
+]
+
+
+@pytest.mark.parametrize("backend_class", BACKENDS)
+def test_backend_round_trip(backend_class):
+    backend = backend_class()
+    key = bytes(range(32))
+    sealed = backend.seal(key, b"plaintext")
+    assert backend.open(key, sealed) == b"plaintext"
+
+    fields = {"gender": b"female", "city": b"Hanoi", "phone_number": b""}
+    assert backend.open_record(key, backend.seal_record(key, fields)) == fields
+
+    with pytest.raises(ValueError):
+        backend.open(bytes(32), sealed)
+    with pytest.raises(ValueError):
+        backend.open(key, sealed[:20])
+
+
+@pytest.mark.parametrize("backend_class", BACKENDS)
+@pytest.mark.parametrize(
+    "name, key, iv, plaintext, aad, ciphertext, tag",
+    [vector for vector in GCM_VECTORS if not vector[4]],
+    ids=[vector[0] for vector in GCM_VECTORS if not vector[4]],
+)
+def test_backend_gcm_vectors(
+    backend_class, name, key, iv, plaintext, aad, ciphertext, tag
+):
+    backend = backend_class()
+    sealed = backend.seal(
+        bytes.fromhex(key), bytes.fromhex(plaintext), bytes.fromhex(iv)
+    )
+    assert sealed.hex() == iv + ciphertext + tag
+
+
+@pytest.mark.skipif(not NativeBackend.is_available(), reason="needs cryptography")
+def test_backends_open_each_other():
+    python, native = PythonBackend(), NativeBackend()
+    key = bytes(range(16))
+    assert native.open(key, python.seal(key, b"python")) == b"python"
+    assert python.open(key, native.seal(key, b"native")) == b"native"
+
+
+@pytest.mark.parametrize("name", available_backends())
+def test_self_test(name):
+    self_test(create_backend(name))
+
+
+def test_self_test_catches_a_broken_backend():
+    class BrokenBackend(PythonBackend):
+        name = "broken"
+
+        def seal(self, key, plaintext, nonce=None):
+            return super().seal(key, plaintext + b"!", nonce)
+
+    with pytest.raises(RuntimeError):
+        self_test(BrokenBackend())
+
+
+def test_create_backend():
+    assert create_backend("python").name == "python"
+    assert create_backend("auto").name in available_backends()
+    with pytest.raises(ValueError):
+        create_backend("rot13")
+
+
+# streaming GCM
+
+
+def _chunks(data: bytes, sizes) -> list:
+    """data cut in chunks of the sizes in turn, split at odd offsets"""
+    chunks, i, n = [], 0, 0
+    while i < len(data):
+        size = sizes[n % len(sizes)]
+        chunks.append(data[i : i + size])
+        i += size
+        n += 1
+    return chunks
+
+
+SIZES = [[1], [7, 9], [15, 17, 3], [100]]
+
+
+@pytest.mark.parametrize("sizes", SIZES)
+def test_gcm_encryptor_matches_seal(sizes):
+    rng = random.Random(len(sizes))
+    aes = AES(rng.randbytes(16))
+    nonce, plaintext = rng.randbytes(12), rng.randbytes(101)
+    sealed = aead.seal(aes, plaintext, b"aad", nonce=nonce)
+
+    encryptor = GCMEncryptor(aes, nonce, b"aad")
+    ciphertext = b"".join(encryptor.update(c) for c in _chunks(plaintext, sizes))
+    assert nonce + ciphertext + encryptor.finalize() == sealed
+    with pytest.raises(ValueError):
+        encryptor.update(b"more")
+
+
+@pytest.mark.parametrize("unverified", [False, True])
+@pytest.mark.parametrize("sizes", SIZES)
+def test_gcm_decryptor(unverified, sizes):
+    rng = random.Random(len(sizes))
+    aes = AES(rng.randbytes(16))
+    plaintext = rng.randbytes(101)
+    sealed = aead.seal(aes, plaintext, b"aad")
+    nonce, ciphertext, tag = sealed[:12], sealed[12:-16], sealed[-16:]
+
+    decryptor = GCMDecryptor(aes, nonce, b"aad", unverified=unverified)
+    released = b"".join(decryptor.update(c) for c in _chunks(ciphertext, sizes))
+    # the buffered mode releases nothing before the tag is verified
+    assert released == (plaintext if unverified else b"")
+    assert released + decryptor.finalize(tag) == plaintext
+    with pytest.raises(ValueError):
+        decryptor.finalize(tag)
+
+
+@pytest.mark.parametrize("unverified", [False, True])
+@pytest.mark.parametrize("tamper", ["tag", "ciphertext", "aad"])
+def test_gcm_decryptor_bad_tag(unverified, tamper):
+    aes = AES(bytes(16))
+    sealed = aead.seal(aes, b"attack at dawn, bring snacks", b"aad")
+    nonce, ciphertext, tag = sealed[:12], bytearray(sealed[12:-16]), sealed[-16:]
+    aad = b"aad"
+    if tamper == "tag":
+        tag = bytes([tag[0] ^ 1]) + tag[1:]
+    elif tamper == "ciphertext":
+        ciphertext[5] ^= 1
+    else:
+        aad = b"aae"
+
+    decryptor = GCMDecryptor(aes, nonce, aad, unverified=unverified)
+    for chunk in _chunks(bytes(ciphertext), [5, 11]):
+        decryptor.update(chunk)
+    with pytest.raises(ValueError):
+        decryptor.finalize(tag)
@@ -0,0 +1,83 @@
+import pytest
+
+from app.db.migrations import MIGRATIONS_DIR, load_migrations, split_statements
+
+pytestmark = pytest.mark.anyio
+
+
+def test_split_statements():
+    sql = """
+-- a comment; not a statement
+ALTER TABLE person ADD COLUMN a INT;
+
+  -- another
+ALTER TABLE person
+    ADD COLUMN b INT;
+"""
+    assert split_statements(sql) == [
+        "ALTER TABLE person ADD COLUMN a INT",
+        "ALTER TABLE person\n    ADD COLUMN b INT",
+    ]
+    assert split_statements("-- nothing\n") == []
+
+
+def test_load_migrations_of_the_repo():
+    migrations = load_migrations()
+    versions = [version for version, _, _ in migrations]
+    assert versions == sorted(versions)
+    assert versions == list(range(1, len(versions) + 1))
+    assert all(statements for _, _, statements in migrations)
+
+    # a database created from init.sql has them all
+    with open(f"{MIGRATIONS_DIR}/../init.sql") as f:
+        init = f.read()
+    for version, name, _ in migrations:
+        assert f"({version}, '{name}')" in init
+
+
+def test_load_migrations_in_version_order(tmp_path):
+    (tmp_path / "0010_later.sql").write_text("SELECT 10;")
+    (tmp_path / "0002_sooner.sql").write_text("SELECT 2;")
+    assert load_migrations(str(tmp_path)) == [
+        (2, "sooner", ["SELECT 2"]),
+        (10, "later", ["SELECT 10"]),
+    ]
+
+
+@pytest.mark.parametrize(
+    "file_names",
+    [["notes.txt"], ["0001_a.sql", "1_b.sql"], ["first.sql"]],
+)
+def test_load_migrations_rejects(tmp_path, file_names):
+    for file_name in file_names:
+        (tmp_path / file_name).write_text("SELECT 1;")
+    with pytest.raises(ValueError):
+        load_migrations(str(tmp_path))
+
+
+async def test_apply_migration(repository):
+    assert await repository.applied_migrations() == []
+
+    await repository.apply_migration(
+        2,
+        "person_nickname",
+        [
+            "ALTER TABLE person ADD COLUMN nickname VARCHAR(50)",
+            "UPDATE person SET nickname = username",
+        ],
+    )
+    await repository.apply_migration(1, "noop", [])
+    assert await repository.applied_migrations() == [1, 2]
+    assert (
+        await repository._run(repository._fetchall, "SELECT nickname FROM person") == []
+    )
+
+
+async def test_failed_migration_is_not_recorded(repository):
+    with pytest.raises(Exception):
+        await repository.apply_migration(1, "broken", ["ALTER TABLE nope ADD x INT"])
+    assert await repository.applied_migrations() == []
+    # recorded twice is refused by the primary key
+    await repository.apply_migration(1, "fixed", [])
+    with pytest.raises(repository.integrity_error):
+        await repository.apply_migration(1, "fixed", [])
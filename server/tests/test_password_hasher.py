@@ -0,0 +1,142 @@
+import anyio
+import pytest
+
+from app.password_hasher import PasswordHasher, PasswordHasherBusy, hash_rounds
+
+pytestmark = pytest.mark.anyio
+
+
+class StubExecutor:
+    """The bcrypt jobs of the crypto executor, held until gate is set"""
+
+    def __init__(self):
+        self.gate = anyio.Event()
+        self.gate.set()
+        self.started = 0
+
+    async def hash_password(self, password: bytes, rounds: int) -> bytes:
+        self.started += 1
+        await self.gate.wait()
+        return b"$2b$%02d$" % rounds + password
+
+    async def hash_passwords(self, passwords, rounds: int):
+        self.started += 1
+        await self.gate.wait()
+        return [b"$2b$%02d$" % rounds + password for password in passwords]
+
+    async def check_password(self, password: bytes, hashed: bytes) -> bool:
+        self.started += 1
+        await self.gate.wait()
+        return hashed.endswith(b"$" + password)
+
+
+@pytest.fixture
+def executor():
+    return StubExecutor()
+
+
+@pytest.fixture
+async def hasher(executor):
+    hasher = PasswordHasher(
+        executor, rounds=12, target_ms=250, concurrency=1, max_waiting=1
+    )
+    # the calibration runs through the open gate
+    await hasher.start()
+    executor.gate = anyio.Event()
+    executor.started = 0
+    return hasher
+
+
+async def test_hash_and_check(hasher, executor):
+    executor.gate.set()
+    hashed = await hasher.hash(b"secret")
+    assert hashed == b"$2b$12$secret"
+    assert await hasher.check(b"secret", hashed)
+    assert not await hasher.check(b"other", hashed)
+    assert hasher.stats()["hashes"] == 1
+    assert hasher.stats()["checks"] == 2
+
+
+async def test_rejects_past_the_waiter_limit(hasher, executor):
+    results = []
+
+    async def hash():
+        results.append(await hasher.hash(b"secret"))
+
+    async with anyio.create_task_group() as tg:
+        # one runs, one waits for the slot
+        tg.start_soon(hash)
+        tg.start_soon(hash)
+        await anyio.wait_all_tasks_blocked()
+        assert hasher.stats()["running"] == 1
+        assert hasher.stats()["waiting"] == 1
+
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.hash(b"secret")
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.check(b"secret", b"$2b$12$secret")
+        assert hasher.stats()["rejected"] == 2
+        assert executor.started == 1
+
+        executor.gate.set()
+
+    assert len(results) == 2
+    assert hasher.stats()["running"] == 0
+    assert hasher.stats()["waiting"] == 0
+    assert hasher.stats()["max_waiting_seen"] == 1
+    # a slot freed up, accepted again
+    assert await hasher.hash(b"secret") == b"$2b$12$secret"
+
+
+async def test_hash_many_is_never_rejected(hasher, executor):
+    results = []
+
+    async def hash():
+        results.append(await hasher.hash(b"secret"))
+
+    async def hash_many():
+        results.append(await hasher.hash_many([b"a", b"b"]))
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(hash)
+        tg.start_soon(hash)
+        await anyio.wait_all_tasks_blocked()
+        # the limit is reached, the batches queue behind it
+        for _ in range(3):
+            tg.start_soon(hash_many)
+        await anyio.wait_all_tasks_blocked()
+        assert hasher.stats()["waiting"] == 4
+        assert hasher.stats()["rejected"] == 0
+
+        executor.gate.set()
+
+    assert results.count([b"$2b$12$a", b"$2b$12$b"]) == 3
+    assert hasher.stats()["hashes"] == 2 + 3 * 2
+    assert hasher.stats()["max_waiting_seen"] == 4
+
+
+async def test_needs_rehash_only_below_the_current_cost(hasher):
+    assert hasher.needs_rehash(b"$2b$10$abcdefghijklmnopqrstuv")
+    assert hasher.needs_rehash(b"$2b$11$abcdefghijklmnopqrstuv")
+    assert not hasher.needs_rehash(b"$2b$12$abcdefghijklmnopqrstuv")
+    assert not hasher.needs_rehash(b"$2b$13$abcdefghijklmnopqrstuv")
+    # not a bcrypt hash, nothing to compare
+    assert not hasher.needs_rehash(b"plain")
+
+
+async def test_rehash_is_counted(hasher, executor):
+    executor.gate.set()
+    assert await hasher.rehash(b"secret") == b"$2b$12$secret"
+    assert hasher.stats()["rehashes"] == 1
+    assert hasher.stats()["hashes"] == 1
+
+
+def test_hash_rounds():
+    assert hash_rounds(b"$2b$12$abcdefghijklmnopqrstuv") == 12
+    assert hash_rounds(b"$2a$04$abcdefghijklmnopqrstuv") == 4
+    assert hash_rounds(b"$2y$31$abcdefghijklmnopqrstuv") == 31
+    assert hash_rounds(b"") is None
+    assert hash_rounds(b"plain") is None
+    assert hash_rounds(b"$2b$xx$abcdefghijklmnopqrstuv") is None
+    assert hash_rounds(b"$2b$12$salt$extra") is None
+    assert hash_rounds(b"$2b$12") is None
@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+
+from app.db.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self, number: int):
+        self.number = number
+        self.connected = True
+        self.broken = False
+        self.closed = False
+        self.rollbacks = 0
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def reconnect(self, attempts: int = 1):
+        if self.broken:
+            raise ConnectionError("server gone")
+        self.connected = True
+
+    def rollback(self):
+        if self.broken:
+            raise ConnectionError("server gone")
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnect:
+    def __init__(self):
+        self.connections = []
+
+    def __call__(self) -> FakeConnection:
+        connection = FakeConnection(len(self.connections))
+        self.connections.append(connection)
+        return connection
+
+
+def make_pool(min_size=1, max_size=2, acquire_timeout=0.05):
+    connect = FakeConnect()
+    pool = ConnectionPool(connect, min_size, max_size, acquire_timeout)
+    pool.open()
+    return pool, connect
+
+
+def test_open_creates_min_size_connections():
+    pool, connect = make_pool(min_size=2, max_size=4)
+    assert len(connect.connections) == 2
+    assert pool.stats()["idle"] == 2
+
+
+def test_invalid_sizes():
+    with pytest.raises(ValueError):
+        ConnectionPool(FakeConnect(), 3, 2, 1)
+
+
+def test_released_connection_is_reused_and_rolled_back():
+    pool, connect = make_pool()
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert first.rollbacks == 2
+    assert len(connect.connections) == 1
+
+
+def test_grows_to_max_size_then_times_out():
+    pool, connect = make_pool(min_size=0, max_size=2)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    stats = pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["in_use"] == 2
+    assert stats["size"] == 2
+
+
+def test_waiter_gets_the_released_connection():
+    pool, _ = make_pool(min_size=1, max_size=1, acquire_timeout=5)
+    held = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    pool.release(held)
+    waiter.join(5)
+    assert acquired == [held]
+
+
+def test_dead_connection_is_reconnected():
+    pool, connect = make_pool()
+    connect.connections[0].connected = False
+    with pool.connection() as connection:
+        assert connection is connect.connections[0]
+        assert connection.connected
+    assert pool.stats()["reconnects"] == 1
+
+
+def test_unreachable_connection_is_replaced():
+    pool, connect = make_pool()
+    dead = connect.connections[0]
+    dead.connected = False
+    dead.broken = True
+    with pool.connection() as connection:
+        assert connection is not dead
+    assert dead.closed
+    assert pool.stats()["size"] == 1
+
+
+def test_connection_broken_on_release_is_dropped():
+    pool, _ = make_pool()
+    with pool.connection() as connection:
+        connection.broken = True
+    assert connection.closed
+    assert pool.stats()["size"] == 0
+    with pool.connection() as replacement:
+        assert replacement is not connection
+
+
+def test_closed_pool_refuses_and_reopens():
+    pool, connect = make_pool()
+    pool.close()
+    assert connect.connections[0].closed
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+    pool.open()
+    with pool.connection():
+        pass
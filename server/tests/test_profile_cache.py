@@ -0,0 +1,127 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import profile_cache as profile_cache_module
+from app.profile_cache import ProfileCache
+
+FIELDS = {"gender": "female", "city": "Hanoi", "phone_number": "0123"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # only the cache's clock, the event loop keeps the real one
+    monkeypatch.setattr(profile_cache_module, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def test_hit_and_miss(clock):
+    cache = ProfileCache(maxsize=4, ttl=30)
+    assert cache.get(1, b"wrapped") is None
+    cache.put(1, b"wrapped", b"subkey", FIELDS)
+    assert cache.get(1, b"wrapped") == (b"subkey", FIELDS)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_ttl_expiry(clock):
+    cache = ProfileCache(maxsize=4, ttl=30)
+    cache.put(1, b"wrapped", b"subkey", FIELDS)
+    profile = cache._profiles[1]
+
+    clock.now += 29.9
+    assert cache.get(1, b"wrapped") is not None
+    clock.now += 0.1
+    assert cache.get(1, b"wrapped") is None
+    assert cache.stats()["expired"] == 1
+    assert profile.private_key == bytearray(6)
+
+
+def test_stale_wrapped_key(clock):
+    cache = ProfileCache(maxsize=4, ttl=30)
+    cache.put(1, b"old", b"subkey", FIELDS)
+    profile = cache._profiles[1]
+
+    # the row was re-encrypted: the entry is dropped, not served
+    assert cache.get(1, b"new") is None
+    assert cache.stats()["stale"] == 1
+    assert cache.get(1, b"old") is None
+    assert profile.private_key == bytearray(6)
+
+
+def test_lru_eviction_zeroizes(clock):
+    cache = ProfileCache(maxsize=2, ttl=30)
+    cache.put(1, b"w1", b"subkey1", FIELDS)
+    cache.put(2, b"w2", b"subkey2", FIELDS)
+    evicted = cache._profiles[2]
+    # 1 was used last, so 2 goes
+    assert cache.get(1, b"w1") is not None
+    cache.put(3, b"w3", b"subkey3", FIELDS)
+
+    assert cache.get(2, b"w2") is None
+    assert cache.get(1, b"w1") is not None
+    assert cache.get(3, b"w3") is not None
+    assert cache.stats()["evictions"] == 1
+    assert evicted.private_key == bytearray(7)
+    assert all(value == bytearray(len(value)) for value in evicted.fields.values())
+
+
+def test_invalidate_and_clear_zeroize(clock):
+    cache = ProfileCache(maxsize=4, ttl=30)
+    cache.put(1, b"w1", b"subkey1", FIELDS)
+    cache.put(2, b"w2", b"subkey2", FIELDS)
+    first, second = cache._profiles[1], cache._profiles[2]
+
+    cache.invalidate([1, 5])
+    assert cache.stats()["invalidations"] == 1
+    assert cache.get(1, b"w1") is None
+    assert first.private_key == bytearray(7)
+
+    cache.clear()
+    assert cache.stats()["size"] == 0
+    assert second.fields["city"] == bytearray(5)
+
+
+def test_put_replaces_and_zeroizes(clock):
+    cache = ProfileCache(maxsize=4, ttl=30)
+    cache.put(1, b"old", b"subkey1", FIELDS)
+    old = cache._profiles[1]
+    cache.put(1, b"new", b"subkey2", FIELDS)
+    assert old.private_key == bytearray(7)
+    assert cache.get(1, b"new") == (b"subkey2", FIELDS)
+
+
+def test_returned_values_are_copies(clock):
+    cache = ProfileCache(maxsize=4, ttl=30)
+    cache.put(1, b"wrapped", b"subkey", FIELDS)
+    subkey, fields = cache.get(1, b"wrapped")
+    cache.clear()
+    assert subkey == b"subkey"
+    assert fields == FIELDS
+
+
+def test_disabled(clock):
+    cache = ProfileCache(maxsize=0, ttl=30)
+    cache.put(1, b"wrapped", b"subkey", FIELDS)
+    assert cache.get(1, b"wrapped") is None
+    assert cache.stats()["size"] == 0
+
+
+@pytest.mark.anyio
+async def test_stop_drops_every_entry(clock):
+    cache = ProfileCache(maxsize=4, ttl=30)
+    await cache.start()
+    cache.put(1, b"wrapped", b"subkey", FIELDS)
+    profile = cache._profiles[1]
+    await cache.stop()
+    assert cache.stats()["size"] == 0
+    assert profile.private_key == bytearray(6)
@@ -0,0 +1,309 @@
+import secrets
+from typing import Dict, List
+
+import anyio
+import pytest
+
+from app.crypto.backend import create_backend
+from app.db.repository import MASKED_PERSON_COLUMNS, SQLiteRepository
+
+pytestmark = pytest.mark.anyio
+
+MASTER_KEY = bytes(range(32))
+
+
+def _person(i: int, private_key: bytes = b"key", key_version: int = 1) -> tuple:
+    return (
+        f"{i}@example.com",
+        f"user{i}",
+        "hash",
+        b"gender",
+        b"city",
+        b"phone",
+        private_key,
+        key_version,
+        b"0",
+    )
+
+
+async def _insert(repository: SQLiteRepository, count: int) -> List[int]:
+    assert all(await repository.insert_persons([_person(i) for i in range(count)]))
+    rows = await repository.list_persons(0, count)
+    return [row["id"] for row in rows]
+
+
+async def _collect(batches) -> List[List]:
+    return [batch async for batch in batches]
+
+
+# keyset pagination
+
+
+async def test_list_persons_pages_by_id(repository):
+    ids = await _insert(repository, 7)
+
+    first = await repository.list_persons(0, 3)
+    second = await repository.list_persons(first[-1]["id"], 3)
+    last = await repository.list_persons(second[-1]["id"], 3)
+
+    assert [row["id"] for row in first + second + last] == ids
+    assert len(last) == 1
+    assert await repository.list_persons(ids[-1], 3) == []
+
+
+async def test_insert_persons_skips_taken_usernames(repository):
+    await _insert(repository, 2)
+    inserted = await repository.insert_persons([_person(1), _person(2)])
+    assert inserted == [False, True]
+
+
+async def test_iter_person_batches(repository):
+    ids = await _insert(repository, 25)
+
+    batches = await _collect(repository.iter_person_batches(batch_size=10))
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert [row["id"] for batch in batches for row in batch] == ids
+
+    batches = await _collect(
+        repository.iter_person_batches(ids[4], limit=12, batch_size=5)
+    )
+    assert [len(batch) for batch in batches] == [5, 5, 2]
+    assert [row["id"] for batch in batches for row in batch] == ids[5:17]
+
+
+async def test_iter_person_batches_exact_multiple(repository):
+    await _insert(repository, 20)
+    batches = await _collect(repository.iter_person_batches(batch_size=10))
+    assert [len(batch) for batch in batches] == [10, 10]
+
+
+async def test_iter_person_batches_sees_rows_inserted_meanwhile(repository):
+    await _insert(repository, 4)
+    seen = []
+    async for batch in repository.iter_person_batches(batch_size=2):
+        seen.extend(row["id"] for row in batch)
+        if len(seen) == 2:
+            await repository.insert_persons([_person(100)])
+    assert len(seen) == 5
+
+
+async def test_export_persons_tuples(repository):
+    ids = await _insert(repository, 5)
+    batches = await _collect(repository.export_persons(2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    rows = [row for batch in batches for row in batch]
+    assert [row[0] for row in rows] == ids
+    assert all(len(row) == len(MASKED_PERSON_COLUMNS) for row in rows)
+    assert rows[0][1:3] == ("0@example.com", "user0")
+
+
+async def test_batches_release_the_connection(repository):
+    await _insert(repository, 6)
+    async for batch in repository.iter_person_batches(batch_size=2):
+        # the single SQLite connection is free while a batch is consumed
+        assert await repository.find_person(batch[0]["id"]) is not None
+
+
+# refresh token rotation
+
+
+async def test_rotate_refresh_token(repository):
+    [person_id] = await _insert(repository, 1)
+    await repository.insert_refresh_token(person_id, b"old", expires_at=200)
+
+    assert await repository.rotate_refresh_token(person_id, b"old", b"new", 300, 100)
+    # the old token is used up, the new one replaces it
+    assert not await repository.rotate_refresh_token(
+        person_id, b"old", b"other", 300, 100
+    )
+    assert await repository.rotate_refresh_token(person_id, b"new", b"next", 400, 100)
+
+
+async def test_rotate_refresh_token_concurrently(repository):
+    [person_id] = await _insert(repository, 1)
+    await repository.insert_refresh_token(person_id, b"old", expires_at=200)
+
+    results: Dict[bytes, bool] = {}
+
+    async def rotate(digest: bytes):
+        results[digest] = await repository.rotate_refresh_token(
+            person_id, b"old", digest, 300, 100
+        )
+
+    async with anyio.create_task_group() as tasks:
+        for digest in (b"a", b"b", b"c", b"d"):
+            tasks.start_soon(rotate, digest)
+
+    winners = [digest for digest, rotated in results.items() if rotated]
+    assert len(winners) == 1
+    # only the winner's token was stored
+    for digest in results:
+        assert (
+            await repository.rotate_refresh_token(
+                person_id, digest, b"x" + digest, 300, 100
+            )
+        ) == (digest in winners)
+
+
+async def test_rotate_refresh_token_rejects_expired_and_foreign(repository):
+    first, second = await _insert(repository, 2)
+    await repository.insert_refresh_token(first, b"token", expires_at=100)
+
+    assert not await repository.rotate_refresh_token(second, b"token", b"new", 300, 50)
+    assert not await repository.rotate_refresh_token(first, b"token", b"new", 300, 100)
+    # a failed rotation stores nothing
+    assert not await repository.rotate_refresh_token(first, b"new", b"next", 300, 50)
+
+
+async def test_rotate_refresh_token_rolls_back_on_taken_digest(repository):
+    [person_id] = await _insert(repository, 1)
+    await repository.insert_refresh_token(person_id, b"old", expires_at=200)
+    await repository.insert_refresh_token(person_id, b"taken", expires_at=200)
+
+    with pytest.raises(repository.integrity_error):
+        await repository.rotate_refresh_token(person_id, b"old", b"taken", 300, 100)
+    # the delete of the old token was rolled back with the failed insert
+    assert await repository.rotate_refresh_token(person_id, b"old", b"new", 300, 100)
+
+
+async def test_delete_expired_refresh_tokens(repository):
+    [person_id] = await _insert(repository, 1)
+    for i in range(5):
+        await repository.insert_refresh_token(person_id, bytes([i]), expires_at=i)
+
+    assert await repository.delete_expired_refresh_tokens(3, limit=2) == 2
+    assert await repository.delete_expired_refresh_tokens(3, limit=2) == 2
+    assert await repository.delete_expired_refresh_tokens(3, limit=2) == 0
+    assert await repository.rotate_refresh_token(person_id, bytes([4]), b"new", 9, 3)
+
+
+# rekeying
+
+
+def _sealed_person(backend, i: int) -> tuple:
+    subkey = secrets.token_bytes(32)
+    fields = backend.seal_record(
+        subkey,
+        {
+            "gender": b"female",
+            "city": f"city{i}".encode(),
+            "phone_number": b"0123",
+            "decrypt_frequency": b"7",
+        },
+    )
+    return (
+        f"{i}@example.com",
+        f"user{i}",
+        "hash",
+        fields["gender"],
+        fields["city"],
+        fields["phone_number"],
+        backend.seal(MASTER_KEY, subkey.hex().encode()),
+        1,
+        fields["decrypt_frequency"],
+    )
+
+
+def _open_person(backend, row: dict, master_key: bytes) -> Dict[str, bytes]:
+    subkey = bytes.fromhex(backend.open(master_key, row["private_key"]).decode())
+    return backend.open_record(
+        subkey,
+        {
+            name: row[name]
+            for name in ("gender", "city", "phone_number", "decrypt_frequency")
+        },
+    )
+
+
+async def test_rotate_person_keys(repository):
+    backend = create_backend("auto")
+    await repository.insert_persons([_sealed_person(backend, i) for i in range(3)])
+    rows = await repository.list_persons(0, 3)
+
+    rekeyed = backend.rekey_records(
+        MASTER_KEY,
+        [
+            (
+                row["private_key"],
+                {name: row[name] for name in ("gender", "city", "phone_number")},
+            )
+            for row in rows
+        ],
+        reset={"decrypt_frequency": b"0"},
+    )
+    written = [
+        (row["id"], row["private_key"], private_key, 1, fields)
+        for row, (_, private_key, fields) in zip(rows, rekeyed)
+    ]
+    assert await repository.rotate_person_keys(written) == 3
+
+    for i, row in enumerate(await repository.list_persons(0, 3)):
+        assert row["private_key"] == rekeyed[i][1]
+        assert _open_person(backend, row, MASTER_KEY) == {
+            "gender": b"female",
+            "city": f"city{i}".encode(),
+            "phone_number": b"0123",
+            "decrypt_frequency": b"0",
+        }
+
+    # the old private keys no longer match, running the batch again is harmless
+    assert await repository.rotate_person_keys(written) == 0
+
+
+async def test_rewrap_person_keys(repository):
+    backend = create_backend("auto")
+    new_master_key = bytes(range(32, 64))
+    await repository.insert_persons([_sealed_person(backend, i) for i in range(5)])
+
+    rows = await repository.list_wrapped_keys(0, 3, exclude_version=2)
+    assert [row["id"] for row in rows] == [1, 2, 3]
+    rows += await repository.list_wrapped_keys(rows[-1]["id"], 3, exclude_version=2)
+    assert len(rows) == 5
+
+    written = [
+        (
+            row["id"],
+            row["private_key"],
+            backend.seal(new_master_key, backend.open(MASTER_KEY, row["private_key"])),
+            2,
+        )
+        for row in rows
+    ]
+    # a row rotated meanwhile is skipped
+    written[0] = (written[0][0], b"stale", written[0][2], 2)
+    assert await repository.rewrap_person_keys(written) == 4
+
+    assert [row["id"] for row in await repository.list_wrapped_keys(0, 10, 2)] == [1]
+    for row in await repository.list_persons(1, 10):
+        assert row["key_version"] == 2
+        assert _open_person(backend, row, new_master_key)["decrypt_frequency"] == b"7"
+
+
+async def test_rekey_records_skips_a_bad_record(repository):
+    backend = create_backend("python")
+    sealing = create_backend("python")
+    await repository.insert_persons([_sealed_person(sealing, i) for i in range(3)])
+    rows = await repository.list_persons(0, 3)
+    records = [
+        (
+            row["private_key"],
+            {name: row[name] for name in ("gender", "city", "phone_number")},
+        )
+        for row in rows
+    ]
+    # a flipped bit in the tag of one field of the second record
+    city = bytearray(records[1][1]["city"])
+    city[-1] ^= 1
+    records[1][1]["city"] = bytes(city)
+    old_key = bytes.fromhex(backend.open(MASTER_KEY, rows[1]["private_key"]).decode())
+    backend.open(old_key, records[1][1]["gender"])
+    assert backend.cipher_cache.stats()["size"] == 2
+
+    rekeyed = backend.rekey_records(MASTER_KEY, records)
+    assert rekeyed[1] is None
+    assert [result[0] for result in (rekeyed[0], rekeyed[2])] == [
+        bytes.fromhex(backend.open(MASTER_KEY, row["private_key"]).decode())
+        for row in (rows[0], rows[2])
+    ]
+    # only the master key is left, the subkeys of the bad record too are gone
+    assert backend.cipher_cache.stats()["size"] == 1
@@ -0,0 +1,129 @@
+import time
+from types import SimpleNamespace
+
+import jwt
+import pytest
+
+from app import token_cache as token_cache_module
+from app.token_cache import TokenCache
+
+SECRET = "secret"
+
+
+def _token(id: int, exp: int | None = None, secret: str = SECRET, **claims) -> str:
+    payload = {"id": id, **claims}
+    if exp is not None:
+        payload["exp"] = exp
+    return jwt.encode(payload, secret, algorithm="HS256")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # only the cache's clock, jwt.decode checks exp against the real time
+    clock = SimpleNamespace(now=time.time())
+    monkeypatch.setattr(
+        token_cache_module,
+        "time",
+        SimpleNamespace(time=lambda: clock.now, perf_counter=time.perf_counter),
+    )
+    return clock
+
+
+def test_hit_skips_the_decode(clock):
+    cache = TokenCache(SECRET, maxsize=4)
+    token = _token(7, exp=int(clock.now) + 100)
+
+    assert cache.verify(token) == 7
+    assert cache.verify(token) == 7
+    assert cache.verify(token) == 7
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["decodes"]) == (2, 1, 1)
+    assert stats["size"] == 1
+
+
+def test_entry_rejected_exactly_at_exp(clock):
+    cache = TokenCache(SECRET, maxsize=4)
+    exp = int(clock.now) + 100
+    token = _token(7, exp=exp)
+    cache.verify(token)
+
+    clock.now = exp - 0.001
+    cache.verify(token)
+    assert cache.stats()["hits"] == 1
+
+    # not served from the cache from exp on: decoded again
+    clock.now = exp
+    cache.verify(token)
+    stats = cache.stats()
+    assert (stats["hits"], stats["expired"], stats["decodes"]) == (1, 1, 2)
+
+
+def test_rejected_tokens_are_not_cached(clock):
+    cache = TokenCache(SECRET, maxsize=4)
+    expired = _token(7, exp=int(time.time()) - 10)
+    forged = _token(7, exp=int(clock.now) + 100, secret="other")
+
+    for _ in range(2):
+        with pytest.raises(jwt.ExpiredSignatureError):
+            cache.verify(expired)
+        with pytest.raises(jwt.InvalidTokenError):
+            cache.verify(forged)
+    stats = cache.stats()
+    assert (stats["size"], stats["rejected"], stats["decodes"]) == (0, 4, 4)
+
+
+def test_tokens_without_exp_are_not_cached(clock):
+    cache = TokenCache(SECRET, maxsize=4)
+    token = _token(7)
+    assert cache.verify(token) == 7
+    assert cache.verify(token) == 7
+    assert cache.stats()["decodes"] == 2
+    assert cache.stats()["size"] == 0
+
+
+def test_invalidate(clock):
+    cache = TokenCache(SECRET, maxsize=4)
+    exp = int(clock.now) + 100
+    first, second = _token(7, exp=exp), _token(7, exp=exp, jti="2")
+    other = _token(8, exp=exp)
+    for token in (first, second, other):
+        cache.verify(token)
+
+    cache.invalidate(first)
+    assert cache.stats()["size"] == 2
+    cache.invalidate_user(7)
+    assert cache.stats()["size"] == 1
+    assert cache.stats()["invalidations"] == 2
+
+    # dropped tokens are still valid, they are decoded again
+    decodes = cache.stats()["decodes"]
+    assert cache.verify(second) == 7
+    assert cache.verify(other) == 8
+    assert cache.stats()["decodes"] == decodes + 1
+
+
+def test_lru_eviction(clock):
+    cache = TokenCache(SECRET, maxsize=2)
+    exp = int(clock.now) + 100
+    tokens = [_token(id, exp=exp) for id in range(3)]
+    cache.verify(tokens[0])
+    cache.verify(tokens[1])
+    cache.verify(tokens[0])
+    cache.verify(tokens[2])
+
+    assert cache.stats()["evictions"] == 1
+    decodes = cache.stats()["decodes"]
+    cache.verify(tokens[0])
+    assert cache.stats()["decodes"] == decodes
+    cache.verify(tokens[1])
+    assert cache.stats()["decodes"] == decodes + 1
+
+
+def test_disabled_still_verifies(clock):
+    cache = TokenCache(SECRET, maxsize=0)
+    token = _token(7, exp=int(clock.now) + 100)
+    assert cache.verify(token) == 7
+    assert cache.verify(token) == 7
+    assert cache.stats()["decodes"] == 2
+    with pytest.raises(jwt.InvalidTokenError):
+        cache.verify("not a token")